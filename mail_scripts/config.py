@@ -8,3 +8,5 @@ ENDPOINT = os.getenv("DORMDIGEST_ENDPOINT") # production server
 ENDPOINT_DEV = os.getenv("DORMDIGEST_ENDPOINT_DEV") # development server
 WEBHOOK_URL = os.getenv("DORMDIGEST_WEBHOOK") # Mattermost webhook URL
 TOKEN = os.getenv("DORMDIGEST_TOKEN")
+SPOOL_DIR = os.getenv("DORMDIGEST_SPOOL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool")) # emails waiting to be delivered
+GZIP = os.getenv("DORMDIGEST_GZIP") == "1" # gzip emails sent to the backends
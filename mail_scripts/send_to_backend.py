@@ -1,23 +1,62 @@
+"""
+Forwards the emails received by procmail to the dormdigest backends.
+
+An email read from stdin is first spooled to disk (atomically, so that it can
+never be lost or read half-written), then the spool is drained: every spooled
+email is posted to every configured endpoint, concurrently, over one
+keep-alive connection per endpoint. Each endpoint keeps its own delivery
+state, so a slow or broken backend never holds up the others. Failed
+deliveries are retried with an exponential backoff, the next time the spool
+is drained. When an endpoint has a backlog, emails are sent to it in batches
+(as an mbox file to `/eat_batch`).
+
+Usage:
+
+  python3 send_to_backend.py < email   # spool the email, then drain the spool
+  python3 send_to_backend.py --drain   # only drain the spool (e.g. from cron)
+"""
 import sys
 import os
 import json
-from urllib import request, error
+import time
+import errno
+import fcntl
+import gzip
+import random
+import http.client
+from urllib import request, parse
 from datetime import datetime
-#from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from config import (
   ENDPOINT,
   ENDPOINT_DEV,
   WEBHOOK_URL,
   TOKEN,
+  SPOOL_DIR,
+  GZIP,
 )
 
 OPERATING = True
 
 _headers = {"Content-Type": "application/json"}
 
-def save_last_email(email):
-  filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S.txt")
+# endpoints to deliver every email to, by name
+ENDPOINTS = {name: url for name, url in (("dev", ENDPOINT_DEV), ("prod", ENDPOINT)) if url}
+
+TIMEOUT = 60 # seconds
+BACKOFF = 60 # seconds before the first retry, doubled after each failure
+MAX_BACKOFF = 6 * 60 * 60
+NOTIFY_AFTER = 3 # failed attempts before posting to Mattermost
+BATCH_THRESHOLD = 5 # send batches to an endpoint once this many emails are due
+BATCH_SIZE = 50
+
+# statuses after which retrying the same email would not help
+# (unlike e.g. 403 or 404, which mean the forwarder or the backend is misconfigured)
+PERMANENT_ERRORS = (400, 413, 415, 422)
+
+def save_last_email(email, suffix=""):
+  filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + suffix + ".txt"
   filepath = "./saved/" + filename
   with open(filepath, "w") as f:
     f.write(email + "\n")
@@ -25,40 +64,286 @@ def save_last_email(email):
   link = "mail_scripts/saved/" + filename
   return link
 
-def send_error_to_mattermost(http_error):
-  link = save_last_email(email)
-
+def send_to_mattermost(text):
   if WEBHOOK_URL is None:
       return
 
-  text = "**{}**: {}\n\nEmail was saved to: {}".format(http_error.code, http_error.reason, link)
   data = {"text": text}
-
   req = request.Request(WEBHOOK_URL, data=json.dumps(data).encode(), headers=_headers, method="POST")
-  request.urlopen(req)
+  try:
+    request.urlopen(req, timeout=TIMEOUT)
+  except OSError:
+    pass # never lose an email over a notification
 
-def pass_to_api(email, endpoint, *, save=True):
-  if endpoint is None or TOKEN is None:
-    return
+## Spool
+
+def spool_path(*parts):
+  return os.path.join(SPOOL_DIR, *parts)
 
-  payload = {
-    "email": email,
-    "token": TOKEN,
-  }
-  req = request.Request(endpoint, data=json.dumps(payload).encode(), headers=_headers, method="POST")
+def make_dirs():
+  for name in ("tmp", "new", "state"):
+    os.makedirs(spool_path(name), exist_ok=True)
+  for name in ENDPOINTS:
+    os.makedirs(spool_path("state", name), exist_ok=True)
 
+def write_atomically(path, data):
+  tmp = spool_path("tmp", "{}.{}".format(os.path.basename(path), os.getpid()))
+  with open(tmp, "wb") as f:
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, path)
+
+def spool(email):
+  """Spool a raw email (bytes), and return its id
+  """
+  make_dirs()
+  # ids sort in the order the emails were received
+  email_id = "{}-{}-{:08x}".format(time.time_ns(), os.getpid(), random.getrandbits(32))
+  write_atomically(spool_path("new", email_id + ".eml"), email)
+  return email_id
+
+def spooled_ids():
+  return sorted(name[:-len(".eml")] for name in os.listdir(spool_path("new")) if name.endswith(".eml"))
+
+def read_email(email_id):
+  with open(spool_path("new", email_id + ".eml"), "rb") as f:
+    return f.read()
+
+def read_state(name, email_id):
   try:
-    response = request.urlopen(req)
-    if response.status in (200, 201):
-      if save: save_last_email(email)
-  except error.HTTPError as e:
-    send_error_to_mattermost(e)
-    return False
+    with open(spool_path("state", name, email_id + ".json")) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return {"delivered": False, "gave_up": False, "attempts": 0, "next_attempt": 0, "error": None}
+
+def write_state(name, email_id, state):
+  write_atomically(spool_path("state", name, email_id + ".json"), json.dumps(state).encode())
+
+def is_settled(state):
+  return state["delivered"] or state["gave_up"]
+
+def settle(email_id):
+  """Move an email delivered to (or given up on by) every endpoint out of the spool
+  """
+  email = read_email(email_id)
+  save_last_email(email.decode("utf-8", errors="replace"), suffix="_" + email_id.rsplit("-", 1)[-1])
+  os.remove(spool_path("new", email_id + ".eml"))
+  for name in ENDPOINTS:
+    try:
+      os.remove(spool_path("state", name, email_id + ".json"))
+    except FileNotFoundError:
+      pass
+
+## Delivery
+
+class Connection:
+  """Keep-alive HTTP(S) connection to a single host
+  """
+
+  def __init__(self, url):
+    self.url = parse.urlsplit(url)
+    self.conn = None
+
+  def post(self, path, body, headers):
+    """Post `body` to `path`, and return the response status, headers and body
+    """
+    for attempt in range(2):
+      if self.conn is None:
+        cls = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+        self.conn = cls(self.url.netloc, timeout=TIMEOUT)
+      try:
+        self.conn.request("POST", path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        return response.status, response.headers, response.read()
+      except (http.client.HTTPException, OSError):
+        self.close()
+        if attempt: raise # else the server closed the kept-alive connection, reconnect once
+
+  def close(self):
+    if self.conn is not None:
+      self.conn.close()
+      self.conn = None
+
+class DeliveryError(Exception):
+  def __init__(self, message, permanent=False, retry_after=None):
+    super().__init__(message)
+    self.permanent = permanent
+    self.retry_after = retry_after
+
+def check_response(status, headers, body):
+  if status in (200, 201, 202):
+    return
+  retry_after = headers.get("Retry-After")
+  message = "{}: {}".format(status, body[:500].decode("utf-8", errors="replace"))
+  raise DeliveryError(
+    message,
+    permanent=status in PERMANENT_ERRORS,
+    retry_after=int(retry_after) if retry_after and retry_after.isdigit() else None,
+  )
+
+class Endpoint:
+  """Delivers spooled emails to one backend, keeping track of each delivery
+  """
+
+  def __init__(self, name, url):
+    self.name = name
+    self.url = url # URL of `/eat`
+    self.connection = Connection(url)
+    self.batches = True # whether the endpoint accepts batches
+
+  def path(self, suffix=""):
+    url = parse.urlsplit(self.url)
+    return url.path.rstrip("/") + suffix + ("?" + url.query if url.query else "")
+
+  def post_email(self, email):
+    headers = {"Content-Type": "message/rfc822", "X-API-Token": TOKEN}
+    if GZIP:
+      email = gzip.compress(email)
+      headers["Content-Type"] = "application/gzip"
+    check_response(*self.connection.post(self.path("/raw"), email, headers))
+
+  def post_batch(self, emails):
+    """Post emails as an mbox file, and return the report of each email
+    """
+    mbox = b"".join(to_mbox(email) for email in emails)
+    headers = {"Content-Type": "application/mbox", "X-API-Token": TOKEN}
+    status, headers, body = self.connection.post(self.path("_batch"), mbox, headers)
+    check_response(status, headers, body)
+    return json.loads(body)["emails"]
+
+  def due(self, now):
+    """Ids of the spooled emails that should be (re)tried now
+    """
+    due = []
+    for email_id in spooled_ids():
+      state = read_state(self.name, email_id)
+      if not is_settled(state) and state["next_attempt"] <= now:
+        due.append((email_id, state))
+    return due
+
+  def record(self, email_id, state, error=None):
+    if error is None:
+      state.update(delivered=True, error=None)
+    else:
+      state["attempts"] += 1
+      state["error"] = str(error)
+      if getattr(error, "permanent", False):
+        state["gave_up"] = True
+      else:
+        delay = min(BACKOFF * 2 ** (state["attempts"] - 1), MAX_BACKOFF)
+        delay = max(delay, getattr(error, "retry_after", None) or 0)
+        state["next_attempt"] = time.time() + delay
+      if state["gave_up"] or state["attempts"] == NOTIFY_AFTER:
+        send_to_mattermost("**{}** failed to deliver `{}` ({} attempts): {}\n\nEmail is spooled in: mail_scripts/spool/new/".format(
+          self.name, email_id, state["attempts"], error,
+        ))
+    write_state(self.name, email_id, state)
+
+  def drain(self):
+    """Deliver every due email, until there are none or the endpoint fails
+
+    Returns the number of emails delivered
+    """
+    delivered = 0
+    try:
+      while True:
+        due = self.due(time.time())
+        if not due:
+          return delivered
+        if len(due) >= BATCH_THRESHOLD and self.batches:
+          delivered += self.deliver_batch(due[:BATCH_SIZE])
+        else:
+          for email_id, state in due:
+            self.deliver(email_id, state)
+            delivered += 1
+    except DeliveryError as e:
+      if e.permanent: raise
+      return delivered # the endpoint is down or overloaded, leave the rest for later
+    finally:
+      self.connection.close()
+
+  def deliver(self, email_id, state):
+    try:
+      self.post_email(read_email(email_id))
+    except (DeliveryError, http.client.HTTPException, OSError) as e:
+      self.record(email_id, state, e)
+      if not isinstance(e, DeliveryError) or not e.permanent:
+        raise DeliveryError(str(e))
+    else:
+      self.record(email_id, state)
+
+  def deliver_batch(self, due):
+    try:
+      reports = self.post_batch([read_email(email_id) for email_id, _ in due])
+    except DeliveryError as e:
+      if not e.permanent: raise
+      self.batches = False # e.g. an older backend, deliver the emails one by one
+      return 0
+    except (http.client.HTTPException, OSError) as e:
+      for email_id, state in due:
+        self.record(email_id, state, e)
+      raise DeliveryError(str(e))
+
+    by_index = {report.get("index"): report for report in reports}
+    if len(reports) != len(due) or set(by_index) != set(range(len(due))):
+      # the backend split the mbox file into other emails (e.g. it dropped an empty
+      # one), so no report can be trusted to be about the email at its index:
+      # retry every email of the batch, one by one
+      self.batches = False
+      send_to_mattermost("**{}** sent {} reports for a batch of {} emails, retrying them one by one".format(
+        self.name, len(reports), len(due),
+      ))
+      return 0
+
+    delivered = 0
+    for index, (email_id, state) in enumerate(due):
+      report = by_index[index]
+      if report["status"] != "error":
+        self.record(email_id, state)
+        delivered += 1
+      elif report.get("permanent"):
+        # e.g. emails the backend could not parse would fail the same way again
+        self.record(email_id, state)
+        send_to_mattermost("**{}** could not ingest `{}`: {}".format(self.name, email_id, report.get("error")))
+      else:
+        # e.g. the database was busy, retried like a failed delivery
+        self.record(email_id, state, DeliveryError(report.get("error")))
+    return delivered
+
+def to_mbox(email):
+  lines = email.split(b"\n")
+  escaped = (b">" + line if line.lstrip(b">").startswith(b"From ") else line for line in lines)
+  return b"From dormdigest\n" + b"\n".join(escaped).rstrip(b"\n") + b"\n\n"
+
+def drain():
+  """Deliver the spooled emails to every endpoint concurrently, unless another
+  process is already draining the spool
+  """
+  make_dirs()
+  with open(spool_path("drain.lock"), "w") as lock:
+    try:
+      fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as e:
+      if e.errno in (errno.EAGAIN, errno.EACCES):
+        return # the other process will deliver our email too
+      raise
+
+    endpoints = [Endpoint(name, url) for name, url in ENDPOINTS.items()]
+    with ThreadPoolExecutor(max_workers=max(len(endpoints), 1)) as pool:
+      for endpoint, future in [(endpoint, pool.submit(endpoint.drain)) for endpoint in endpoints]:
+        try:
+          future.result()
+        except Exception as e:
+          send_to_mattermost("**{}** failed to drain the spool: {}".format(endpoint.name, e))
 
-  return True
+    for email_id in spooled_ids():
+      if ENDPOINTS and all(is_settled(read_state(name, email_id)) for name in ENDPOINTS):
+        settle(email_id)
 
 if __name__ == "__main__":
   if OPERATING:
-    email = sys.stdin.read()
-    success = pass_to_api(email, ENDPOINT_DEV, save=True)
-    if success: pass_to_api(email, ENDPOINT, save=False)
+    if "--drain" not in sys.argv[1:]:
+      spool(sys.stdin.buffer.read())
+    if TOKEN:
+      drain()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark small writes (like `/eat` queueing an email, or `/create_session`)
+from many threads of a server process: each thread committing on its own, or
+sending its writes to the writer of the process (`db/writer.py`), which
+groups them in transactions.
+
+For each number of threads, prints the writes per second, the median and
+99th percentile latency of a write, and the number of commits.
+
+To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_db_writer.py [path/to/directory/]
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import configs.server_configs as config
+import db.db_operations as db_operations
+import db.writer as db_writer
+from db.schema import SQLBase, configure_connections
+
+THREADS = (1, 4, 16, 64)
+DURATION = 3 # seconds
+
+def direct(session, raw):
+    return db_operations.enqueue_email(session, raw)
+
+def grouped(session, raw):
+    return db_writer.write(session, db_operations.enqueue_email, raw)
+
+def measure(engine, write, threads):
+    Session = sqlalchemy.orm.sessionmaker(bind=engine)
+    commits = [0]
+    def count_commit(conn):
+        commits[0] += 1
+    sqlalchemy.event.listen(engine, "commit", count_commit)
+
+    stop = threading.Event()
+    latencies = [[] for _ in range(threads)]
+    def run(thread):
+        session = Session()
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            write(session, f"email {thread}-{i}")
+            latencies[thread].append(time.perf_counter() - start)
+            i += 1
+        session.close()
+    workers = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    time.sleep(DURATION)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    sqlalchemy.event.remove(engine, "commit", count_commit)
+    latencies = [latency for thread in latencies for latency in thread]
+    return latencies, commits[0]
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"{'mode':<8} {'threads':>7} {'writes/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'commits':>8}")
+    for mode, write in (("direct", direct), ("writer", grouped)):
+        for threads in THREADS:
+            with tempfile.TemporaryDirectory(dir=directory) as tmp:
+                engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+                configure_connections(engine)
+                SQLBase.metadata.create_all(engine)
+                latencies, commits = measure(engine, write, threads)
+                quantiles = statistics.quantiles(latencies, n=100)
+                print(f"{mode:<8} {threads:>7} {len(latencies) / DURATION:>9.0f}"
+                      f" {quantiles[49] * 1e3:>9.2f} {quantiles[98] * 1e3:>9.2f} {commits:>8}")
+                engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the storage of event descriptions: as text (like before
+`db/descriptions.py`), and compressed with zlib at a few levels.
+
+A file-backed database is filled with a month of events, whose descriptions
+are the plaintext and HTML of the emails in `src/test_emails` (or of the
+`.txt` emails in the given directory). For each way of storing them, prints
+the size of the database file (after a VACUUM), the bytes of the
+descriptions, the time to compress a description, and the time to read the
+descriptions of the events of a day (like `/get_events_by_date`).
+
+To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_descriptions.py [path/to/emails/]
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import datetime
+import email
+import email.policy
+import os
+import statistics
+import tempfile
+import time
+from unittest import mock
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import configs.server_configs as config
+import db.db_operations as db_operations
+from db import descriptions, migrations
+from db.schema import SQLBase, Event, EventDescription, EventDescriptionType, EMAIL_DESCRIPTION_CHUNK_SIZE
+
+TEST_EMAILS = Path(__file__).parent.parent / "test_emails"
+EVENTS = 600
+READS = 200
+LEVELS = (1, 6, 9)
+
+def load_descriptions(directory):
+    """Return the (plaintext, html) of the emails in `directory`
+    """
+    corpus = []
+    for path in sorted(Path(directory).glob("*.txt")):
+        message = email.message_from_bytes(path.read_bytes(), policy=email.policy.default)
+        plaintext, html = message.get_body(("plain",)), message.get_body(("html",))
+        corpus.append((
+            plaintext.get_content() if plaintext else "",
+            html.get_content() if html else "",
+        ))
+    return corpus
+
+def add_text_descriptions(session, event_id, plaintext, html):
+    """Store descriptions as text chunks, like `add_event_description` used to
+    """
+    for content_type, text in ((EventDescriptionType.PLAINTEXT, plaintext), (EventDescriptionType.HTML, html)):
+        for content_index, i in enumerate(range(0, len(text), EMAIL_DESCRIPTION_CHUNK_SIZE)):
+            session.add(EventDescription(event_id, content_type.value, content_index, text[i:i+EMAIL_DESCRIPTION_CHUNK_SIZE]))
+
+def fill(engine, corpus, compressed):
+    session = sqlalchemy.orm.sessionmaker(bind=engine)()
+    user_id = db_operations.add_user(session, "username@mit.edu")
+    for i in range(EVENTS):
+        plaintext, html = corpus[i % len(corpus)]
+        # every email is a little different
+        plaintext, html = f"{plaintext}\n{i}", f"{html}<p>{i}</p>"
+        event_id = db_operations.add_event(
+            session, f"Event {i}", user_id, None, [], start_date=datetime.date(2023, 2, 1 + i % 28), commit=False,
+        )
+        if compressed:
+            db_operations.add_event_description(session, event_id, plaintext, html, commit=False)
+        else:
+            add_text_descriptions(session, event_id, plaintext, html)
+    session.commit()
+    session.close()
+    engine.execute("VACUUM")
+
+def read_day(engine):
+    """Return the latencies of reading the descriptions of the events of a day
+    """
+    session = sqlalchemy.orm.sessionmaker(bind=engine)()
+    events = session.query(Event).filter(Event.start_date == datetime.date(2023, 2, 3)).all()
+    latencies = []
+    for _ in range(READS):
+        start = time.perf_counter()
+        db_operations.get_event_descriptions(session, events, EventDescriptionType.PLAINTEXT)
+        db_operations.get_event_descriptions(session, events, EventDescriptionType.HTML)
+        latencies.append(time.perf_counter() - start)
+    session.close()
+    return latencies, len(events)
+
+def compress_time(corpus):
+    start = time.perf_counter()
+    for plaintext, html in corpus:
+        descriptions.compress_description(plaintext)
+        descriptions.compress_description(html)
+    return (time.perf_counter() - start) / (2 * len(corpus))
+
+def main():
+    corpus = load_descriptions(sys.argv[1] if len(sys.argv) > 1 else TEST_EMAILS)
+    size = sum(len(plaintext.encode()) + len(html.encode()) for plaintext, html in corpus) / len(corpus)
+    print(f"{len(corpus)} emails, {size / 1e3:.1f} kB of descriptions per email on average")
+    print(f"{'storage':<8} {'file (kB)':>10} {'descriptions (kB)':>18} {'compress (ms)':>14} {'read a day (ms)':>16}")
+    db_operations.is_redis_alive = False # time the database, not the cache
+    for storage, level in [("text", None), *((f"zlib-{level}", level) for level in LEVELS)]:
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(config, "DESCRIPTION_COMPRESSION_LEVEL", level or 6):
+            path = os.path.join(tmp, "bench.db")
+            engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+            SQLBase.metadata.create_all(engine)
+            migrations.upgrade(engine)
+            fill(engine, corpus, compressed=level is not None)
+            with engine.connect() as connection:
+                text_bytes, compressed_bytes = descriptions.description_sizes(connection)
+            latencies, events = read_day(engine)
+            compress = f"{compress_time(corpus) * 1e3:.2f}" if level else "-"
+            print(f"{storage:<8} {os.path.getsize(path) / 1e3:>10.0f} {(text_bytes + compressed_bytes) / 1e3:>18.0f}"
+                  f" {compress:>14} {statistics.median(latencies) * 1e3:>16.2f}")
+            engine.dispose()
+    print(f"(reading the descriptions of the {events} events of a day)")
+
+if __name__ == "__main__":
+    main()
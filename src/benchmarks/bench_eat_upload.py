@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the cost of uploading an email to `/eat` (JSON-embedded string)
+against `/eat/raw` (raw MIME body, optionally gzipped).
+
+For each way, measures the bytes sent, and the CPU time spent by the
+forwarder to encode the email and by the server to get it back as a string
+(validating `EmailModel`, or decompressing the body like `read_raw_email`).
+
+To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_eat_upload.py
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import gzip
+import json
+import timeit
+import zlib
+
+from bench_ingest_latency import make_email
+from ingest_batch import decode_email
+from main import EmailModel
+
+TEST_EMAILS = Path(__file__).parent.parent / "test_emails"
+NUMBER = 20
+CHUNK_SIZE = 1 << 16 # bytes per chunk of the request body, as received by the server
+
+def send_json(raw: str) -> bytes:
+    return json.dumps({"email": raw, "token": "token"}).encode()
+
+def receive_json(body: bytes) -> str:
+    return EmailModel.parse_raw(body).email
+
+def send_raw(raw: str) -> bytes:
+    return raw.encode()
+
+def receive_raw(body: bytes) -> str:
+    chunks = [body[i:i+CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)]
+    return decode_email(b"".join(chunks))
+
+def send_gzip(raw: str) -> bytes:
+    return gzip.compress(raw.encode(), compresslevel=6)
+
+def receive_gzip(body: bytes) -> str:
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    chunks = [decompressor.decompress(body[i:i+CHUNK_SIZE]) for i in range(0, len(body), CHUNK_SIZE)]
+    return decode_email(b"".join(chunks))
+
+WAYS = {
+    "/eat (json)": (send_json, receive_json),
+    "/eat/raw": (send_raw, receive_raw),
+    "/eat/raw (gzip)": (send_gzip, receive_gzip),
+}
+
+def main():
+    emails = {path.name: path.read_text() for path in sorted(TEST_EMAILS.glob("*.txt"))}
+    emails["flyer (generated)"] = make_email()
+
+    for name, raw in emails.items():
+        print(f"{name}: {len(raw.encode()) / 1e3:.0f} kB")
+        print(f"  {'endpoint':<16} {'sent (kB)':>10} {'send (ms)':>10} {'receive (ms)':>13}")
+        for way, (send, receive) in WAYS.items():
+            body = send(raw)
+            assert receive(body) == raw
+            send_time = timeit.timeit(lambda: send(raw), number=NUMBER) / NUMBER
+            receive_time = timeit.timeit(lambda: receive(body), number=NUMBER) / NUMBER
+            print(f"  {way:<16} {len(body) / 1e3:>10.0f} {send_time * 1e3:>10.2f} {receive_time * 1e3:>13.2f}")
+
+if __name__ == "__main__":
+    main()
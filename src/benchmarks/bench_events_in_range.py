@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the pages of `/get_events_in_range` (`db_operations.get_events_in_range`)
+on a file-backed database of a year of events.
+
+Pages are read from the key of the last event of the previous page (keyset
+pagination), and, for comparison, with an OFFSET (like paging the same
+query with `LIMIT ... OFFSET ...` would). Prints the latency of the first
+and deeper pages of each.
+
+To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_events_in_range.py [number of events]
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import db.db_operations as db_operations
+from db import migrations
+from db.schema import SQLBase, Event, configure_connections
+
+EVENTS = 100_000
+BATCH_SIZE = 5000
+PAGE_SIZE = 50
+PAGES = (0, 10, 100, 1000)
+REPEATS = 20
+FROM_DATE, TO_DATE = datetime.date(2023, 1, 1), datetime.date(2023, 12, 31)
+
+def new_events(start, count):
+    return [
+        db_operations.NewEvent(
+            title=f"Event {i}", description="", event_tags=[i % 10],
+            start_date=FROM_DATE + datetime.timedelta(days=i % 365),
+            start_time=datetime.time(8 + i % 12, 15 * (i % 4)), sender=f"user{i % 1000}@mit.edu",
+        )
+        for i in range(start, start + count)
+    ]
+
+def offset_page(session, page):
+    return session.query(Event).filter(
+        Event.start_date.between(FROM_DATE, TO_DATE)
+    ).order_by(*db_operations.EVENT_PAGE_ORDER).limit(PAGE_SIZE).offset(page * PAGE_SIZE).all()
+
+def timed(function):
+    latencies = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else EVENTS
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        configure_connections(engine)
+        SQLBase.metadata.create_all(engine)
+        migrations.upgrade(engine)
+        session = sqlalchemy.orm.sessionmaker(bind=engine)()
+        for i in range(0, events, BATCH_SIZE):
+            db_operations.add_events(session, new_events(i, min(BATCH_SIZE, events - i)))
+
+        # keys of the last event before each page
+        keys, after = {}, None
+        for page in range(max(PAGES) + 1):
+            keys[page] = after
+            page_events = db_operations.get_events_in_range(session, FROM_DATE, TO_DATE, limit=PAGE_SIZE, after=after)
+            if not page_events:
+                break
+            after = db_operations.event_page_key(page_events[-1])
+            session.expunge_all()
+
+        print(f"{events} events, pages of {PAGE_SIZE}")
+        print(f"{'page':>6} {'keyset (ms)':>12} {'offset (ms)':>12}")
+        for page in PAGES:
+            if page not in keys:
+                break
+            keyset = timed(lambda: (db_operations.get_events_in_range(session, FROM_DATE, TO_DATE, limit=PAGE_SIZE, after=keys[page]), session.expunge_all()))
+            offset = timed(lambda: (offset_page(session, page), session.expunge_all()))
+            print(f"{page:>6} {keyset * 1e3:>12.2f} {offset * 1e3:>12.2f}")
+        session.close()
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
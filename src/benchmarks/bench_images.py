@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the compression of the images inserted in emails, over a corpus of
+sample flyers (JPEG photos, HEIC photos from phones, and PNG posters).
+
+Compares the previous pipeline (a fully decoded image, resized to a single
+500px-wide PNG) with the current one (see `compress_pending_image`: draft
+decoding, and WebP or AVIF versions at each of `COMPRESSED_IMAGE_WIDTHS`).
+
+For each image and pipeline, prints the CPU time spent compressing it, the
+bytes of its default (500px-wide) version in the preferred format, which is
+what an event page serves on most screens, and the bytes of all its versions.
+
+The corpus is generated, unless a directory of sample flyers is given. To
+use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_images.py [path/to/flyers/]
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import os
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import utils.email_parser as email_parser
+
+NUMBER = 3
+
+def make_photo(size) -> Image.Image:
+    """A photo-like image: smooth shapes, with some sensor noise
+    """
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for i in range(12):
+        x, y = size[0] * i // 12, size[1] * (i * 7 % 12) // 12
+        draw.ellipse((x, y, x + size[0] // 4, y + size[1] // 4), fill=(40 * i % 256, 90, 255 - 20 * i))
+    image = image.filter(ImageFilter.GaussianBlur(8))
+    noise = Image.effect_noise(size, 12).convert("RGB")
+    return Image.blend(image, noise, 0.15)
+
+def make_poster(size) -> Image.Image:
+    """A poster-like image: flat colors and text
+    """
+    image = Image.new("RGB", size, (250, 240, 200))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size[1], 120):
+        draw.rectangle((40, i + 20, size[0] - 40, i + 60), fill=(30, 60 + i % 150, 120))
+        draw.text((60, i + 80), "STUDY BREAK - FREE FOOD - LOBBY 10 - FRIDAY 7PM", fill=(0, 0, 0))
+    return image
+
+def make_corpus() -> dict:
+    corpus = {}
+    for name, image, format in (
+        ("photo.jpg", make_photo((4032, 3024)), "JPEG"),
+        ("photo.heic", make_photo((4032, 3024)), "HEIF"),
+        ("poster.png", make_poster((1700, 2200)), "PNG"),
+        ("small.png", make_poster((400, 300)), "PNG"),
+    ):
+        buffer = BytesIO()
+        image.save(buffer, format=format, **({"quality": 90} if format != "PNG" else {}))
+        corpus[name] = buffer.getvalue()
+    return corpus
+
+def legacy_compress(data: bytes, images: str) -> dict:
+    """The previous pipeline, returning the bytes of each (the only) version,
+    by format and width
+    """
+    img = Image.open(BytesIO(data))
+    wpercent = (500/float(img.size[0]))
+    hsize = int((float(img.size[1])*float(wpercent)))
+    img = img.resize((500,hsize), Image.Resampling.LANCZOS)
+    path = os.path.join(images, "legacy.png")
+    img.save(path, optimize=True, quality=80, format='PNG')
+    return {("png", 500): os.path.getsize(path)}
+
+def compress(formats):
+    def compress(data: bytes, images: str) -> dict:
+        email_parser.IMAGE_FORMATS = formats
+        email_parser.LOCAL_IMAGE_PATH = images + "/"
+        pending_path = os.path.join(images, "pending", "image")
+        with open(pending_path, "wb") as f:
+            f.write(data)
+        sizes = {}
+        for path in email_parser.compress_pending_image(pending_path):
+            width, format = path.rsplit("_", 1)[1].split("w.")
+            sizes[format, int(width)] = os.path.getsize(path)
+            os.remove(path) # else the next run would find it and skip compressing
+        return sizes
+    return compress
+
+PIPELINES = {
+    "png (legacy)": legacy_compress,
+    "webp": compress(("webp",)),
+    "avif+webp": compress(("avif", "webp")),
+}
+
+def main():
+    if len(sys.argv) > 1:
+        corpus = {path.name: path.read_bytes() for path in sorted(Path(sys.argv[1]).iterdir()) if path.is_file()}
+    else:
+        corpus = make_corpus()
+
+    with tempfile.TemporaryDirectory() as images:
+        os.makedirs(os.path.join(images, "pending"))
+        for name, data in corpus.items():
+            size = Image.open(BytesIO(data)).size
+            print(f"{name}: {size[0]}x{size[1]}, {len(data) / 1e3:.0f} kB")
+            print(f"  {'pipeline':<14} {'cpu (ms)':>9} {'default (kB)':>13} {'all (kB)':>9}")
+            for pipeline, run in PIPELINES.items():
+                start = time.process_time()
+                for _ in range(NUMBER):
+                    sizes = run(data, images)
+                cpu = (time.process_time() - start) / NUMBER
+                format = pipeline.split("+")[0].split()[0]
+                widths = [width for f, width in sizes if f == format]
+                default = max([width for width in widths if width <= 500] or [min(widths)])
+                print(f"  {pipeline:<14} {cpu * 1e3:>9.0f} {sizes[format, default] / 1e3:>13.1f} {sum(sizes.values()) / 1e3:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark how many events per second can be added to a file-backed SQLite
+database, from the summaries of digested emails (see `EventSummary`):
+
+- `legacy`: the previous `add_digested_event`, which committed the sender,
+  the event, its tags, its description chunks, its images and its
+  Message-ID one after the other (each commit being an fsync)
+- `per email`: `add_digested_event`, one transaction per email
+- `batch`: `add_digested_events`, one transaction per batch of emails (like
+  `ingest_batch.py` and `/eat_batch`)
+
+Summaries are generated (with a few senders, and descriptions of a few
+chunks), so only the database is measured. The database is created in a
+temporary directory, unless one is given (e.g. to measure a different
+disk). To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_ingest_db.py [path/to/directory/]
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import datetime
+import os
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import ingest_worker
+from db import migrations
+from db.schema import SQLBase, User, Event, EventTag, EventDescription, EventImage, IngestedMessage, DescriptionEncoding
+from db.descriptions import description_chunks
+from utils.category_parser import tags_to_mask
+from utils.compressed_text import compress_text
+from utils.email_parser import EventSummary
+from utils.time_parser import EventTime
+
+EVENTS = 500
+BATCH_SIZE = 50
+
+def make_summaries(count, prefix):
+    return [
+        EventSummary(
+            message_id=f"<{prefix}-{i}@mit.edu>",
+            sender=f"user{i % 20}@mit.edu",
+            title=f"Study break {i}",
+            plaintext=compress_text("Free food in the lobby! " * 400),
+            html=compress_text("<p>Free food in the lobby!</p>" * 2500),
+            categories=[1, 7],
+            location="Lobby 10",
+            when=EventTime(datetime.date(2023, 2, 1 + i % 28), datetime.time(19), None, None),
+            sent=datetime.datetime(2023, 1, 1 + i % 28, 12),
+            images=[f"{i:064x}"],
+        )
+        for i in range(count)
+    ]
+
+def legacy_add(session, summary):
+    """The previous `add_digested_event` (with `commit=True`)
+    """
+    user = session.query(User).filter(User.email == summary.sender).first()
+    if user is None:
+        user = User(summary.sender, 0)
+        session.add(user)
+        session.commit()
+    event = Event()
+    event.title = summary.title
+    event.user_id = user.id
+    event.location = summary.location
+    event.start_date = summary.when.start_date
+    event.start_time = summary.when.start_time
+    event.date_created = summary.sent
+    event.category_mask = tags_to_mask(summary.categories)
+    session.add(event)
+    session.commit()
+    session.query(EventTag).filter(EventTag.event_id == event.id).delete()
+    session.add_all([EventTag(event.id, tag) for tag in summary.categories])
+    session.commit()
+    for content_type, content_index, data in description_chunks(summary.plaintext, summary.html):
+        session.add(EventDescription(event.id, content_type, content_index, None, DescriptionEncoding.ZLIB.value, data))
+    session.commit()
+    session.add_all([EventImage(event.id, image_name) for image_name in summary.images])
+    session.commit()
+    session.add(IngestedMessage(summary.message_id, event.id))
+    session.commit()
+
+def add_legacy(session, summaries):
+    for summary in summaries:
+        legacy_add(session, summary)
+
+def add_per_email(session, summaries):
+    for summary in summaries:
+        assert ingest_worker.add_digested_event(session, summary) is not None
+
+def add_batches(session, summaries):
+    for i in range(0, len(summaries), BATCH_SIZE):
+        assert None not in ingest_worker.add_digested_events(session, summaries[i:i+BATCH_SIZE])
+
+MODES = {
+    "legacy": add_legacy,
+    "per email": add_per_email,
+    f"batch of {BATCH_SIZE}": add_batches,
+}
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"{'mode':<12} {'events/s':>9} {'commits':>8}")
+    for mode, add in MODES.items():
+        with tempfile.TemporaryDirectory(dir=directory) as tmp:
+            engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            SQLBase.metadata.create_all(engine)
+            migrations.upgrade(engine)
+            commits = []
+            sqlalchemy.event.listen(engine, "commit", lambda conn: commits.append(1))
+            session = sqlalchemy.orm.sessionmaker(bind=engine)()
+
+            summaries = make_summaries(EVENTS, mode)
+            start = time.perf_counter()
+            add(session, summaries)
+            elapsed = time.perf_counter() - start
+            session.close()
+            engine.dispose()
+            print(f"{mode:<12} {EVENTS / elapsed:>9.0f} {len(commits):>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark how ingesting emails affects the latency of the requests served
+meanwhile by the same server process.
+
+Simulated reads are scheduled on an asyncio event loop every few
+milliseconds, while emails with a large inline image are ingested:
+
+- `inline`: on the event loop itself, like `/eat` used to
+- `thread`: in a background thread of the server process (`INGEST_PROCESSES = 0`)
+- `pool`: in the ingest process pool (see `ingest_worker.py`)
+
+For each mode, prints the latency percentiles of the reads (from when they
+were due to when they completed).
+
+The images are saved in a temporary directory. To use this
+script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_ingest_latency.py
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from io import BytesIO
+
+from PIL import Image
+
+import configs.server_configs as config
+import ingest_worker
+from utils.email_parser import eat_and_summarize
+
+EMAILS = 8
+IMAGE_SIZE = (3000, 2000)
+READ_INTERVAL = 0.002 # seconds
+
+def make_email() -> str:
+    """Build a dormspam email with a large inline JPEG flyer
+    """
+    image = Image.effect_noise(IMAGE_SIZE, 64).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+
+    msg = EmailMessage()
+    msg["From"] = "Firstname Lastname <username@mit.edu>"
+    msg["To"] = "dorms@mit.edu"
+    msg["Subject"] = "Flyer party in Lobby 10"
+    msg["Date"] = formatdate()
+    msg["Message-ID"] = make_msgid()
+    footer = "bcc'd to dorms, red for bc-talk"
+    msg.set_content(f"Come to the flyer party, Friday 3/8 at 7pm in Lobby 10!\n\n{footer}\n")
+    cid = make_msgid()
+    msg.add_alternative(f'<p>Come to the flyer party!</p><img src="cid:{cid[1:-1]}"><p>{footer}</p>', subtype="html")
+    msg.get_payload()[1].add_related(buffer.getvalue(), "image", "jpeg", cid=cid)
+    return msg.as_string()
+
+async def measure_reads(ingest) -> list[float]:
+    """Schedule reads on the event loop while `ingest` runs, and return their latencies
+    """
+    loop = asyncio.get_running_loop()
+    latencies = []
+    done = asyncio.Event()
+
+    async def reads():
+        due = time.perf_counter()
+        while not done.is_set():
+            due += READ_INTERVAL
+            await asyncio.sleep(max(0, due - time.perf_counter()))
+            latencies.append(time.perf_counter() - due)
+
+    reader = asyncio.create_task(reads())
+    await ingest(loop)
+    done.set()
+    await reader
+    return latencies
+
+def run(mode: str, raw: str) -> list[float]:
+    async def inline(loop):
+        for _ in range(EMAILS):
+            eat_and_summarize(raw)
+            await asyncio.sleep(0)
+
+    async def in_thread(loop):
+        # a single ingest worker thread, like `ingest_worker.IngestWorker`
+        def work():
+            for _ in range(EMAILS):
+                ingest_worker.digest_email(raw)
+        await loop.run_in_executor(None, work)
+
+    ingest = inline if mode == "inline" else in_thread
+    return asyncio.run(measure_reads(ingest))
+
+def main():
+    raw = make_email()
+    print(f"{EMAILS} emails of {len(raw) / 1e6:.1f} MB, with a {IMAGE_SIZE[0]}x{IMAGE_SIZE[1]} image each")
+    print(f"{'mode':<8} {'reads':>6} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+
+    for mode, processes in (("inline", 0), ("thread", 0), ("pool", 1)):
+        config.INGEST_PROCESSES = processes
+        if processes:
+            ingest_worker.get_ingest_pool().submit(int).result() # warm up the pool
+        latencies = run(mode, raw)
+        ingest_worker.shutdown_ingest_pool()
+
+        p50 = statistics.median(latencies) * 1e3
+        p99 = statistics.quantiles(latencies, n=100)[98] * 1e3
+        print(f"{mode:<8} {len(latencies):>6} {p50:>9.2f} {p99:>9.2f} {max(latencies) * 1e3:>9.2f}")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "images"))
+        os.chdir(tmp) # images are saved to `config.PENDING_IMAGE_PATH`, relative to here
+        main()
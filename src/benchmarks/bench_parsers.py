@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the regex parser chains on the sample emails in `src/test_emails`.
+
+Compares the chains against the way they used to run, where every parser
+passed its raw pattern string to `re.finditer`, and every parser of a chain
+rescanned the whole text (even when sharing the same pattern).
+
+Also compares `parse_categories` and `parse_locations` against their previous
+versions, which ran one `\bkeyword\b` regex search per keyword, and one
+substring search per known location (lowercasing the text each time).
+
+Finally, times `parse_event_time` on each email repeated 1, 4 and 16 times,
+to check that its cost stays linear in the size of the text.
+
+To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_parsers.py
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import re
+import timeit
+
+from utils.email_parser import eat
+from utils.parser import ParserChain
+from utils.time_parser import parse_event_time
+from utils.location_parser import LOCATIONS, LOCATION_PARSER_CHAIN, parse_locations
+from utils.category_parser import CATEGORIES, parse_categories
+
+TEST_EMAILS = Path(__file__).parent.parent / "test_emails"
+REPEAT = 5
+NUMBER = 200
+
+CHAINS = {
+   "LOCATION_PARSER_CHAIN": LOCATION_PARSER_CHAIN,
+}
+SIZES = (1, 4, 16)
+
+def legacy_iter(chain: ParserChain, text: str):
+   """Iterate through a chain like it used to: one uncompiled scan per parser
+   """
+   for parser in chain.parsers:
+      for match in re.finditer(parser.pattern, text, flags=re.IGNORECASE):
+         parsed = parser.parse_match(match)
+         if parsed is not None:
+            yield parsed
+
+def legacy_parse_categories(text: str):
+   """Find categories like it used to: one regex search per keyword
+   """
+   categories = set()
+   for i, category in enumerate(CATEGORIES):
+      for keyword in category.keywords:
+         pattern = fr"\b{re.escape(keyword)}\b"
+         match = re.search(pattern, text, re.IGNORECASE)
+         if match:
+            categories.add(i)
+            break
+   return categories
+
+def legacy_parse_locations(text: str):
+   """Find locations like it used to: one substring search per location
+   """
+   locations = set(loc for loc in LOCATIONS if loc.lower() in text.lower())
+   locations |= set(LOCATION_PARSER_CHAIN.iter(text))
+   return locations
+
+def best_time(statement) -> float:
+   """Best time (in microseconds) of a single run of `statement`
+   """
+   times = timeit.repeat(statement, repeat=REPEAT, number=NUMBER)
+   return min(times) / NUMBER * 1e6
+
+def main():
+   texts = {}
+   for file in sorted(TEST_EMAILS.glob("*.txt")):
+      with open(file, "r") as f:
+         texts[file.name] = eat(f.read()).plaintext
+
+   print(f"{'email':<28}{'chain':<26}{'before (us)':>12}{'after (us)':>12}{'speedup':>9}")
+   for name, text in texts.items():
+      for chain_name, chain in CHAINS.items():
+         # both ways must agree (merged chains only up to order)
+         before, after = list(legacy_iter(chain, text)), list(chain.iter_parsed(text))
+         if chain.merge:
+            before, after = sorted(map(repr, before)), sorted(map(repr, after))
+         assert before == after, f"{chain_name} disagrees on {name}"
+
+         t_before = best_time(lambda: list(legacy_iter(chain, text)))
+         t_after = best_time(lambda: list(chain.iter_parsed(text)))
+         print(f"{name:<28}{chain_name:<26}{t_before:>12.1f}{t_after:>12.1f}{t_before/t_after:>8.2f}x")
+
+      assert legacy_parse_categories(text) == parse_categories(text), f"parse_categories disagrees on {name}"
+      t_before = best_time(lambda: legacy_parse_categories(text))
+      t_after = best_time(lambda: parse_categories(text))
+      print(f"{name:<28}{'parse_categories':<26}{t_before:>12.1f}{t_after:>12.1f}{t_before/t_after:>8.2f}x")
+
+      # (results may differ, since locations now match whole words only)
+      t_before = best_time(lambda: legacy_parse_locations(text))
+      t_after = best_time(lambda: parse_locations(text))
+      print(f"{name:<28}{'parse_locations':<26}{t_before:>12.1f}{t_after:>12.1f}{t_before/t_after:>8.2f}x")
+
+   print()
+   print(f"{'email':<28}{'size':>6}{'length':>10}{'parse_event_time (us)':>24}{'us/KB':>9}")
+   for name, text in texts.items():
+      for size in SIZES:
+         sized_text = "\n".join([text] * size)
+         t = best_time(lambda: parse_event_time(sized_text))
+         print(f"{name:<28}{size:>5}x{len(sized_text):>10}{t:>24.1f}{t/len(sized_text)*1000:>9.1f}")
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark `/search_events` (`db_operations.search_events`, see `db/search.py`)
+on a file-backed database of many events.
+
+Events are generated with titles, locations and plaintext descriptions made
+of words drawn from a vocabulary (a few words are very common, most are
+rare, like in dormspam). Prints how long the events took to add (with
+their index), the size of the database, and the latency of searches for
+common and rare words, with and without a date range, and deep pages.
+
+To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_search.py [number of events]
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+import db.db_operations as db_operations
+from db import migrations
+from db.schema import SQLBase, configure_connections
+
+EVENTS = 100_000
+BATCH_SIZE = 1000
+REPEATS = 50
+VOCABULARY = [f"word{i}" for i in range(20_000)]
+COMMON = ["free", "food", "study", "break", "pizza", "boba", "club", "meeting"]
+
+def words(rng, count):
+    # Zipf-like: a few words in about a third of the events, most words in a handful
+    return " ".join(
+        rng.choice(COMMON) if rng.random() < 0.02 else VOCABULARY[min(int(rng.paretovariate(0.6)), len(VOCABULARY)) - 1]
+        for _ in range(count)
+    )
+
+def new_events(rng, start, count):
+    return [
+        db_operations.NewEvent(
+            title=words(rng, 5), description=words(rng, 150), event_tags=[i % 10],
+            start_date=datetime.date(2023, 1, 1) + datetime.timedelta(days=i % 365),
+            location=f"Room {i % 500}", sender=f"user{i % 1000}@mit.edu",
+        )
+        for i in range(start, start + count)
+    ]
+
+SEARCHES = {
+    "common word": dict(query="free"),
+    "common words": dict(query="free pizza"),
+    "rare word": dict(query="word5000"),
+    "prefix": dict(query="word50"),
+    "common, in a month": dict(query="free", from_date=datetime.date(2023, 3, 1), to_date=datetime.date(2023, 3, 31)),
+    "common, page 50": dict(query="free", offset=50 * 20),
+    "no match": dict(query="nothing"),
+}
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else EVENTS
+    rng = random.Random(0)
+    db_operations.is_redis_alive = False
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+        configure_connections(engine)
+        SQLBase.metadata.create_all(engine)
+        migrations.upgrade(engine)
+        session = sqlalchemy.orm.sessionmaker(bind=engine)()
+
+        start = time.perf_counter()
+        for i in range(0, events, BATCH_SIZE):
+            db_operations.add_events(session, new_events(rng, i, min(BATCH_SIZE, events - i)))
+        elapsed = time.perf_counter() - start
+        print(f"Added {events} events in {elapsed:.1f} s ({events / elapsed:.0f} events/s), database of {os.path.getsize(path) / 1e6:.0f} MB")
+
+        print(f"{'search':<20} {'results':>8} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+        for name, search in SEARCHES.items():
+            latencies = []
+            for _ in range(REPEATS):
+                start = time.perf_counter()
+                results, _ = db_operations.search_events(session, limit=21, **search)
+                latencies.append(time.perf_counter() - start)
+                session.expunge_all()
+            matches = session.execute(
+                "SELECT COUNT(*) FROM events_fts WHERE events_fts MATCH :query",
+                {"query": db_operations.fts_query(search["query"])},
+            ).scalar()
+            quantiles = statistics.quantiles(latencies, n=20)
+            print(f"{name:<20} {matches:>8} {quantiles[9] * 1e3:>9.1f} {quantiles[18] * 1e3:>9.1f}")
+        session.close()
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
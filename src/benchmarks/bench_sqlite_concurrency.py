@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the latency of reads from the SQLite database while other
+processes ingest events into it, like the gunicorn workers of `run_prod.sh`.
+
+For each connection profile (SQLite's defaults, and `config.SQLITE_PRAGMAS`),
+a file-backed database is seeded with a month of events. Reader processes
+then load the events of a day (with their descriptions, like
+`/get_events_by_date`), first alone, then while writer processes add
+batches of events as fast as they can. Prints the latency percentiles of the
+reads, the events written per second, and the number of "database is locked"
+errors.
+
+To use this script, cd into `src` and run:
+
+```bash
+python3 benchmarks/bench_sqlite_concurrency.py [path/to/directory/]
+```
+"""
+
+from pathlib import Path
+import sys; sys.path.append(str(Path(sys.path[0]).parent))
+import datetime
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+import sqlalchemy
+
+import configs.server_configs as config
+import db.db_operations as db_operations
+import db.schema as schema
+from db import migrations
+from db.schema import EventDescriptionType
+from utils.compressed_text import compress_text
+from utils.email_parser import EventSummary
+from utils.time_parser import EventTime
+
+PROFILES = {
+    "default": {},
+    "configured": config.SQLITE_PRAGMAS,
+}
+READERS = 2
+WRITERS = 2
+DURATION = 5 # seconds
+BATCH_SIZE = 50
+SEED_EVENTS = 600
+
+def use_database(url, pragmas):
+    """Point `get_engine` of this process to the database `url`, with `pragmas`
+    """
+    schema.SQL_URL = url
+    config.SQLITE_PRAGMAS = pragmas
+    schema._engine = None
+
+def make_summaries(count, prefix):
+    return [
+        EventSummary(
+            message_id=f"<{prefix}-{i}@mit.edu>",
+            sender=f"user{i % 20}@mit.edu",
+            title=f"Study break {i}",
+            plaintext=compress_text("Free food in the lobby! " * 100),
+            html=compress_text("<p>Free food in the lobby!</p>" * 2000),
+            categories=[1, 7],
+            location="Lobby 10",
+            when=EventTime(datetime.date(2023, 2, 1 + i % 28), datetime.time(19), None, None),
+            sent=datetime.datetime(2023, 1, 1 + i % 28, 12),
+            images=[],
+        )
+        for i in range(count)
+    ]
+
+def write(url, pragmas, writer, stop, written, errors):
+    """Add batches of events until `stop` is set (in a writer process)
+    """
+    import ingest_worker
+    use_database(url, pragmas)
+    batch = 0
+    while not stop.is_set():
+        summaries = make_summaries(BATCH_SIZE, f"{writer}-{batch}")
+        try:
+            with db_operations.session_scope() as session:
+                ingest_worker.add_digested_events(session, summaries)
+        except sqlalchemy.exc.OperationalError:
+            errors.value += 1
+        else:
+            written.value += BATCH_SIZE
+        batch += 1
+
+def read(url, pragmas, stop, results):
+    """Read the events of a day until `stop` is set (in a reader process), then
+    put the latencies of the reads and the number of errors in `results`
+    """
+    use_database(url, pragmas)
+    latencies, errors = [], 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with db_operations.session_scope() as session:
+                events = db_operations.get_events_by_date(session, datetime.date(2023, 2, 3), False)
+                db_operations.get_event_descriptions(session, events, EventDescriptionType.HTML)
+        except sqlalchemy.exc.OperationalError:
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+    results.put((latencies, errors))
+
+def measure(url, pragmas, writers):
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    written = context.Value("i", 0)
+    write_errors = context.Value("i", 0)
+    processes = [
+        context.Process(target=write, args=(url, pragmas, writer, stop, written, write_errors))
+        for writer in range(writers)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(1 if writers else 0) # let the writers start
+
+    reader_stop = context.Event()
+    results = context.Queue()
+    readers = [context.Process(target=read, args=(url, pragmas, reader_stop, results)) for _ in range(READERS)]
+    for reader in readers:
+        reader.start()
+    time.sleep(1) # let the readers start
+    written_before = written.value
+    time.sleep(DURATION)
+    writes = (written.value - written_before) / DURATION
+    reader_stop.set()
+    latencies, errors = [], write_errors.value
+    for reader in readers:
+        reader_latencies, reader_errors = results.get()
+        latencies.extend(reader_latencies)
+        errors += reader_errors
+    for reader in readers:
+        reader.join()
+    stop.set()
+    for process in processes:
+        process.join()
+    return latencies, writes, errors
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100)[p - 1] if len(values) > 1 else float("nan")
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"{'profile':<11} {'writers':>7} {'reads':>6} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} {'writes/s':>9} {'locked':>7}")
+    for profile, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory(dir=directory) as tmp:
+            url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            use_database(url, pragmas)
+            engine = schema.new_engine()
+            migrations.setup_database(engine) # like `run_prod.sh`, before the processes start
+            engine.dispose()
+            import ingest_worker
+            with db_operations.session_scope() as session:
+                ingest_worker.add_digested_events(session, make_summaries(SEED_EVENTS, "seed"))
+
+            for writers in (0, WRITERS):
+                latencies, writes, errors = measure(url, pragmas, writers)
+                print(f"{profile:<11} {writers:>7} {len(latencies):>6}"
+                      f" {percentile(latencies, 50) * 1e3:>9.1f} {percentile(latencies, 95) * 1e3:>9.1f}"
+                      f" {percentile(latencies, 99) * 1e3:>9.1f} {max(latencies, default=0) * 1e3:>9.1f}"
+                      f" {writes:>9.0f} {errors:>7}")
+            db_operations.Session.remove()
+            schema.get_engine().dispose()
+
+if __name__ == "__main__":
+    main()
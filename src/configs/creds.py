@@ -0,0 +1,4 @@
+database_name = "dormdigest"
+user = "dev"
+password = "dev"
+valid_API_tokens = ["devtoken"]
@@ -41,11 +41,80 @@ Breakdown of variable config options:
 - BASE_IMAGE_URL: URL where we can find the events images
     * For `prod` and `testing`, it is the Nginx endpoing that is serving files statically
     * For `dev`, it is the backend FastAPI endpoint serving static files
+- INGEST_WORKERS: Number of background threads (per server process) ingesting the emails queued by `/eat`
+- INGEST_PROCESSES: Number of processes (per server process) the ingest workers parse emails
+    and compress images in, so that it doesn't slow down the server
+    * 0 => Parse emails in the ingest worker threads instead
+- INGEST_MAX_BACKLOG: How many emails can wait in the queue before `/eat` answers 503 (try again later)
+- INGEST_RETRY_AFTER: Seconds `/eat` asks to wait (with `Retry-After`) when it answers 503
+- INGEST_MAX_EMAIL_BYTES: Largest (decompressed) email accepted by `/eat/raw`
+- IMAGE_PROCESSES: Number of processes compressing the images of ingested emails in the background
+    (only in one server process at a time, see `image_worker.py`)
+    * 0 => Compress images in a thread of the server process instead
+- IMAGE_POLL_INTERVAL: Seconds the image worker waits before checking for new images again
+- IMAGE_FORMATS: Formats images are compressed to, most preferred first (the last one is the
+    fallback of browsers that support none of the others)
+    * "webp"
+    * "avif" => Smaller than WebP, but several times slower to encode
+- IMAGE_MEMORY_CAP: Bytes of an inserted image held in memory while decoding it from its email, past
+    which it is spooled to a temporary file (memory-mapped) instead
+- IMAGE_GC_GRACE: Seconds an image no event links to is kept, in case its email is still being ingested
+    (see `python3 image_worker.py --gc`)
+- INGEST_MAX_ATTEMPTS: How many times an email is tried before it is moved to the dead-letter table
+- INGEST_RETRY_DELAY: Seconds to wait before retrying a failed email (doubled after each attempt)
+- INGEST_CLAIM_TIMEOUT: Seconds after which an email still being processed is assumed lost
+    (e.g. the server restarted) and can be claimed again
+- INGEST_POLL_INTERVAL: Seconds an idle ingest worker waits before checking the queue again
+- DB_WRITER_INTERVAL: Seconds the database writer of a server process waits for more writes after
+    the first one, before committing them all in one transaction (see `db/writer.py`)
+- DB_WRITER_MAX_WRITES: Most writes committed in one transaction by the database writer
+- DESCRIPTION_COMPRESSION_LEVEL: zlib level (1-9) event descriptions are compressed with (see
+    `db/descriptions.py`). Higher levels are slower to compress, but not to decompress
+- SQLITE_PRAGMAS: Pragmas applied to each new connection to the SQLite database (see `db/schema.py`)
+    * journal_mode "WAL" => Readers and the writer don't block each other (the server processes
+      and ingest workers all share the database file)
+    * synchronous "NORMAL" => Commits are only synced at checkpoints (safe with WAL, but a power
+      loss may lose the last commits)
+    * busy_timeout => Milliseconds a writer waits for the other writer before failing with
+      "database is locked"
+    * mmap_size, cache_size (negative => in KiB), temp_store => Memory used to read the
+      database, and for temporary tables and indexes
 '''
 
 LOCAL_IMAGE_PATH = "./images/" #Path to where images should be stored locally after extraction
+PENDING_IMAGE_PATH = LOCAL_IMAGE_PATH + "pending/" #Path to where images wait to be compressed
 SERVER_PORT = 8432
 
+INGEST_WORKERS = 1
+INGEST_PROCESSES = 1
+INGEST_MAX_BACKLOG = 1000
+INGEST_RETRY_AFTER = 60
+INGEST_MAX_EMAIL_BYTES = 64 * 1024 * 1024
+
+IMAGE_PROCESSES = 1
+IMAGE_POLL_INTERVAL = 5
+IMAGE_FORMATS = ("webp",)
+IMAGE_MEMORY_CAP = 4 * 1024 * 1024
+IMAGE_GC_GRACE = 24 * 60 * 60
+INGEST_MAX_ATTEMPTS = 5
+INGEST_RETRY_DELAY = 30
+INGEST_CLAIM_TIMEOUT = 600
+INGEST_POLL_INTERVAL = 2
+
+DB_WRITER_INTERVAL = 0.005
+DB_WRITER_MAX_WRITES = 100
+
+DESCRIPTION_COMPRESSION_LEVEL = 6
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 10000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
 
 if CURRENT_MODE == AVAILABLE_MODES.PROD:
     SERVER_HOST = "0.0.0.0"
@@ -0,0 +1,28 @@
+'''
+Point the tests to a temporary database, never the one in the current
+directory (e.g. the production database, when the tests are run where the
+server is deployed)
+
+It is set up like the server's is before it starts (see `run_prod.sh`),
+since some test scripts (e.g. `test_session.py`) query it as soon as they
+are imported.
+'''
+import os
+import tempfile
+
+from db import migrations
+import db.schema as schema
+
+_database_dir = None
+
+def pytest_configure(config):
+    global _database_dir
+    _database_dir = tempfile.TemporaryDirectory()
+    schema.SQL_URL = f"sqlite:///{os.path.join(_database_dir.name, 'test.db')}"
+    engine = schema.new_engine()
+    migrations.setup_database(engine)
+    engine.dispose()
+
+def pytest_unconfigure(config):
+    if _database_dir is not None:
+        _database_dir.cleanup()
@@ -0,0 +1,54 @@
+'''
+Base test case of the tests that need a database (see `DatabaseTestCase`)
+'''
+import tempfile
+import unittest
+from unittest import mock
+
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy.pool import StaticPool
+
+import db.db_operations as db_operations
+from db import migrations
+from db.schema import SQLBase
+
+class DatabaseTestCase(unittest.TestCase):
+    '''
+    Test case with a new database with the latest tables (`self.engine`), and
+    a session of it (`self.session`)
+
+    The database is in memory, over a single connection shared by every
+    thread (e.g. the database writer's, see `db/writer.py`). With
+    `DATABASE_FILE`, it is a temporary file instead, and each session has its
+    own connection (e.g. to test concurrent transactions).
+
+    `db_operations.Session` (e.g. behind the endpoints of `main.py`) makes
+    sessions of it too.
+    '''
+    DATABASE_FILE = False
+    MIGRATE = False # apply the migrations after creating the tables, like `python3 -m db.migrations upgrade`
+
+    def setUp(self):
+        super().setUp()
+        if self.DATABASE_FILE:
+            tmp = tempfile.NamedTemporaryFile(suffix=".db")
+            self.addCleanup(tmp.close)
+            self.engine = sqlalchemy.create_engine(f"sqlite:///{tmp.name}")
+        else:
+            self.engine = sqlalchemy.create_engine(
+                "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+            )
+        if self.MIGRATE:
+            migrations.setup_database(self.engine)
+        else:
+            SQLBase.metadata.create_all(self.engine)
+
+        self.Session = sqlalchemy.orm.sessionmaker(bind=self.engine)
+        self.session = self.Session()
+        self.addCleanup(self.session.close)
+        scoped_session = sqlalchemy.orm.scoped_session(self.Session)
+        patcher = mock.patch.object(db_operations, "Session", scoped_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(scoped_session.remove)
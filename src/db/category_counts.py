@@ -0,0 +1,48 @@
+'''
+Number of events of each category on each day (the `daily_category_counts` table)
+
+The counts are kept up to date by `db_operations` in the same transaction as
+the events they count (see `db_operations.count_event_categories`), so that
+`/get_event_category_frequency_for_month` and heatmaps only read a few rows
+per day, instead of every event.
+
+If they are ever out of sync (e.g. after the events table was edited by
+hand), cd into `src` and rebuild them from the events:
+
+    python3 -m db.category_counts
+'''
+import sqlalchemy
+
+from db.schema import DateKind, ALL_CATEGORIES
+from utils.category_parser import CATEGORIES
+
+# SQL expression of the day each date kind counts an event on
+DAY_EXPRESSIONS = {
+    DateKind.START: "events.start_date",
+    DateKind.SENT: "date(events.date_created)",
+}
+
+def rebuild_daily_category_counts(connection):
+    '''
+    Recount the events of each category on each day, in SQL, replacing the
+    previous counts (call it in a transaction)
+
+    Returns the number of rows of counts
+    '''
+    connection.execute("DELETE FROM daily_category_counts")
+    for date_kind, day in DAY_EXPRESSIONS.items():
+        for category in [ALL_CATEGORIES, *range(len(CATEGORIES))]:
+            has_category = "1 = 1" if category == ALL_CATEGORIES else f"(events.category_mask & {1 << category}) != 0"
+            connection.execute(sqlalchemy.text(
+                "INSERT INTO daily_category_counts (date_kind, date, category, count)"
+                f" SELECT :date_kind, {day}, :category, COUNT(*) FROM events"
+                f" WHERE {day} IS NOT NULL AND {has_category}"
+                f" GROUP BY {day}"
+            ), date_kind=date_kind.value, category=category)
+    return connection.execute("SELECT COUNT(*) FROM daily_category_counts").scalar()
+
+if __name__ == '__main__':
+    from db.schema import get_engine
+    with get_engine().begin() as connection:
+        rows = rebuild_daily_category_counts(connection)
+    print(f"Rebuilt {rows} daily category counts")
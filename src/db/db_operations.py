@@ -1,16 +1,26 @@
 import sqlalchemy as db
 from sqlalchemy import exc, cast, Date
 import sqlalchemy.orm
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, date, time
+from typing import List, NamedTuple, Optional, Sequence, Union
 
 from contextlib import contextmanager
 from db.db_helpers import *
 from db.schema import \
     Event, EventDescription, EventTag, User, Club, ClubMembership, EventDescriptionType, \
-    EMAIL_DESCRIPTION_CHUNK_SIZE, sqlengine, SessionId, SESSION_ID_LENGTH
-from utils.category_parser import parse_tags
+    EMAIL_DESCRIPTION_CHUNK_SIZE, get_engine, SessionId, SESSION_ID_LENGTH, \
+    IngestJob, IngestDeadLetter, IngestJobStatus, IngestedMessage, EventImage, \
+    DailyCategoryCount, DateKind, ALL_CATEGORIES, DescriptionEncoding, EVENT_PAGE_START_TIME, EVENT_PAGE_TITLE
+from db.descriptions import description_chunks, description_text, join_description
+from db.search import fts_query, format_snippet, search_query, index_events, reindex_events
+from utils.category_parser import CATEGORIES, parse_tags, tags_to_mask, mask_to_tags
 import db.schema as schema
 import calendar
+from collections import Counter
+import json
+import uuid
+import base64
+import binascii
 from auth.auth_helpers import generate_API_token
 import configs.server_configs as config
 
@@ -58,8 +68,16 @@ def do_caching(ttl=0, limit=0):
 
 MAX_COMMIT_RETRIES = 10
 
+class ProcessSession(sqlalchemy.orm.Session):
+    '''
+    Session using the engine of the current process, created when the first
+    query is made rather than at import (see `schema.get_engine`)
+    '''
+    def get_bind(self, mapper=None, clause=None):
+        return self.bind or get_engine()
+
 # Set up SQLachemy sesion factory
-session_factory = sqlalchemy.orm.sessionmaker(bind=sqlengine)  # main object used for queries
+session_factory = sqlalchemy.orm.sessionmaker(class_=ProcessSession)  # main object used for queries
 Session = sqlalchemy.orm.scoped_session(session_factory) #We use scoped_session for thread safety
 
 @contextmanager
@@ -176,13 +194,7 @@ def get_events_by_month(session, month,year=None, filter_by_sent_date=False):
     Year: int (if None, will interpret as current year)
 
     '''
-    assert 1 <= month <= 12, "Month must be in range 1 and 12"
-    if not year:
-        year = datetime.now().year
-    _, last_day_of_month = calendar.monthrange(year,month)
-
-    from_date = datetime(year,month,1).date()
-    to_date = datetime(year,month,last_day_of_month).date()
+    from_date, to_date = _month_range(month, year)
     if (filter_by_sent_date):
         query = session.query(
             Event
@@ -202,41 +214,253 @@ def get_events_by_month(session, month,year=None, filter_by_sent_date=False):
     events = query.all()
     return events
 
+def search_events(session, query, from_date=None, to_date=None, filter_by_sent_date=False, limit=20, offset=0):
+    '''
+    Search the title, location and plaintext description of events (see `db.search`)
+
+    query: text typed by the user (events match if they contain all of its words)
+    from_date, to_date: datetime Date objects; if given, only events happening
+                        (or sent, if `filter_by_sent_date`) in that range match
+    limit, offset: page of results, best ranked first
+
+    Returns the events of the page, and a snippet of each (HTML, with the
+    matching words in <mark> tags)
+    '''
+    match = fts_query(query)
+    if match is None:
+        return [], []
+    day = "date(events.date_created)" if filter_by_sent_date else "events.start_date"
+    filters, params = [], {"query": match, "limit": limit, "offset": offset}
+    for name, value, condition in (("from_date", from_date, f"{day} >= :from_date"), ("to_date", to_date, f"{day} <= :to_date")):
+        if value is not None:
+            filters.append(condition)
+            params[name] = value.isoformat()
+    rows = session.execute(sqlalchemy.text(search_query(filters)), params).fetchall()
+    events = {event.id: event for event in _query_in(session.query(Event), Event.id, [event_id for event_id, _ in rows])}
+    return [events[event_id] for event_id, _ in rows], [format_snippet(snippet) for _, snippet in rows]
+
+# Most ids in a single `IN (...)` clause (SQLite allows at most 999 parameters before 3.32)
+MAX_IN_CLAUSE_IDS = 500
+
+def _query_in(query, column, ids):
+    '''
+    Run `query` filtered on `column` being one of `ids`, in as few queries as
+    possible, and return all the rows
+    '''
+    ids = list(dict.fromkeys(ids))
+    rows = []
+    for i in range(0, len(ids), MAX_IN_CLAUSE_IDS):
+        rows.extend(query.filter(column.in_(ids[i:i+MAX_IN_CLAUSE_IDS])).all())
+    return rows
 
 def get_event_tags(session, events, convertName=False):
     '''
     Given a list of Event models, return a list of all tags associated with each event
     
     If `convertToName` is True, tag number will be converted to the category name.
-    '''
-    @do_caching(limit=1024)
-    def get_event_tags_helper(event_ids, convertName):
-        res = []
-        for event in events:
-            #Using relationships defined in Event
-            event_tags = [x.get_tag_value() for x in event.tags.all()]
-            if convertName: #Parse tag numbers into category names
-                event_categories = parse_tags(event_tags)
-                res.append(event_categories)
-            else:
-                res.append(event_tags)
-        return res
-    event_ids = sorted([event.id for event in events]) #Make events list serializable 
-    return get_event_tags_helper(event_ids, convertName)
 
-def get_event_user_emails(session, events):
-    '''
-    Given a list of Event models, return a list of the user email associated with each event (e.g. sender)
+    The tags are read from the category bitmask of each event, so no query is needed
+    (and the tags of each event are sorted).
     '''
     res = []
     for event in events:
-        #Using relationships defined in Event
-        if event.user:
-            res.append(event.user.get_user_email())
+        event_tags = mask_to_tags(event.category_mask or 0)
+        if convertName: #Parse tag numbers into category names
+            res.append(parse_tags(event_tags))
         else:
-            res.append("unknown_user") # Default "unknown_user" is failsafe in case we misadd a user
+            res.append(event_tags)
     return res
 
+def _month_range(month, year=None):
+    '''
+    Return the first and last days of a month (of the current year if `year` is None)
+    '''
+    assert 1 <= month <= 12, "Month must be in range 1 and 12"
+    if not year:
+        year = datetime.now().year
+    _, last_day_of_month = calendar.monthrange(year,month)
+    return datetime(year,month,1).date(), datetime(year,month,last_day_of_month).date()
+
+def get_events_by_category_in_month(session, category, month, year=None, filter_by_sent_date=False):
+    '''
+    Get all events of a given category (tag number) happening in a given month,
+    ordered by start time and event name
+
+    The category is filtered on the bitmask of the events, in the same
+    indexed scan as `get_events_by_month`.
+    '''
+    from_date, to_date = _month_range(month, year)
+    has_category = Event.category_mask.op('&')(1 << category) != 0
+    if filter_by_sent_date:
+        query = session.query(
+            Event
+        ).filter(
+            Event.date_created.between(from_date, to_date+timedelta(days=1)), has_category
+        ).order_by(
+            Event.date_created, Event.title
+        )
+    else:
+        query = session.query(
+            Event
+        ).filter(
+            Event.start_date.between(from_date, to_date), has_category
+        ).order_by(
+            Event.start_date, Event.start_time, Event.title
+        )
+    return query.all()
+
+# Order of the pages of `get_events_in_range` (the id breaks ties, so that the order is total)
+EVENT_PAGE_ORDER = (Event.start_date, EVENT_PAGE_START_TIME, EVENT_PAGE_TITLE, Event.id)
+
+def get_events_in_range(session, from_date, to_date, category_mask=0, limit=50, after=None):
+    '''
+    Get a page of the events happening between two days (inclusive),
+    ordered by start date, start time, event name and id
+
+    category_mask: if not 0, only events with at least one of the categories
+                   of the bitmask (see `category_parser.tags_to_mask`) are returned
+    after: key of the last event of the previous page (see `event_page_key`),
+           or None for the first page
+
+    Each page is read from `ix_events_page` (whose entries end with the id of
+    the event, like every index in SQLite) starting at the day of the key of
+    the previous page, so deep pages cost the same as the first one.
+    '''
+    query = session.query(
+        Event
+    ).filter(
+        Event.start_date <= to_date
+    )
+    if after is None or after[0] < from_date:
+        query = query.filter(Event.start_date >= from_date)
+    else:
+        # instead of `start_date >= from_date`, so that SQLite seeks the index to the key
+        query = query.filter(db.tuple_(*EVENT_PAGE_ORDER) > db.tuple_(*(
+            db.literal(value, type_=column.type) for column, value in zip(EVENT_PAGE_ORDER, after)
+        )))
+    if category_mask:
+        query = query.filter(Event.category_mask.op('&')(category_mask) != 0)
+    return query.order_by(*EVENT_PAGE_ORDER).limit(limit).all()
+
+def event_page_key(event):
+    '''
+    Key of an event in the pages of `get_events_in_range`
+    '''
+    return (event.start_date, event.start_time or time(0), event.title or "", event.id) # see `EVENT_PAGE_START_TIME`
+
+def encode_event_cursor(key):
+    '''
+    Encode the key of an event (see `event_page_key`) as an opaque string, for clients
+    '''
+    start_date, start_time, title, event_id = key
+    data = json.dumps([start_date.isoformat(), start_time.isoformat(), title, event_id])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+def decode_event_cursor(cursor):
+    '''
+    Decode a cursor of `encode_event_cursor`
+
+    Raises ValueError if the cursor is invalid.
+    '''
+    try:
+        start_date, start_time, title, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return date.fromisoformat(start_date), time.fromisoformat(start_time), str(title), int(event_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def get_category_counts_by_day(session, month, year=None, filter_by_sent_date=False):
+    '''
+    Given the month and year, return a dictionary mapping each day (as "YYYY-MM-DD")
+    with at least one event, to a dictionary mapping category names to the number
+    of events of that category on that day (categories with no events are left out)
+
+    The counts are read from `daily_category_counts` (at most 11 rows per day).
+    '''
+    from_date, to_date = _month_range(month, year)
+    date_kind = DateKind.SENT if filter_by_sent_date else DateKind.START
+    rows = session.query(
+        DailyCategoryCount.date, DailyCategoryCount.category, DailyCategoryCount.count
+    ).filter(
+        DailyCategoryCount.date_kind==date_kind.value,
+        DailyCategoryCount.date.between(from_date, to_date),
+        DailyCategoryCount.count > 0,
+    ).order_by(
+        DailyCategoryCount.date, DailyCategoryCount.category
+    ).all()
+
+    res = {}
+    for day, category, count in rows:
+        day_counts = res.setdefault(day.strftime("%Y-%m-%d"), {})
+        if category != ALL_CATEGORIES:
+            day_counts[CATEGORIES[category].name] = count
+    return res
+
+def get_daily_event_counts(session, from_date, to_date, filter_by_sent_date=False, category=ALL_CATEGORIES):
+    '''
+    Return a dictionary mapping each day (as "YYYY-MM-DD") between `from_date`
+    and `to_date` (inclusive) with at least one event, to its number of events
+    (of the given category, or of any category), e.g. for a heatmap of a year
+    '''
+    date_kind = DateKind.SENT if filter_by_sent_date else DateKind.START
+    rows = session.query(
+        DailyCategoryCount.date, DailyCategoryCount.count
+    ).filter(
+        DailyCategoryCount.date_kind==date_kind.value,
+        DailyCategoryCount.date.between(from_date, to_date),
+        DailyCategoryCount.category==category,
+        DailyCategoryCount.count > 0,
+    ).order_by(
+        DailyCategoryCount.date
+    ).all()
+    return {day.strftime("%Y-%m-%d"): count for day, count in rows}
+
+_ADD_DAILY_CATEGORY_COUNT = db.text(
+    "INSERT INTO daily_category_counts (date_kind, date, category, count)"
+    " VALUES (:date_kind, :date, :category, :count)"
+    " ON CONFLICT (date_kind, date, category) DO UPDATE SET count = count + excluded.count"
+).bindparams(db.bindparam("date", type_=db.Date))
+
+def count_event_categories(session, events, sign=1):
+    '''
+    Add (or subtract, if `sign` is -1) events to the number of events of each
+    of their categories on their start and sent days, in `daily_category_counts`
+
+    Nothing is committed: call it in the transaction that adds, changes or
+    removes the events, before any change (with -1) and after them.
+    '''
+    deltas = Counter()
+    for event in events:
+        categories = [ALL_CATEGORIES, *mask_to_tags(event.category_mask or 0)]
+        days = (
+            (DateKind.START, event.start_date),
+            (DateKind.SENT, event.date_created.date() if event.date_created else None),
+        )
+        for date_kind, day in days:
+            if day is None:
+                continue
+            for category in categories:
+                deltas[date_kind.value, day, category] += sign
+    if not any(deltas.values()):
+        return
+
+    # a single statement per row, so that counts added concurrently (e.g. by
+    # another process) are never lost between reading and inserting a row
+    session.execute(_ADD_DAILY_CATEGORY_COUNT, [
+        {"date_kind": date_kind, "date": day, "category": category, "count": delta}
+        for (date_kind, day, category), delta in deltas.items() if delta
+    ])
+
+def get_event_user_emails(session, events):
+    '''
+    Given a list of Event models, return a list of the user email associated with each event (e.g. sender)
+
+    The users of all events are loaded at once.
+    '''
+    rows = _query_in(session.query(User.id, User.email), User.id, [event.user_id for event in events])
+    emails = dict(rows)
+    # Default "unknown_user" is failsafe in case we misadd a user
+    return [emails.get(event.user_id, "unknown_user") for event in events]
+
 
 def get_event_description(session, event_id, description_type):
     """
@@ -248,13 +472,15 @@ def get_event_description(session, event_id, description_type):
     """
     @do_caching(limit=1024)
     def get_event_description_helper(event_id, description_type_value):
-        description_chunks = session.query(EventDescription).filter(
+        description_chunks = session.query(
+                EventDescription.encoding, EventDescription.data, EventDescription.compressed_data
+        ).filter(
                 EventDescription.event_id == event_id,
                 EventDescription.content_type == description_type_value
         ).order_by(
                 EventDescription.content_index
         ).all()
-        full_description = "".join([chunk.data for chunk in description_chunks])
+        full_description = join_description(description_chunks)
         return full_description
     description_type_value = description_type.value
     return get_event_description_helper(event_id, description_type_value)
@@ -263,12 +489,31 @@ def get_event_descriptions(session, events, description_type):
     '''
     Given a list of Event models, return a list of either plaintext or html
     description of each event (where type is determined by `description_type`)
+
+    The description chunks of all events are loaded at once.
     '''
-    res = [get_event_description(session, event.id, description_type) for event in events]
-    return res
+    @do_caching(limit=1024)
+    def get_event_descriptions_helper(event_ids, description_type_value):
+        chunks_by_event = {event_id: [] for event_id in event_ids}
+        rows = _query_in(
+            session.query(
+                EventDescription.event_id, EventDescription.encoding,
+                EventDescription.data, EventDescription.compressed_data,
+            ).filter(
+                EventDescription.content_type == description_type_value,
+            ).order_by(
+                EventDescription.event_id, EventDescription.content_index,
+            ),
+            EventDescription.event_id, event_ids,
+        )
+        for event_id, *chunk in rows:
+            chunks_by_event[event_id].append(chunk)
+        return [join_description(chunks_by_event[event_id]) for event_id in event_ids]
+    event_ids = [event.id for event in events]
+    return get_event_descriptions_helper(event_ids, description_type.value)
 
 ## Add Functions
-def add_to_db(session, obj, others=None,rollbackfunc=None):
+def add_to_db(session, obj, others=None,rollbackfunc=None,commit=True):
     """Adds objects to database with re-trials
     
     Arguments:
@@ -277,6 +522,8 @@ def add_to_db(session, obj, others=None,rollbackfunc=None):
     Keyword Arguments:
         others {List} -- List of other model objects (default: {None})
         rollbackfunc {Func} -- Function that should be called on rollback (default: {None})
+        commit {Boolean} -- Whether to commit, or only flush so that the caller
+                            can commit many additions at once (default: {True})
     
     Returns:
         Boolean - Success or not successful
@@ -290,7 +537,10 @@ def add_to_db(session, obj, others=None,rollbackfunc=None):
             if (others):
                 for o in others:
                     session.add(o)
-            session.commit()
+            if commit:
+                session.commit()
+            else:
+                session.flush()
         except exc.IntegrityError:
             session.rollback()
             if (rollbackfunc):
@@ -305,55 +555,154 @@ def add_to_db(session, obj, others=None,rollbackfunc=None):
 def add_event(session, title, user_id, description, event_tags=[0],\
               start_date=None, end_date=None, start_time=None, end_time=None, \
               description_html=None, club_id=None, location=None, cta_link=None,\
-              date_created=None):
+              date_created=None, commit=True):
     '''
-    Adds an event to the database
+    Adds an event to the database, in a single transaction (see `add_events`)
+
+    If `commit` is False, nothing is committed, so that the caller can add
+    many events in a single transaction.
     
     Returns id of new event, or None if add failed
     '''
-    event = Event()
-    #Required fields
-    event.title = title
-    event.user_id = user_id
-    
-    #Optional Fields
-    event.club_id = club_id
-    event.location = location
-    event.start_date = start_date if start_date else datetime.today().date() # Default to day received
-    event.end_date = end_date
-    event.start_time = start_time if start_time else datetime.min.time() # Default to midnight
-    event.end_time = end_time
-    event.cta_link = cta_link
-    event.date_created = date_created if date_created else datetime.now()
-
-    committed = add_to_db(session, event)
-    if committed:
-        session.flush()
-        add_event_tags(session, event.id,event_tags)
-        add_event_description(session, event.id, description, description_html)
-        return event.id
-    return None
+    return add_events(session, [NewEvent(
+        title, description, event_tags, start_date, end_date, start_time, end_time,
+        description_html, club_id, location, cta_link, date_created, user_id=user_id,
+    )], commit=commit)[0]
+
+class NewEvent(NamedTuple):
+    '''
+    Fields of an event to add with `add_events` (see `add_event`)
 
-def add_event_tags(session, event_id, event_tags):
+    The event is added for `user_id`, or for the user with email `sender`
+    (who is added if needed).
+    '''
+    title: str
+    description: Union[str, bytes] # either text, or already compressed (see `utils.compressed_text`)
+    event_tags: List[int] = [0]
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    start_time: Optional[time] = None
+    end_time: Optional[time] = None
+    description_html: Union[str, bytes, None] = None
+    club_id: Optional[int] = None
+    location: Optional[str] = None
+    cta_link: Optional[str] = None
+    date_created: Optional[datetime] = None
+    user_id: Optional[int] = None
+    sender: Optional[str] = None
+    images: Sequence[str] = () # see `add_event_images`
+    message_id: Optional[str] = None # see `add_ingested_message`
+
+def add_events(session, new_events, commit=True):
+    '''
+    Adds many events to the database (along with their senders, tags,
+    description chunks, images and Message-IDs), in a single transaction
+
+    Rows of each table are inserted at once, and nothing is committed until
+    every row was inserted (or at all, if `commit` is False, so that the
+    caller can add more in the same transaction). Like `add_to_db`, the
+    transaction is rolled back if an insert fails.
+
+    Returns the id of each new event, or a list of None if add failed
+    '''
+    if not new_events:
+        return []
+    failed = [None] * len(new_events)
+    user_ids = add_users(session, [new_event.sender for new_event in new_events if new_event.user_id is None], commit=False)
+    if user_ids is None:
+        return failed
+
+    events = []
+    for new_event in new_events:
+        event = Event()
+        #Required fields
+        event.title = new_event.title
+        event.user_id = new_event.user_id if new_event.user_id is not None else user_ids[new_event.sender]
+
+        #Optional Fields
+        event.club_id = new_event.club_id
+        event.location = new_event.location
+        event.start_date = new_event.start_date if new_event.start_date else datetime.today().date() # Default to day received
+        event.end_date = new_event.end_date
+        event.start_time = new_event.start_time if new_event.start_time else datetime.min.time() # Default to midnight
+        event.end_time = new_event.end_time
+        event.cta_link = new_event.cta_link
+        event.date_created = new_event.date_created if new_event.date_created else datetime.now()
+        event.category_mask = tags_to_mask(new_event.event_tags)
+        events.append(event)
+    count_event_categories(session, events) # committed with the events
+
+    # events are inserted one by one, to get their ids back
+    if not add_to_db(session, events[0], others=events[1:], commit=False):
+        return failed
+
+    tags, descriptions, images, messages = [], [], [], []
+    for new_event, event in zip(new_events, events):
+        tags.extend({"event_id": event.id, "event_tag": tag} for tag in new_event.event_tags)
+        descriptions.extend(
+            {"event_id": event.id, "content_type": content_type, "content_index": content_index,
+             "data": None, "encoding": DescriptionEncoding.ZLIB.value, "compressed_data": data}
+            for content_type, content_index, data in description_chunks(new_event.description, new_event.description_html)
+        )
+        images.extend({"event_id": event.id, "image_name": image_name} for image_name in new_event.images)
+        if new_event.message_id is not None:
+            messages.append({"message_id": new_event.message_id, "event_id": event.id})
+    try:
+        _bulk_insert(session, EventTag, tags)
+        _bulk_insert(session, EventDescription, descriptions)
+        _bulk_insert(session, EventImage, images)
+        _bulk_insert(session, IngestedMessage, messages)
+        index_events(session, [
+            (event.id, new_event.title, new_event.location, description_text(new_event.description))
+            for new_event, event in zip(new_events, events)
+        ], new=True)
+        if commit:
+            session.commit()
+    except exc.IntegrityError:
+        session.rollback()
+        return failed
+    return [event.id for event in events]
+
+def _bulk_insert(session, model, rows):
+    '''
+    Insert rows (dictionaries of column values) of `model`'s table in a single statement
+    '''
+    if rows:
+        session.execute(model.__table__.insert(), rows)
+
+def add_event_tags(session, event_id, event_tags, commit=True):
     '''
     Given event_tags (list of ints representing enum Categories)
     and an event_id, link the event to those tags
     
     Note: Will delete existing event_tags if they exist
     '''
+    event = session.query(Event).filter(Event.id==event_id).first()
+    if not event:
+        return #Event doesn't exist
+    count_event_categories(session, [event], -1)
+    _set_event_tags(session, event, event_tags)
+    count_event_categories(session, [event])
+    if commit:
+        session.commit()
+
+def _set_event_tags(session, event, event_tags):
+    '''
+    Replace the tags of an existing event (its bitmask and event_tags rows), without committing
+    '''
     #Delete existing event_tags
     session.query(EventTag).filter(
-            EventTag.event_id==event_id
+            EventTag.event_id==event.id
         ).delete()
+    event.category_mask = tags_to_mask(event_tags)
     
     #Create new event tags
     new_tags = []
     for tag in event_tags:
-        new_tags.append(EventTag(event_id,tag))
+        new_tags.append(EventTag(event.id,tag))
     session.add_all(new_tags)
-    session.commit()
-    
-def add_user(session, email,user_privilege=0):
+
+def add_user(session, email,user_privilege=0, commit=True):
     '''
     Add a new user to the database (if it doesn't exist). 
     
@@ -366,12 +715,33 @@ def add_user(session, email,user_privilege=0):
         return curr_user.id
     
     new_user = User(email,user_privilege)
-    committed = add_to_db(session, new_user)
+    committed = add_to_db(session, new_user, commit=commit)
     if committed:
         session.flush()
         return new_user.id
     return None
 
+def add_users(session, emails, commit=True):
+    '''
+    Add the users with the given emails to the database (those that do not exist),
+    with one query to find them, and one to insert those missing
+
+    Returns a dictionary mapping each email to the id of its user, or None if add failed
+    '''
+    emails = list(dict.fromkeys(emails))
+    user_ids = dict(_query_in(session.query(User.email, User.id), User.email, emails))
+    missing = [email for email in emails if email not in user_ids]
+    if missing:
+        try:
+            _bulk_insert(session, User, [{"email": email, "user_privilege": 0} for email in missing])
+            if commit:
+                session.commit()
+        except exc.IntegrityError:
+            session.rollback()
+            return None
+        user_ids.update(_query_in(session.query(User.email, User.id), User.email, missing))
+    return user_ids
+
 def add_club(session, club_name,club_abbrev=None,exec_email=None):
     '''
     Add a new club to the database (if it doesn't exist). 
@@ -414,36 +784,36 @@ def add_club_member(session, club_id,user_id,member_privilege=0):
     new_membership = ClubMembership(user_id,club_id,member_privilege)
     add_to_db(session, new_membership)
     
-def add_event_description(session, event_id, description_plaintext, description_html):
+def add_event_description(session, event_id, description_plaintext, description_html, commit=True):
     """
     Add an event email description (its plaintext and/or html version)
     to the database
     
-    Entries will be segmented based on type (plain vs html) and size (due 
-    to limitations with max packet sizes in the SQL database).
+    Entries will be segmented based on type (plain vs html), compressed
+    (see `db.descriptions`), and segmented based on size (due to limitations
+    with max packet sizes in the SQL database).
     
-    If one of the descriptions provided is None, the database will store 
-    an empty string in its place.
+    If one of the descriptions provided is None or empty, nothing is stored
+    for it (and it reads as an empty string).
     """
-    
-    def add_event_description_helper(description_type, data):
-        """
-        Add event description of a given description type to database.
-        Divide the data into multiple entries as needed.
-        """
-        chunked_data = [data[i:i+EMAIL_DESCRIPTION_CHUNK_SIZE] for i in range(0, len(data), EMAIL_DESCRIPTION_CHUNK_SIZE)]
-        for chunk_index, chunk_data in enumerate(chunked_data):
-            description = EventDescription(event_id, description_type.value, chunk_index, chunk_data)
-            session.add(description)
-
-    plaintext_to_add = description_plaintext or ""
-    add_event_description_helper(EventDescriptionType.PLAINTEXT, plaintext_to_add)
-
-    html_to_add = description_html or ""
-    add_event_description_helper(EventDescriptionType.HTML, html_to_add)
-    session.commit()
+    for content_type, content_index, data in description_chunks(description_plaintext, description_html):
+        session.add(EventDescription(event_id, content_type, content_index, None, DescriptionEncoding.ZLIB.value, data))
+    session.flush()
+    reindex_events(session, [event_id])
+    if commit:
+        session.commit()
+
+def add_event_images(session, event_id, image_names, commit=True):
+    '''
+    Given names of the images inserted in the description of an event (see
+    `utils.email_parser.ImageVariants`), link the event to those images, so
+    that they are not collected as garbage
+    '''
+    session.add_all([EventImage(event_id, image_name) for image_name in image_names])
+    if commit:
+        session.commit()
 
-def add_session_id(session, email_addr, token=None):
+def add_session_id(session, email_addr, token=None, commit=True):
     """
     Add a new session id to the database for a user login.
 
@@ -451,12 +821,23 @@ def add_session_id(session, email_addr, token=None):
     """
     if token is None: token = generate_API_token(length=SESSION_ID_LENGTH)
     new_session_id = SessionId(token, email_addr)
-    committed = add_to_db(session, new_session_id)
+    committed = add_to_db(session, new_session_id, commit=commit)
     if committed:
         session.flush()
         return new_session_id.session_id
     return None
     
+## Image functions
+
+def get_referenced_image_names(session):
+    '''
+    Return the set of names of the images inserted in the description of an event
+    '''
+    rows = session.query(EventImage.image_name).join(
+        Event, Event.id == EventImage.event_id,
+    ).distinct().all()
+    return {row.image_name for row in rows}
+
 ## Update functions
 
 def update_event_description(session, event_id, description, description_html):
@@ -484,7 +865,7 @@ def update_event_description(session, event_id, description, description_html):
 
 def update_event(session, event_id, title, description, event_tags=None,\
                 start_date=None, end_date=None, start_time=None, end_time=None, \
-                description_html=None, club_id=None, location=None, cta_link=None):
+                description_html=None, club_id=None, location=None, cta_link=None, commit=True):
     '''
     Update an existing event with id `event_id` in the database
     
@@ -509,6 +890,8 @@ def update_event(session, event_id, title, description, event_tags=None,\
     error=False
     # Attempt to make corresponding updates
     try: 
+        # Uncount the event from its previous day and categories
+        count_event_categories(session, [event], -1)
         #Required fields
         event.title = title
         event.description = description
@@ -520,14 +903,178 @@ def update_event(session, event_id, title, description, event_tags=None,\
         event.start_time = start_time
         event.end_time = end_time
         event.cta_link = cta_link
+        #Update event tags if necessary
+        if event_tags:
+            _set_event_tags(session, event, event_tags)
+        count_event_categories(session, [event])
+        session.flush()
+        reindex_events(session, [event_id])
     except:
         session.rollback()
         error=True
     else:
+        if commit:
+            session.commit()
+    
+    return not error
+
+## Ingestion queue
+
+def enqueue_email(session, raw, commit=True):
+    '''
+    Store a raw email in the ingestion queue, to be ingested later by a worker
+    (see `ingest_worker.py`)
+
+    Returns id of the new ingestion job
+    '''
+    job = IngestJob(raw)
+    session.add(job)
+    if commit:
         session.commit()
+    else:
+        session.flush()
+    return job.id
 
-    #Update event tags if necessary
-    if event_tags:
-        add_event_tags(session, event_id, event_tags)
-    
-    return not error
\ No newline at end of file
+def get_ingested_event_ids(session, message_ids):
+    '''
+    Given Message-IDs of emails, return a dictionary mapping those that were
+    already added as events to the id of their event
+    '''
+    message_ids = list(set(message_ids))
+    if not message_ids:
+        return {}
+    rows = session.query(IngestedMessage.message_id, IngestedMessage.event_id).filter(
+        IngestedMessage.message_id.in_(message_ids),
+    ).all()
+    return dict(rows)
+
+def add_ingested_message(session, message_id, event_id, commit=True):
+    '''
+    Record that the email with Message-ID `message_id` was added as event `event_id`
+    '''
+    session.add(IngestedMessage(message_id, event_id))
+    if commit:
+        session.commit()
+
+def count_pending_ingest_jobs(session):
+    '''
+    Count the ingestion jobs waiting for a worker (including those waiting to be retried)
+    '''
+    return session.query(db.func.count(IngestJob.id)).filter(
+        IngestJob.status == IngestJobStatus.PENDING.value,
+    ).scalar()
+
+def _claimable_ingest_jobs(now):
+    '''
+    Filter for the ingestion jobs a worker can claim at time `now`: pending jobs
+    that are due, and jobs whose claim timed out (e.g. the server restarted
+    while they were being processed)
+    '''
+    return db.or_(
+        db.and_(
+            IngestJob.status == IngestJobStatus.PENDING.value,
+            IngestJob.available_at <= now,
+        ),
+        db.and_(
+            IngestJob.status == IngestJobStatus.PROCESSING.value,
+            IngestJob.claimed_at <= now - timedelta(seconds=config.INGEST_CLAIM_TIMEOUT),
+        ),
+    )
+
+def claim_ingest_job(session, now=None):
+    '''
+    Claim the oldest ingestion job that is ready to be processed
+
+    The claim is a single UPDATE statement, so that concurrent workers (even
+    in other server processes) never claim the same job.
+
+    Returns the claimed IngestJob (with its raw email), or None if there is
+    nothing to do
+    '''
+    now = now or datetime.now()
+    claimable = _claimable_ingest_jobs(now)
+    oldest_id = session.query(IngestJob.id).filter(claimable).order_by(IngestJob.id).limit(1).as_scalar()
+
+    token = uuid.uuid4().hex
+    claimed = session.query(IngestJob).filter(
+        IngestJob.id == oldest_id,
+        claimable,
+    ).update({
+        IngestJob.status: IngestJobStatus.PROCESSING.value,
+        IngestJob.claimed_by: token,
+        IngestJob.claimed_at: now,
+        IngestJob.attempts: IngestJob.attempts + 1,
+        IngestJob.date_updated: now,
+    }, synchronize_session=False)
+    session.commit()
+    if not claimed:
+        return None
+
+    return session.query(IngestJob).filter(
+        IngestJob.claimed_by == token,
+    ).options(sqlalchemy.orm.undefer(IngestJob.raw)).first()
+
+def settle_ingest_job(session, job, event_id=None, report=None, duplicate=False, commit=True):
+    '''
+    Mark an ingestion job as done (if an event was added), duplicate (if its
+    email was already added as event `event_id`) or rejected, and drop its raw email
+
+    `report` is the stage report of the ingestion (see `utils.email_parser.Digestion`)
+    '''
+    if duplicate:
+        job.status = IngestJobStatus.DUPLICATE.value
+    else:
+        job.status = (IngestJobStatus.DONE if event_id is not None else IngestJobStatus.REJECTED).value
+    job.event_id = event_id
+    job.report = json.dumps(report) if report is not None else None
+    job.raw = None
+    job.claimed_by = None
+    job.date_updated = datetime.now()
+    if commit:
+        session.commit()
+
+def fail_ingest_job(session, job, error, retry=True):
+    '''
+    Record that an ingestion job failed with `error`
+
+    The job is retried later (with exponential backoff), unless `retry` is
+    False or it already failed `config.INGEST_MAX_ATTEMPTS` times. It is then
+    moved to the dead-letter table instead.
+
+    Returns whether the job will be retried
+    '''
+    now = datetime.now()
+    job.error = error
+    job.claimed_by = None
+    job.date_updated = now
+
+    retry = retry and job.attempts < config.INGEST_MAX_ATTEMPTS
+    if retry:
+        delay = config.INGEST_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.status = IngestJobStatus.PENDING.value
+        job.available_at = now + timedelta(seconds=delay)
+    else:
+        session.add(IngestDeadLetter(job.id, job.raw, job.attempts, error))
+        job.status = IngestJobStatus.DEAD.value
+        job.raw = None
+    session.commit()
+    return retry
+
+def get_ingest_job_status(session, job_id):
+    '''
+    Get the status of an ingestion job, as a dictionary
+    (or None if there is no such job)
+    '''
+    job = session.query(IngestJob).filter(IngestJob.id==job_id).first()
+    if not job:
+        return None
+    return {
+        "id": job.id,
+        "status": IngestJobStatus(job.status).name.lower(),
+        "attempts": job.attempts,
+        "event_id": job.event_id,
+        "report": json.loads(job.report) if job.report else None,
+        "error": job.error,
+        "date_created": job.date_created,
+        "date_updated": job.date_updated,
+    }
@@ -0,0 +1,126 @@
+'''
+Compressed storage of event descriptions (the `event_descriptions` table)
+
+Descriptions are stored as the zlib-compressed bytes of their UTF-8 text, in
+the `compressed_data` column of as many rows as needed to keep each under
+`EMAIL_DESCRIPTION_CHUNK_SIZE` bytes. The HTML of dormspam (mostly the same
+inline styles, over and over) compresses about tenfold, so the database
+stays small and reading the descriptions of a day reads a few rows instead
+of megabytes.
+
+Descriptions added before compression are stored as text in the `data`
+column, and are still read as is. They are compressed by a migration (see
+`db.migrations`); to compress any left, and print how much space the
+descriptions take, cd into `src` and run:
+
+    python3 -m db.descriptions
+'''
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import sqlalchemy
+
+from db.schema import EventDescription, EventDescriptionType, DescriptionEncoding, EMAIL_DESCRIPTION_CHUNK_SIZE
+
+from utils.compressed_text import compress_text, decompress_text
+
+def compress_description(description: Union[str, bytes]) -> List[bytes]:
+    '''
+    Compress a description (unless it is already, see `utils.compressed_text`),
+    and divide its bytes into chunks of at most `EMAIL_DESCRIPTION_CHUNK_SIZE` bytes
+    '''
+    data = description if isinstance(description, bytes) else compress_text(description)
+    return [data[i:i+EMAIL_DESCRIPTION_CHUNK_SIZE] for i in range(0, len(data), EMAIL_DESCRIPTION_CHUNK_SIZE)]
+
+def description_chunks(description_plaintext, description_html) -> Iterator[Tuple[int, int, bytes]]:
+    '''
+    Iterate through the (content type, index, compressed bytes) of the chunks
+    of the plaintext and html descriptions of an event (each either text, or
+    already compressed)
+
+    Empty (or None) descriptions have no chunks.
+    '''
+    for description_type, text in (
+        (EventDescriptionType.PLAINTEXT, description_plaintext),
+        (EventDescriptionType.HTML, description_html),
+    ):
+        if not text:
+            continue
+        for chunk_index, chunk in enumerate(compress_description(text)):
+            yield description_type.value, chunk_index, chunk
+
+def join_description(chunks: Iterable[Tuple[int, str, bytes]]) -> str:
+    '''
+    Given the (encoding, data, compressed data) of the chunks of a description,
+    in order, return its text
+    '''
+    texts, compressed = [], []
+    for encoding, data, compressed_data in chunks:
+        if encoding == DescriptionEncoding.ZLIB.value:
+            compressed.append(compressed_data)
+        else:
+            texts.append(data or "")
+    if compressed:
+        texts.append(decompress_text(b"".join(compressed)))
+    return "".join(texts)
+
+def description_text(description: Union[str, bytes, None]) -> Optional[str]:
+    '''
+    Text of a description given as text, or already compressed
+    '''
+    return decompress_text(description) if isinstance(description, bytes) else description
+
+def compress_text_descriptions(connection, batch_size=200):
+    '''
+    Compress the descriptions still stored as text, a range of `batch_size`
+    event ids at a time, committing each range (unless it is called in a
+    transaction), so that writers are never held up for long
+
+    Returns the number of descriptions compressed
+    '''
+    table = EventDescription.__table__
+    is_text = table.c.encoding == DescriptionEncoding.TEXT.value
+    first_id, last_id = connection.execute(
+        sqlalchemy.select([sqlalchemy.func.min(table.c.event_id), sqlalchemy.func.max(table.c.event_id)]).where(is_text)
+    ).first()
+    if first_id is None:
+        return 0
+    compressed = 0
+    for start in range(first_id, last_id + 1, batch_size):
+        in_range = table.c.event_id.between(start, start + batch_size - 1) & is_text
+        with connection.begin():
+            texts = {}
+            rows = connection.execute(
+                sqlalchemy.select([table.c.event_id, table.c.content_type, table.c.data]).where(in_range)
+                .order_by(table.c.event_id, table.c.content_type, table.c.content_index)
+            )
+            for event_id, content_type, data in rows:
+                texts.setdefault((event_id, content_type), []).append(data or "")
+            if not texts:
+                continue
+            connection.execute(table.delete().where(in_range))
+            connection.execute(table.insert(), [
+                {"event_id": event_id, "content_type": content_type, "content_index": chunk_index,
+                 "data": None, "encoding": DescriptionEncoding.ZLIB.value, "compressed_data": chunk}
+                for (event_id, content_type), text in texts.items()
+                for chunk_index, chunk in enumerate(compress_description("".join(text)))
+            ])
+        compressed += len(texts)
+    return compressed
+
+def description_sizes(connection):
+    '''
+    Return the number of bytes of descriptions stored as text, and as compressed bytes
+    '''
+    return connection.execute(
+        "SELECT COALESCE(SUM(length(CAST(data AS BLOB))), 0), COALESCE(SUM(length(compressed_data)), 0)"
+        " FROM event_descriptions"
+    ).first()
+
+if __name__ == '__main__':
+    from db.schema import get_engine
+    with get_engine().connect() as connection:
+        compressed = compress_text_descriptions(connection)
+        text_bytes, compressed_bytes = description_sizes(connection)
+    print(f"Compressed {compressed} descriptions")
+    print(f"Descriptions take {text_bytes} bytes as text, and {compressed_bytes} bytes compressed")
+    print("(run VACUUM on the database to give the space freed back to the file system)")
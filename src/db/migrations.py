@@ -0,0 +1,236 @@
+'''
+Versioned migrations of the database schema
+
+`SQLBase.metadata.create_all` only creates the tables that are missing, so
+any change to an existing table (an index, a column, a backfill) also needs
+a migration below. Migrations are applied once each, in order (right after
+`create_all`, see `setup_database`), and recorded in the `schema_migrations`
+table. They are applied before the server starts (see `run_prod.sh`), never
+by its workers: the engine of a process only checks that none is missing
+(see `db.schema.get_engine`).
+
+Since `create_all` creates new databases with the latest schema, migrations
+must do nothing when their change was already made (the helpers below take
+care of that).
+
+To list the migrations, and whether they were applied, cd into `src` and run:
+
+    python3 -m db.migrations
+
+To create the missing tables, and apply the missing migrations:
+
+    python3 -m db.migrations upgrade
+'''
+import time
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, MetaData, Table
+
+# versions of the migrations applied to the database
+migrations_table = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128)),
+    Column("date_applied", DateTime),
+)
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable # called with a connection, in a transaction (unless `transaction` is False)
+    transaction: bool = True
+
+MIGRATIONS: List[Migration] = []
+
+def migration(version, name, transaction=True):
+    '''
+    Function decorator registering a migration, as the next version
+
+    Migrations that rewrite many rows can commit them in batches themselves
+    (with `transaction=False`), so that they never hold the write lock for
+    long. They must then be safe to apply again if they were interrupted.
+    '''
+    def decorator(apply):
+        assert version == len(MIGRATIONS) + 1, "Migrations must be numbered in order"
+        MIGRATIONS.append(Migration(version, name, apply, transaction))
+        return apply
+    return decorator
+
+## Helpers
+
+def has_index(connection, table_name, index_name):
+    if connection.dialect.name == "sqlite":
+        # SQLAlchemy does not reflect the indexes on expressions of SQLite
+        return connection.execute(sqlalchemy.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = :table_name AND name = :index_name"
+        ), table_name=table_name, index_name=index_name).first() is not None
+    return index_name in {index["name"] for index in sqlalchemy.inspect(connection).get_indexes(table_name)}
+
+def create_index(connection, table_name, index_name, *column_names):
+    '''
+    Create an index on `table_name`, unless it already exists
+    '''
+    if has_index(connection, table_name, index_name):
+        return
+    # only the names of the columns are needed (reflecting the table would warn about indexes on expressions)
+    table = Table(table_name, MetaData(), *(Column(name) for name in column_names))
+    sqlalchemy.Index(index_name, *(table.c[name] for name in column_names)).create(connection)
+
+def add_column(connection, table_name, column):
+    '''
+    Add `column` (a new `Column` object) to `table_name`, unless it already exists
+
+    Note: Columns added to existing rows need a `server_default` if they are not nullable
+    '''
+    columns = sqlalchemy.inspect(connection).get_columns(table_name)
+    if column.name in {existing["name"] for existing in columns}:
+        return False
+    Table(table_name, MetaData(), column) # CreateColumn needs the column to be in a table
+    ddl = sqlalchemy.schema.CreateColumn(column).compile(dialect=connection.dialect)
+    connection.execute(f"ALTER TABLE {table_name} ADD COLUMN {ddl}")
+    return True
+
+## Migrations
+
+@migration(1, "Index the columns queried by db_operations")
+def add_query_indexes(connection):
+    create_index(connection, "events", "ix_events_start_date", "start_date", "start_time", "title")
+    create_index(connection, "events", "ix_events_date_created", "date_created", "title")
+    create_index(connection, "event_tags", "ix_event_tags_event_id", "event_id", "event_tag")
+    create_index(connection, "event_descriptions", "ix_event_descriptions_event_id", "event_id", "content_type", "content_index")
+    create_index(connection, "session_ids", "ix_session_ids_email_addr", "email_addr", "session_id")
+    create_index(connection, "club_memberships", "ix_club_memberships_user_id", "user_id", "club_id")
+    create_index(connection, "ingest_jobs", "ix_ingest_jobs_claimed_by", "claimed_by")
+
+@migration(2, "Store the categories of events as a bitmask")
+def add_event_category_mask(connection):
+    add_column(connection, "events", Column("category_mask", Integer, nullable=False, server_default="0"))
+    # even if the column already existed: SQLite commits ALTER TABLE right away,
+    # so a backfill that was interrupted left it, with masks of 0
+    connection.execute(
+        "UPDATE events SET category_mask = COALESCE(("
+        "  SELECT SUM(DISTINCT 1 << event_tags.event_tag) FROM event_tags"
+        "  WHERE event_tags.event_id = events.id"
+        "), 0)"
+    )
+    create_index(connection, "events", "ix_events_start_date_category_mask", "start_date", "category_mask")
+    create_index(connection, "events", "ix_events_date_created_category_mask", "date_created", "category_mask")
+
+@migration(3, "Count the events of each category on each day")
+def add_daily_category_counts(connection):
+    # the table itself is created by `create_all`
+    from db.category_counts import rebuild_daily_category_counts
+    rebuild_daily_category_counts(connection)
+
+@migration(4, "Compress the descriptions of events", transaction=False)
+def compress_event_descriptions(connection):
+    add_column(connection, "event_descriptions", Column("encoding", Integer, nullable=False, server_default="0"))
+    add_column(connection, "event_descriptions", Column("compressed_data", LargeBinary))
+    from db.descriptions import compress_text_descriptions
+    compress_text_descriptions(connection)
+
+@migration(5, "Index events for full-text search", transaction=False)
+def add_events_search_index(connection):
+    if connection.dialect.name != "sqlite":
+        return # FTS5 is specific to SQLite
+    from db.schema import EVENTS_FTS_DDL
+    from db.search import rebuild_search_index
+    connection.execute(EVENTS_FTS_DDL)
+    rebuild_search_index(connection) # from scratch, if it was interrupted
+
+@migration(6, "Index the pages of /get_events_in_range")
+def add_event_page_index(connection):
+    from db.schema import Event
+    if not has_index(connection, "events", "ix_events_page"):
+        # on expressions, which `create_index` does not build
+        next(index for index in Event.__table__.indexes if index.name == "ix_events_page").create(connection)
+
+## Runner
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+def applied_migrations(connection):
+    '''
+    Return a dictionary mapping the versions applied to the database to when they were
+    '''
+    if not migrations_table.exists(connection):
+        return {} # a new database
+    rows = connection.execute(sqlalchemy.select([migrations_table.c.version, migrations_table.c.date_applied]))
+    return {row.version: row.date_applied for row in rows}
+
+def check_schema(engine):
+    '''
+    Raise `SchemaOutOfDate` if the database is missing migrations
+    '''
+    with engine.connect() as connection:
+        done = applied_migrations(connection)
+    missing = [migration.version for migration in MIGRATIONS if migration.version not in done]
+    if missing:
+        raise SchemaOutOfDate(
+            f"The database is missing migrations {missing}, apply them first with: python3 -m db.migrations upgrade"
+        )
+
+def setup_database(engine):
+    '''
+    Create the missing tables, then apply the missing migrations
+
+    Returns the versions applied
+    '''
+    from db.schema import SQLBase
+    SQLBase.metadata.create_all(engine)
+    return upgrade(engine)
+
+def upgrade(engine, retries=3):
+    '''
+    Apply the migrations the database is missing, in order
+
+    Returns the versions applied
+    '''
+    for attempt in range(retries):
+        try:
+            return _upgrade(engine)
+        except sqlalchemy.exc.DBAPIError:
+            # e.g. another server process started at the same time and applied them
+            if attempt == retries - 1:
+                raise
+            time.sleep(1)
+
+def _upgrade(engine):
+    migrations_table.create(engine, checkfirst=True)
+    applied = []
+    with engine.connect() as connection:
+        done = applied_migrations(connection)
+        for migration in MIGRATIONS:
+            if migration.version in done:
+                continue
+            if not migration.transaction:
+                migration.apply(connection)
+            with connection.begin():
+                if migration.transaction:
+                    migration.apply(connection)
+                connection.execute(migrations_table.insert().values(
+                    version=migration.version,
+                    name=migration.name,
+                    date_applied=datetime.now(),
+                ))
+            applied.append(migration.version)
+    return applied
+
+if __name__ == '__main__':
+    import sys
+    from db.schema import new_engine
+    engine = new_engine()
+    if sys.argv[1:] == ["upgrade"]:
+        applied = setup_database(engine)
+        print(f"Applied migrations {applied}" if applied else "The database is up to date")
+    elif sys.argv[1:]:
+        sys.exit("usage: python3 -m db.migrations [upgrade]")
+    else:
+        with engine.connect() as connection:
+            done = applied_migrations(connection)
+        for migration in MIGRATIONS:
+            status = f"applied {done[migration.version]:%Y-%m-%d %H:%M}" if migration.version in done else "pending"
+            print(f"{migration.version:>4}  {migration.name:<60} {status}")
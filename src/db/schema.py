@@ -2,16 +2,21 @@ from ast import In
 import datetime
 
 import configs.creds as creds
+import configs.server_configs as config
 import enum
+import os
+import threading
 
 #SQLAlchemy
 import sqlalchemy
 import sqlalchemy.orm
 import sqlalchemy.ext.declarative
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Text, Date, Time, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Text, Date, Time, Enum, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import deferred
 
+from db.migrations import check_schema
+
 DATABASE_NAME = creds.database_name
 SQL_URL = "mysql+mysqlconnector://%s:%s@sql.mit.edu/%s?charset=utf8" % (
     creds.user, creds.password, DATABASE_NAME
@@ -33,6 +38,7 @@ CLUB_NAME_LENGTH = 128
 CLUB_NAME_ABBREV_LENGTH = 32
 EMAIL_DESCRIPTION_CHUNK_SIZE = 65000 # bytes
 SESSION_ID_LENGTH = 32
+IMAGE_NAME_LENGTH = 64 # hex SHA-256 of the image
 
 class UserPrivilege(enum.Enum):
     NORMAL = 0 #Default
@@ -46,6 +52,25 @@ class EventDescriptionType(enum.Enum):
     PLAINTEXT = 0
     HTML = 1
 
+class DescriptionEncoding(enum.Enum): # How a description chunk is stored (see `db/descriptions.py`)
+    TEXT = 0 # Text in `data` (descriptions added before they were compressed)
+    ZLIB = 1 # Bytes of the zlib-compressed UTF-8 description in `compressed_data`
+
+class DateKind(enum.Enum): # Which date of an event it is counted on
+    START = 0 # Parsed start date
+    SENT = 1 # Date the email was sent
+
+# Category of the rows of DailyCategoryCount counting all events of the day, whatever their tags
+ALL_CATEGORIES = -1
+
+class IngestJobStatus(enum.Enum):
+    PENDING = 0 # Waiting for a worker (possibly to be retried)
+    PROCESSING = 1 # Claimed by a worker
+    DONE = 2 # Added as an event
+    REJECTED = 3 # Not dormspam, or not from an accepted sender
+    DEAD = 4 # Failed too many times, see IngestDeadLetter
+    DUPLICATE = 5 # Already ingested, see IngestedMessage
+
 
 ##############################################################
 # Setup Stages
@@ -53,12 +78,64 @@ class EventDescriptionType(enum.Enum):
 
 # Initialization Steps
 SQLBase = sqlalchemy.ext.declarative.declarative_base()
-sqlengine = sqlalchemy.create_engine(SQL_URL,pool_recycle=600,pool_pre_ping=True)
-SQLBase.metadata.bind = sqlengine
+
+# Engine of this process, see `get_engine`
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    '''
+    Get the engine of this process, creating it the first time it is needed
+
+    The engine is never created at import: a process forked after it was
+    created (e.g. a gunicorn worker) gets its own, rather than sharing the
+    pooled connections of its parent.
+
+    The schema is not changed here: the database must have been created and
+    migrated beforehand (`python3 -m db.migrations upgrade`, see `run_prod.sh`),
+    so that no request ever waits on a migration. Raises `SchemaOutOfDate` otherwise.
+    '''
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            engine = new_engine()
+            check_schema(engine)
+            _engine, _engine_pid = engine, os.getpid()
+        return _engine
+
+def new_engine():
+    '''
+    Create an engine of the database (with `configure_connections`)
+    '''
+    engine = sqlalchemy.create_engine(SQL_URL,pool_recycle=600,pool_pre_ping=True)
+    configure_connections(engine)
+    return engine
+
+def configure_connections(engine):
+    '''
+    Apply `config.SQLITE_PRAGMAS` to each new connection of a SQLite engine
+    '''
+    if engine.dialect.name != "sqlite":
+        return
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in config.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
 
 # Main primitives
+# Note: Indexes added to existing tables also need a migration (see db/migrations.py)
 class Event(SQLBase):
     __tablename__ = "events"
+    __table_args__ = (
+        Index("ix_events_start_date", "start_date", "start_time", "title"), # Events by day/month, in order
+        Index("ix_events_date_created", "date_created", "title"), # Same, by sent date
+        Index("ix_events_start_date_category_mask", "start_date", "category_mask"), # Categories by day
+        Index("ix_events_date_created_category_mask", "date_created", "category_mask"), # Same, by sent date
+    )
     id = Column(Integer, primary_key=True,
                 unique=True, autoincrement=True)
 
@@ -78,6 +155,8 @@ class Event(SQLBase):
     # description_html = deferred(Column(Text, default=""), group="full_description")
 
     tags = relationship('EventTag', backref='Event', lazy='dynamic')
+    # Same tags, as a bitmask with bit `1 << tag` set for each (see `category_parser.tags_to_mask`)
+    category_mask = Column(Integer, nullable=False, default=0, server_default="0")
 
     cta_link = Column(String(EVENT_LINK_LENGTH))
     start_date = Column(Date)
@@ -91,6 +170,24 @@ class Event(SQLBase):
     date_created = Column(DateTime, default=datetime.datetime.now) #Date the email was sent
     date_updated = Column(DateTime, default=datetime.datetime.now)
 
+# Start time and title of events in the order of the pages of `/get_events_in_range`
+# (see `db_operations.EVENT_PAGE_ORDER`): events with none sort like midnight (or an
+# empty title), since keys with NULL never compare in the row values of the pages
+EVENT_PAGE_START_TIME = sqlalchemy.func.coalesce(Event.__table__.c.start_time, sqlalchemy.literal_column("'00:00:00.000000'", type_=Time))
+EVENT_PAGE_TITLE = sqlalchemy.func.coalesce(Event.__table__.c.title, sqlalchemy.literal_column("''", type_=String))
+Index("ix_events_page", Event.__table__.c.start_date, EVENT_PAGE_START_TIME, EVENT_PAGE_TITLE) # Pages of events, in order
+
+# Full-text index of the title, location and plaintext description of events
+# (see `db/search.py`), with the id of each event as rowid. SQLite only: it
+# is created along with the events table (and by a migration for existing
+# databases).
+EVENTS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5("
+    "title, location, description, tokenize = 'porter unicode61 remove_diacritics 2')"
+)
+sqlalchemy.event.listen(Event.__table__, "after_create", sqlalchemy.DDL(EVENTS_FTS_DDL).execute_if(dialect="sqlite"))
+sqlalchemy.event.listen(Event.__table__, "before_drop", sqlalchemy.DDL("DROP TABLE IF EXISTS events_fts").execute_if(dialect="sqlite"))
+
 
 class User(SQLBase):
     __tablename__ = "users"
@@ -131,6 +228,9 @@ class Club(SQLBase):
 # Relationship Tables
 class ClubMembership(SQLBase): #Map user to clubs they are in
     __tablename__ = "club_memberships"
+    __table_args__ = (
+        Index("ix_club_memberships_user_id", "user_id", "club_id"),
+    )
     id = Column(Integer, primary_key=True,
             unique=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"),nullable=False)
@@ -144,6 +244,9 @@ class ClubMembership(SQLBase): #Map user to clubs they are in
 
 class EventTag(SQLBase): #Map event to tags it is associated with
     __tablename__ = "event_tags"
+    __table_args__ = (
+        Index("ix_event_tags_event_id", "event_id", "event_tag"),
+    )
     id = Column(Integer, primary_key=True,unique=True, autoincrement=True)
     event_id = Column(Integer, ForeignKey("events.id"),nullable=False)
     event_tag = Column(Integer, default=0)
@@ -157,21 +260,55 @@ class EventTag(SQLBase): #Map event to tags it is associated with
 
 class EventDescription(SQLBase): # Contain email description content for a specific Event
     __tablename__ = "event_descriptions"
+    __table_args__ = (
+        Index("ix_event_descriptions_event_id", "event_id", "content_type", "content_index"),
+    )
     id = Column(Integer, primary_key=True,unique=True, autoincrement=True)
     event_id = Column(Integer, ForeignKey("events.id"))
     content_type = Column(Integer) # Enum value denoting plaintext or html
     content_index = Column(Integer) # For maintain ordering of text
     data = Column(String(EMAIL_DESCRIPTION_CHUNK_SIZE), default="") # When storing, need to be < 1 MB to avoid  
                                                                     # SQL max_allowed_packet limits
+    encoding = Column(Integer, nullable=False, default=DescriptionEncoding.TEXT.value, server_default="0")
+    compressed_data = Column(LargeBinary(EMAIL_DESCRIPTION_CHUNK_SIZE)) # Same size limit as `data`
     
-    def __init__(self, event_id, content_type, content_index, data):
+    def __init__(self, event_id, content_type, content_index, data, encoding=DescriptionEncoding.TEXT.value, compressed_data=None):
         self.event_id = event_id
         self.content_type = content_type
         self.content_index = content_index
         self.data = data
+        self.encoding = encoding
+        self.compressed_data = compressed_data
+
+class EventImage(SQLBase): # Map event to the images inserted in its description, to collect the others
+    __tablename__ = "event_images"
+    id = Column(Integer, primary_key=True,unique=True, autoincrement=True)
+    event_id = Column(Integer, ForeignKey("events.id"), nullable=False, index=True)
+    image_name = Column(String(IMAGE_NAME_LENGTH), nullable=False, index=True) # See `utils.email_parser.ImageVariants`
+
+    def __init__(self, event_id, image_name):
+        self.event_id = event_id
+        self.image_name = image_name
+
+class DailyCategoryCount(SQLBase): # Number of events of each category on each day, see db/category_counts.py
+    __tablename__ = "daily_category_counts"
+    # Primary key in this order, so that a range of days of one kind is a single range scan
+    date_kind = Column(Integer, primary_key=True, autoincrement=False) # Enum value of DateKind
+    date = Column(Date, primary_key=True)
+    category = Column(Integer, primary_key=True, autoincrement=False) # Tag number, or ALL_CATEGORIES
+    count = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, date_kind, date, category, count=0):
+        self.date_kind = date_kind
+        self.date = date
+        self.category = category
+        self.count = count
 
 class SessionId(SQLBase): # keep track of valid session ids
     __tablename__ = "session_ids"
+    __table_args__ = (
+        Index("ix_session_ids_email_addr", "email_addr", "session_id"),
+    )
     id = Column(Integer, primary_key=True,unique=True, autoincrement=True)
     session_id = Column(String(SESSION_ID_LENGTH), nullable=False)
     email_addr = Column(String(EMAIL_LENGTH), unique=False, nullable=False)
@@ -181,5 +318,47 @@ class SessionId(SQLBase): # keep track of valid session ids
         self.session_id = session_id
         self.email_addr = email_addr
 
-# Implement schema
-SQLBase.metadata.create_all(sqlengine)
\ No newline at end of file
+class IngestJob(SQLBase): # Raw emails received by `/eat`, waiting to be ingested
+    __tablename__ = "ingest_jobs"
+    id = Column(Integer, primary_key=True,unique=True, autoincrement=True)
+    raw = deferred(Column(Text)) # Cleared once the job is settled
+    status = Column(Integer, default=IngestJobStatus.PENDING.value, index=True)
+    attempts = Column(Integer, default=0)
+    available_at = Column(DateTime, default=datetime.datetime.now) # Not claimed before then (retry backoff)
+    claimed_by = Column(String(32), index=True) # Random token of the claim currently processing the job
+    claimed_at = Column(DateTime)
+    event_id = Column(Integer, ForeignKey("events.id"))
+    report = Column(Text) # JSON report of the ingestion stages
+    error = Column(Text) # Last error encountered
+
+    date_created = Column(DateTime, default=datetime.datetime.now)
+    date_updated = Column(DateTime, default=datetime.datetime.now)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+class IngestDeadLetter(SQLBase): # Raw emails that could not be ingested, kept for replay
+    __tablename__ = "ingest_dead_letters"
+    id = Column(Integer, primary_key=True,unique=True, autoincrement=True)
+    job_id = Column(Integer, ForeignKey("ingest_jobs.id"), nullable=False)
+    raw = deferred(Column(Text))
+    attempts = Column(Integer)
+    error = Column(Text)
+    date_created = Column(DateTime, default=datetime.datetime.now)
+
+    def __init__(self, job_id, raw, attempts, error):
+        self.job_id = job_id
+        self.raw = raw
+        self.attempts = attempts
+        self.error = error
+
+class IngestedMessage(SQLBase): # Message-ID of the emails added as events, to skip duplicates
+    __tablename__ = "ingested_messages"
+    id = Column(Integer, primary_key=True,unique=True, autoincrement=True)
+    message_id = Column(String(EMAIL_MESSAGE_ID_LENGTH), unique=True, nullable=False)
+    event_id = Column(Integer, ForeignKey("events.id"))
+    date_created = Column(DateTime, default=datetime.datetime.now)
+
+    def __init__(self, message_id, event_id):
+        self.message_id = message_id
+        self.event_id = event_id
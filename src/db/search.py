@@ -0,0 +1,134 @@
+'''
+Full-text search over events (the `events_fts` table, see `db.schema.EVENTS_FTS_DDL`)
+
+The title, location and plaintext description of each event are indexed by
+SQLite's FTS5, with the id of the event as rowid. `db_operations` keeps the
+index up to date in the same transaction as the events (see `index_events`
+and `reindex_events`), and `db_operations.search_events` queries it.
+
+Existing databases are indexed by a migration, applied before the server
+starts (see `db.migrations`). If the index is ever out of sync (e.g. after the events table was edited by hand),
+cd into `src` and rebuild it from the events:
+
+    python3 -m db.search
+'''
+import html
+import re
+from typing import Iterable, Optional, Tuple
+
+import sqlalchemy
+
+from db.descriptions import join_description
+from db.schema import Event, EventDescription, EventDescriptionType
+
+# Relative weights of matches in the title, location and description, when ranking results
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+SNIPPET_TOKENS = 16 # Most tokens in a snippet
+BATCH_SIZE = 500 # Most ids in an `IN (...)` clause (see `db_operations.MAX_IN_CLAUSE_IDS`)
+# Marks around the matches in snippets, replaced with <mark> tags once the snippet is escaped
+_MATCH_START, _MATCH_END = "\x02", "\x03"
+
+def fts_query(text: str) -> Optional[str]:
+    '''
+    Turn the text typed by a user into an FTS5 query matching events with all
+    of its words (the last one as a prefix, as it may not be typed in full)
+
+    Returns None if the text has no words.
+    '''
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+def format_snippet(snippet: str) -> str:
+    '''
+    Escape a snippet of `search_query` for HTML, with its matches in <mark> tags
+    '''
+    return html.escape(snippet).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>")
+
+def search_query(filters: Iterable[str] = ()) -> str:
+    '''
+    SQL of a search of the index, ranked, returning the id of each event
+    matching `:query` and a snippet of its best matching column
+
+    `filters` are conditions on the `events` table the results must match.
+    '''
+    weights = ", ".join(str(weight) for weight in RANK_WEIGHTS)
+    return (
+        f"SELECT events_fts.rowid, snippet(events_fts, -1, '{_MATCH_START}', '{_MATCH_END}', '…', {SNIPPET_TOKENS})"
+        " FROM events_fts JOIN events ON events.id = events_fts.rowid"
+        " WHERE events_fts MATCH :query" + "".join(f" AND {condition}" for condition in filters) +
+        f" ORDER BY bm25(events_fts, {weights}), events_fts.rowid"
+        " LIMIT :limit OFFSET :offset"
+    )
+
+def index_events(connection, rows: Iterable[Tuple[int, str, str, str]], new=False):
+    '''
+    Index (or index again) events, given the (id, title, location, plaintext
+    description) of each
+
+    `connection` is a connection or a session (in a transaction). If `new`,
+    the events were just added, and have nothing to replace in the index.
+    '''
+    rows = [
+        {"id": event_id, "title": title or "", "location": location or "", "description": description or ""}
+        for event_id, title, location, description in rows
+    ]
+    if not rows:
+        return
+    if not new:
+        unindex_events(connection, [row["id"] for row in rows])
+    connection.execute(sqlalchemy.text(
+        "INSERT INTO events_fts (rowid, title, location, description) VALUES (:id, :title, :location, :description)"
+    ), rows)
+
+def unindex_events(connection, event_ids):
+    for i in range(0, len(event_ids), BATCH_SIZE):
+        connection.execute(sqlalchemy.text(
+            "DELETE FROM events_fts WHERE rowid IN :ids"
+        ).bindparams(sqlalchemy.bindparam("ids", expanding=True)), {"ids": event_ids[i:i+BATCH_SIZE]})
+
+def reindex_events(connection, event_ids):
+    '''
+    Index events again from their rows in the database (e.g. after they were updated)
+    '''
+    events, descriptions = Event.__table__, EventDescription.__table__
+    for i in range(0, len(event_ids), BATCH_SIZE):
+        batch = event_ids[i:i+BATCH_SIZE]
+        chunks = {event_id: [] for event_id in batch}
+        for event_id, *chunk in connection.execute(
+            sqlalchemy.select([descriptions.c.event_id, descriptions.c.encoding, descriptions.c.data, descriptions.c.compressed_data]).where(
+                descriptions.c.event_id.in_(batch) & (descriptions.c.content_type == EventDescriptionType.PLAINTEXT.value)
+            ).order_by(descriptions.c.event_id, descriptions.c.content_index)
+        ):
+            chunks[event_id].append(chunk)
+        index_events(connection, [
+            (event_id, title, location, join_description(chunks[event_id]))
+            for event_id, title, location in connection.execute(
+                sqlalchemy.select([events.c.id, events.c.title, events.c.location]).where(events.c.id.in_(batch))
+            )
+        ])
+
+def rebuild_search_index(connection, batch_size=BATCH_SIZE):
+    '''
+    Index all events again, replacing the previous index, committing each
+    batch of events (unless it is called in a transaction, e.g. while the
+    server is running, so that searches never see a partial index)
+
+    Returns the number of events indexed
+    '''
+    with connection.begin():
+        connection.execute("DELETE FROM events_fts")
+    event_ids = [row.id for row in connection.execute(sqlalchemy.select([Event.__table__.c.id]))]
+    for i in range(0, len(event_ids), batch_size):
+        with connection.begin():
+            reindex_events(connection, event_ids[i:i+batch_size])
+    with connection.begin():
+        connection.execute("INSERT INTO events_fts (events_fts) VALUES ('optimize')")
+    return len(event_ids)
+
+if __name__ == '__main__':
+    from db.schema import get_engine
+    with get_engine().begin() as connection:
+        events = rebuild_search_index(connection)
+    print(f"Indexed {events} events")
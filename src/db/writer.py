@@ -0,0 +1,118 @@
+'''
+Single writer of the database, in each server process
+
+Rather than committing on their own (each commit being a write lock, and an
+fsync), request handlers and ingest workers send their writes to the writer
+of their process (see `write`), and wait for it to be done. The writer is a
+thread owning its own connection: it waits up to `config.DB_WRITER_INTERVAL`
+seconds for more writes after the first one, and commits all of them in a
+single transaction. The busier the server, the more writes share a commit.
+
+Writes are functions of `db_operations` taking the database session as
+their first argument, and a `commit` argument, which the writer sets to
+False. If a transaction fails (or a write rolls it back, like `add_to_db`
+does when an insert fails), its writes are done again one by one, so that a
+single bad write never fails the others.
+
+Reads don't go through the writer: they use their own sessions (and
+connections), as before.
+'''
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, NamedTuple
+
+import sqlalchemy.orm
+
+import configs.server_configs as config
+
+class Write(NamedTuple):
+    function: Callable
+    args: tuple
+    kwargs: dict
+    future: Future
+
+class WriteRolledBack(Exception):
+    '''
+    Raised when a write rolled back the transaction it shared with other writes
+    '''
+
+class Writer(threading.Thread):
+    '''
+    Thread doing the writes sent to an engine, grouped in transactions
+    '''
+
+    def __init__(self, engine):
+        super().__init__(name="db-writer", daemon=True)
+        self.engine = engine
+        self.pid = os.getpid()
+        self.writes = queue.SimpleQueue()
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        future = Future()
+        self.writes.put(Write(function, args, kwargs, future))
+        return future
+
+    def run(self):
+        while True:
+            group = [self.writes.get()]
+            deadline = time.monotonic() + config.DB_WRITER_INTERVAL
+            while len(group) < config.DB_WRITER_MAX_WRITES:
+                try:
+                    group.append(self.writes.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self.execute(group)
+
+    def execute(self, group):
+        '''
+        Do a group of writes in a single transaction, and set their results
+        '''
+        session = sqlalchemy.orm.Session(bind=self.engine)
+        try:
+            results = []
+            for write in group:
+                transaction = session.transaction
+                results.append(write.function(session, *write.args, commit=False, **write.kwargs))
+                if session.transaction is not transaction and len(group) > 1:
+                    raise WriteRolledBack(write.function.__name__)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(group) == 1:
+                group[0].future.set_exception(e)
+            else:
+                for write in group:
+                    self.execute([write])
+            return
+        finally:
+            session.close()
+        for write, result in zip(group, results):
+            write.future.set_result(result)
+
+# writers of this process, by engine
+_writers: dict = {}
+_writers_lock = threading.Lock()
+
+def get_writer(engine) -> Writer:
+    '''
+    Get the writer of `engine` in this process, starting it if needed
+    '''
+    with _writers_lock:
+        writer = _writers.get(engine)
+        if writer is None or writer.pid != os.getpid():
+            writer = _writers[engine] = Writer(engine)
+            writer.start()
+        return writer
+
+def write(session, function, *args, **kwargs):
+    '''
+    Call `function(session, *args, commit=False, **kwargs)` in the writer of
+    the engine `session` is bound to (with the writer's own session), wait
+    until it is committed, and return its result
+
+    Raises the exception of `function`, or of the commit, if any.
+    '''
+    return get_writer(session.get_bind()).submit(function, *args, **kwargs).result()
@@ -0,0 +1,215 @@
+'''
+Background worker that compresses the images of ingested emails
+
+Ingesting an email only saves the original of each of its inserted images to
+the pending area (`config.PENDING_IMAGE_PATH`), and points its HTML to the
+URL the compressed image will have (see `utils.email_parser.save_pending_image`).
+Until the compressed image is ready, `/images/{image_name}` serves the
+original instead (see `main.py`).
+
+Only one server process at a time compresses images: the one holding the
+lock of the pending area, so that two processes never compress the same
+image. If it exits, another one takes over. Images are compressed in a pool
+of `config.IMAGE_PROCESSES` processes, so that they never hold the GIL of the
+process serving requests.
+
+Images are named after a hash of their bytes, so an image sent in many
+emails is only stored once. The images no event links to (e.g. those of
+rejected emails) are only deleted by the garbage collector.
+
+The worker can also run on its own, outside of the server, and the garbage
+collector from e.g. a daily cron job:
+
+    python3 image_worker.py
+    python3 image_worker.py --gc [--dry-run] [--legacy]
+'''
+import argparse
+import errno
+import fcntl
+import multiprocessing
+import os
+import re
+import threading
+import time
+import traceback
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import configs.server_configs as config
+import db.db_operations as db_operations
+from db.schema import EventDescriptionType
+from utils.email_parser import (
+    list_pending_images, compress_pending_image,
+    list_image_files, image_stem, find_image_names,
+)
+
+# names of content-addressed images (they were named with uuid1() before)
+_HASHED_IMAGE_NAME = re.compile(r"[0-9a-f]{64}")
+
+# set whenever an image is saved to the pending area by this process
+_new_image = threading.Event()
+
+def notify():
+    '''
+    Wake up the image worker of this process, since new images are pending
+    '''
+    _new_image.set()
+
+def compress_pending_images(pool: Executor | None) -> int:
+    '''
+    Compress the images of the pending area in `pool` (or one by one without a pool)
+
+    Returns the number of images compressed
+    '''
+    paths = list_pending_images()
+    if pool is None:
+        outcomes = []
+        for path in paths:
+            try:
+                outcomes.append(compress_pending_image(path))
+            except Exception as e:
+                outcomes.append(e)
+    else:
+        futures = [pool.submit(compress_pending_image, path) for path in paths]
+        outcomes = [future.exception() or future.result() for future in futures]
+
+    compressed = 0
+    for path, outcome in zip(paths, outcomes):
+        if isinstance(outcome, Exception):
+            # the original was moved to the failed area, and is served as is
+            print(f"Failed to compress {path}: {outcome!r}")
+        else:
+            compressed += 1
+    return compressed
+
+def try_lock(lock_file) -> bool:
+    '''
+    Try to take the lock of the pending area, without waiting
+    '''
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+        raise
+    return True
+
+class ImageWorker(threading.Thread):
+    '''
+    Thread compressing pending images until it is stopped, whenever it
+    holds the lock of the pending area
+    '''
+
+    def __init__(self):
+        super().__init__(name="image-worker", daemon=True)
+        self.stopping = threading.Event()
+
+    def run(self):
+        os.makedirs(config.PENDING_IMAGE_PATH, exist_ok=True)
+        pool = None
+        with open(os.path.join(config.PENDING_IMAGE_PATH, ".lock"), "w") as lock_file:
+            try:
+                locked = False
+                while not self.stopping.is_set():
+                    locked = locked or try_lock(lock_file)
+                    if locked:
+                        try:
+                            if pool is None and config.IMAGE_PROCESSES > 0:
+                                # spawned rather than forked, see `ingest_worker.get_ingest_pool`
+                                pool = ProcessPoolExecutor(
+                                    max_workers=config.IMAGE_PROCESSES,
+                                    mp_context=multiprocessing.get_context("spawn"),
+                                )
+                            compress_pending_images(pool)
+                        except Exception:
+                            traceback.print_exc() # e.g. the pool broke, start over next time
+                            if pool is not None:
+                                pool.shutdown(cancel_futures=True)
+                                pool = None
+                    _new_image.wait(config.IMAGE_POLL_INTERVAL)
+                    _new_image.clear()
+            finally:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+
+    def stop(self):
+        self.stopping.set()
+        _new_image.set()
+
+_worker: ImageWorker | None = None
+
+def start_image_worker():
+    '''
+    Start the image worker thread of this process
+    '''
+    global _worker
+    if _worker is None:
+        _worker = ImageWorker()
+        _worker.start()
+
+def stop_image_worker(timeout=None):
+    '''
+    Stop the image worker thread, letting it finish the images at hand
+    '''
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker.join(timeout)
+        _worker = None
+
+def collect_garbage(session, grace=None, dry_run=False, legacy=False):
+    '''
+    Delete the image files that no event links to (see `db_operations.add_event_images`),
+    unless they were modified less than `grace` seconds ago (by default
+    `config.IMAGE_GC_GRACE`), since their email may still be being ingested
+
+    Images named before they were content-addressed are only deleted if
+    `legacy` is True, and no event description points to them.
+
+    Returns the number of files and bytes deleted (or that would be if `dry_run`)
+    '''
+    grace = config.IMAGE_GC_GRACE if grace is None else grace
+    referenced = db_operations.get_referenced_image_names(session)
+    if legacy:
+        events = db_operations.get_all_events(session)
+        for html in db_operations.get_event_descriptions(session, events, EventDescriptionType.HTML):
+            referenced.update(find_image_names(html))
+
+    cutoff = time.time() - grace
+    files, size = 0, 0
+    for entry in list_image_files():
+        name = image_stem(entry.name)
+        if name in referenced or (not legacy and not _HASHED_IMAGE_NAME.fullmatch(name)):
+            continue
+        stat = entry.stat()
+        if stat.st_mtime >= cutoff:
+            continue
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue # e.g. just compressed
+        files += 1
+        size += stat.st_size
+    return files, size
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress pending images, or collect unreferenced ones")
+    parser.add_argument("--gc", action="store_true", help="delete the images no event links to, then exit")
+    parser.add_argument("--dry-run", action="store_true", help="with --gc, only count the images that would be deleted")
+    parser.add_argument("--legacy", action="store_true", help="with --gc, also collect images named before they were content-addressed")
+    args = parser.parse_args()
+
+    if args.gc:
+        with db_operations.session_scope() as session:
+            files, size = collect_garbage(session, dry_run=args.dry_run, legacy=args.legacy)
+        print(f"{'Would delete' if args.dry_run else 'Deleted'} {files} files ({size / 1e6:.1f} MB)")
+        return
+
+    start_image_worker()
+    try:
+        _worker.join()
+    except KeyboardInterrupt:
+        stop_image_worker()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+'''
+Ingest many raw emails at once, e.g. to replay weeks of emails that never
+made it to `/eat` (see `hotfixes/04-10-2024_Missing_Events`)
+
+Emails are read one at a time from an mbox file or a directory of `.eml`
+files (never the whole archive at once), digested in parallel in a process
+pool, and their events are added to the database in one transaction per
+batch. Emails whose Message-ID was already ingested are reported as
+duplicates instead of being added again.
+
+To use this script, cd into `src` and run:
+
+    python3 ingest_batch.py path/to/archive.mbox
+    python3 ingest_batch.py path/to/emails/ --glob "*.txt" --batch-size 100
+
+It prints a JSON report of each email, one per line. The same batches can
+also be posted to the server, see `/eat_batch` in `main.py`.
+'''
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+import db.db_operations as db_operations
+import ingest_worker
+from utils.email_parser import eat_and_summarize, EmailMissingHeaders
+
+DEFAULT_BATCH_SIZE = 50
+READ_CHUNK_SIZE = 1 << 16 # bytes
+
+# body lines starting with "From " are escaped as ">From " in mbox files
+_ESCAPED_FROM = re.compile(rb">+From ")
+
+class MboxSplitter:
+    '''
+    Splits an mbox file into raw emails, as its bytes are fed in chunks
+
+    Example: ::
+
+        >>> splitter = MboxSplitter()
+        >>> splitter.feed(b"From a@mit.edu Mon Jan 1\\nSubject: 1\\n\\n>From here\\n\\nFrom b")
+        []
+        >>> splitter.feed(b"@mit.edu Tue Jan 2\\nSubject: 2\\n")
+        [b'Subject: 1\\n\\nFrom here\\n']
+        >>> splitter.close()
+        [b'Subject: 2\\n']
+        >>>
+    '''
+
+    def __init__(self):
+        self.partial_line = b""
+        self.lines: List[bytes] = []
+        self.after_blank_line = True # "From " lines only separate emails after a blank line
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        '''
+        Feed the next chunk of the mbox file, and return the emails it completed
+        '''
+        lines = (self.partial_line + chunk).split(b"\n")
+        self.partial_line = lines.pop()
+        emails = []
+        for line in lines:
+            email = self._feed_line(line)
+            if email is not None:
+                emails.append(email)
+        return emails
+
+    def close(self) -> List[bytes]:
+        '''
+        Return the last email, once the whole mbox file was fed
+        '''
+        if self.partial_line:
+            self.lines.append(self.partial_line)
+            self.partial_line = b""
+        email = self._pop_email()
+        return [email] if email is not None else []
+
+    def _feed_line(self, line: bytes) -> Optional[bytes]:
+        email = None
+        if line.startswith(b"From ") and self.after_blank_line:
+            email = self._pop_email()
+        else:
+            if _ESCAPED_FROM.match(line):
+                line = line[1:]
+            self.lines.append(line)
+        self.after_blank_line = not line.strip()
+        return email
+
+    def _pop_email(self) -> Optional[bytes]:
+        lines, self.lines = self.lines, []
+        if lines and not lines[-1].strip():
+            lines.pop() # blank line separating it from the next email
+        if not lines:
+            return None
+        return b"\n".join(lines) + b"\n"
+
+def decode_email(raw: bytes) -> str:
+    '''
+    Decode a raw email, like `/eat` expects it
+    '''
+    return raw.decode("utf-8", errors="replace")
+
+def iter_mbox(path) -> Iterator[str]:
+    '''
+    Iterate through the raw emails of an mbox file, reading it in chunks
+    '''
+    splitter = MboxSplitter()
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_CHUNK_SIZE):
+            for raw in splitter.feed(chunk):
+                yield decode_email(raw)
+    for raw in splitter.close():
+        yield decode_email(raw)
+
+def iter_email_dir(path, pattern="*.eml") -> Iterator[str]:
+    '''
+    Iterate through the raw emails of a directory, one file per email
+    '''
+    for file in sorted(Path(path).glob(pattern)):
+        yield decode_email(file.read_bytes())
+
+def iter_emails(path, pattern="*.eml") -> Iterator[str]:
+    '''
+    Iterate through the raw emails of an mbox file or a directory
+    '''
+    if os.path.isdir(path):
+        return iter_email_dir(path, pattern)
+    return iter_mbox(path)
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def digest_batch(pool: Optional[Executor], raws: List[str]) -> list:
+    '''
+    Digest raw emails in parallel in `pool` (or one by one without a pool)
+
+    Returns, for each email, either what `eat_and_summarize` returned, or the
+    exception it raised
+    '''
+    if pool is None:
+        futures = None
+    else:
+        futures = [pool.submit(eat_and_summarize, raw) for raw in raws]
+
+    digested = []
+    for i, raw in enumerate(raws):
+        try:
+            digested.append(futures[i].result() if futures else eat_and_summarize(raw))
+        except Exception as e:
+            digested.append(e)
+    return digested
+
+async def digest_batch_async(pool: Optional[Executor], raws: List[str]) -> list:
+    '''
+    Same as `digest_batch`, without blocking the event loop
+    '''
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(loop.run_in_executor(pool, eat_and_summarize, raw) for raw in raws),
+        return_exceptions=True,
+    )
+
+def _report_error(index, error, permanent):
+    if isinstance(error, EmailMissingHeaders):
+        message = str(error)
+    else:
+        message = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+    return {"index": index, "status": "error", "error": message, "permanent": permanent}
+
+def write_batch(session, digested: list, start_index=0) -> List[dict]:
+    '''
+    Add the events of a batch of digested emails (see `digest_batch`) to the
+    database, in a single transaction
+
+    If the transaction fails, the emails are added again one by one, so that
+    a single bad email does not lose the whole batch.
+
+    Returns a report for each email: its status ("accepted", "rejected",
+    "duplicate" or "error"), along with the id of its event, or the reason
+    it was rejected. Errors are "permanent" when the email itself could not be
+    digested (e.g. missing headers), since sending it again would not help,
+    unlike e.g. failing to write it to the database.
+    '''
+    summaries = [outcome[1] for outcome in digested if not isinstance(outcome, BaseException) and outcome[1]]
+    event_ids = db_operations.get_ingested_event_ids(session, [summary.message_id for summary in summaries])
+
+    try:
+        # the first email with each new Message-ID is added, the others are duplicates
+        new_summaries = {}
+        for summary in summaries:
+            if summary.message_id not in event_ids:
+                new_summaries.setdefault(summary.message_id, summary)
+        new_event_ids = ingest_worker.add_digested_events(session, list(new_summaries.values()), commit=False)
+        if None in new_event_ids:
+            raise RuntimeError("failed to add event")
+        accepted = set(new_summaries)
+        event_ids.update(zip(new_summaries, new_event_ids))
+
+        reports = []
+        for index, outcome in enumerate(digested, start_index):
+            if isinstance(outcome, BaseException):
+                # unless the pool broke down, digesting the email again would fail the same way
+                reports.append(_report_error(index, outcome, not isinstance(outcome, BrokenExecutor)))
+                continue
+
+            report, summary = outcome
+            if summary is None:
+                reports.append({"index": index, "status": "rejected", "rejection": report["rejection"]})
+            elif summary.message_id in accepted:
+                accepted.remove(summary.message_id)
+                reports.append({
+                    "index": index, "status": "accepted",
+                    "message_id": summary.message_id, "event_id": event_ids[summary.message_id],
+                })
+            else:
+                reports.append({
+                    "index": index, "status": "duplicate",
+                    "message_id": summary.message_id, "event_id": event_ids[summary.message_id],
+                })
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        if len(digested) == 1:
+            return [_report_error(start_index, e, False)]
+        reports = []
+        for index, outcome in enumerate(digested, start_index):
+            reports.extend(write_batch(session, [outcome], index))
+    return reports
+
+def ingest_batches(raws: Iterable[str], pool: Optional[Executor], batch_size=DEFAULT_BATCH_SIZE) -> Iterator[dict]:
+    '''
+    Ingest raw emails one batch at a time, and iterate through their reports
+    '''
+    index = 0
+    for batch in batched(raws, batch_size):
+        digested = digest_batch(pool, batch)
+        with db_operations.session_scope() as session:
+            yield from write_batch(session, digested, index)
+        index += len(batch)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest an mbox file, or a directory of emails")
+    parser.add_argument("path", help="mbox file, or directory with one email per file")
+    parser.add_argument("--glob", default="*.eml", help="pattern of the email files in a directory (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="emails per transaction (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="processes digesting emails in parallel (default: %(default)s)")
+    args = parser.parse_args()
+
+    counts = {}
+    pool = ProcessPoolExecutor(max_workers=args.processes) if args.processes > 0 else None
+    try:
+        for report in ingest_batches(iter_emails(args.path, args.glob), pool, args.batch_size):
+            counts[report["status"]] = counts.get(report["status"], 0) + 1
+            print(json.dumps(report), flush=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print(json.dumps(counts), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
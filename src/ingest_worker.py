@@ -0,0 +1,245 @@
+'''
+Background workers that ingest the raw emails queued by `/eat`
+
+Each server process runs `config.INGEST_WORKERS` worker threads (see
+`start_ingest_workers`), which drain the ingestion queue stored in the
+database. Failed emails are retried with a backoff, then moved to the
+dead-letter table (see `db_operations.fail_ingest_job`).
+
+The CPU-bound work (MIME parsing and the regex parsers) runs in a pool
+of `config.INGEST_PROCESSES` processes, created once per server process,
+so that it never holds the GIL of the process serving requests. Only the
+small picklable summary of each event comes back from the pool (see
+`utils.email_parser.eat_and_summarize`).
+
+The workers can also run on their own, outside of the server:
+
+    python3 ingest_worker.py
+'''
+import multiprocessing
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import List
+
+import db.db_operations as db_operations
+import db.writer as db_writer
+from db.schema import IngestJob
+import configs.server_configs as config
+import image_worker
+from utils.email_parser import eat_and_summarize, EmailMissingHeaders, EventSummary
+
+# set whenever a new email is queued in this process, to wake up idle workers
+_new_job = threading.Event()
+
+def notify():
+    '''
+    Wake up the idle workers of this process, since a new email was queued
+    '''
+    _new_job.set()
+
+# pool digesting the emails, see `get_ingest_pool`
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+def get_ingest_pool():
+    '''
+    Get the process pool of this server process, creating it if needed
+    (or None if `config.INGEST_PROCESSES` is 0)
+
+    Processes are spawned rather than forked, since the server process
+    already runs threads (and holds database connections) by then.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None and config.INGEST_PROCESSES > 0:
+            _pool = ProcessPoolExecutor(
+                max_workers=config.INGEST_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+def shutdown_ingest_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+def digest_email(raw):
+    '''
+    Digest a raw email in the process pool (or right here without a pool)
+
+    Returns the stage report, and the summary of the event if the email was accepted
+    '''
+    pool = get_ingest_pool()
+    if pool is None:
+        return eat_and_summarize(raw)
+    try:
+        return pool.submit(eat_and_summarize, raw).result()
+    except BrokenProcessPool:
+        shutdown_ingest_pool() # a process died (e.g. out of memory), start over next time
+        raise
+
+def add_digested_event(session, summary: EventSummary, commit=True):
+    '''
+    Add an event (and its sender) from the summary of a digested email, link
+    it to its images, and record its Message-ID to recognize duplicates, in
+    a single transaction (see `add_digested_events`)
+
+    If `commit` is False, nothing is committed, so that the caller can add
+    many events in a single transaction.
+
+    Returns id of new event, or None if add failed
+    '''
+    return add_digested_events(session, [summary], commit=commit)[0]
+
+def add_digested_events(session, summaries: List[EventSummary], commit=True):
+    '''
+    Add the events of many digested emails at once (see `db_operations.add_events`)
+
+    Returns the id of each new event, or a list of None if add failed
+    '''
+    return db_operations.add_events(session, [
+        db_operations.NewEvent(
+            summary.title,
+            summary.plaintext,
+            summary.categories,
+            summary.when.start_date or summary.sent.date(), #If no date was found, use the sent date
+            summary.when.end_date,
+            summary.when.start_time,
+            summary.when.end_time,
+            summary.html,
+            location=summary.location,
+            date_created=summary.sent or datetime.now(),
+            sender=summary.sender,
+            images=summary.images,
+            message_id=summary.message_id,
+        )
+        for summary in summaries
+    ], commit=commit)
+
+def process_ingest_job(session, job):
+    '''
+    Ingest the raw email of a claimed job, and record how it went
+
+    Emails with missing headers are dead-lettered right away, since retrying
+    them would not help. Any other error is retried later. Emails that were
+    already added as events are not added again.
+
+    The event is added, and the job settled, in one write of the database
+    writer (see `db/writer.py`).
+    '''
+    if job.attempts > config.INGEST_MAX_ATTEMPTS:
+        # claimed again after its claim timed out, too many times
+        db_operations.fail_ingest_job(session, job, job.error or "processing never finished", retry=False)
+        return
+
+    try:
+        report, summary = digest_email(job.raw)
+        event_id = db_writer.write(session, settle_digested_job, job.id, report, summary)
+    except EmailMissingHeaders as e:
+        session.rollback()
+        db_operations.fail_ingest_job(session, job, str(e), retry=False)
+    except Exception:
+        session.rollback()
+        db_operations.fail_ingest_job(session, job, traceback.format_exc())
+    else:
+        session.expire(job) # settled by the writer
+        if event_id is not None:
+            image_worker.notify() # its images (if any) are pending
+
+def settle_digested_job(session, job_id, report, summary: EventSummary | None, commit=True):
+    '''
+    Add the event of a digested email (unless it was rejected, or already
+    added), and settle its job
+
+    Returns the id of the new event, or None if none was added
+    '''
+    job = session.query(IngestJob).filter(IngestJob.id == job_id).one()
+    if summary is None:
+        db_operations.settle_ingest_job(session, job, None, report, commit=commit)
+        return None
+
+    ingested = db_operations.get_ingested_event_ids(session, [summary.message_id])
+    if summary.message_id in ingested:
+        db_operations.settle_ingest_job(session, job, ingested[summary.message_id], report, duplicate=True, commit=commit)
+        return None
+    event_id = add_digested_event(session, summary, commit=False)
+    if event_id is None:
+        raise RuntimeError("failed to add event")
+    db_operations.settle_ingest_job(session, job, event_id, report, commit=commit)
+    return event_id
+
+def drain():
+    '''
+    Ingest queued emails until there are none ready to be processed
+
+    Returns the number of jobs processed
+    '''
+    processed = 0
+    while True:
+        with db_operations.session_scope() as session:
+            job = db_operations.claim_ingest_job(session)
+            if job is None:
+                return processed
+            process_ingest_job(session, job)
+        processed += 1
+
+class IngestWorker(threading.Thread):
+    '''
+    Thread draining the ingestion queue until it is stopped
+    '''
+
+    def __init__(self, name=None):
+        super().__init__(name=name, daemon=True)
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                drain()
+            except Exception:
+                traceback.print_exc() # e.g. the database is locked, try again later
+            _new_job.wait(config.INGEST_POLL_INTERVAL)
+            _new_job.clear()
+
+    def stop(self):
+        self.stopping.set()
+        _new_job.set()
+
+_workers: list[IngestWorker] = []
+
+def start_ingest_workers(count=None):
+    '''
+    Start `count` worker threads (by default `config.INGEST_WORKERS`),
+    along with the process pool they digest emails in
+    '''
+    count = config.INGEST_WORKERS if count is None else count
+    if count > 0:
+        get_ingest_pool()
+    for i in range(count):
+        worker = IngestWorker(name=f"ingest-worker-{i}")
+        worker.start()
+        _workers.append(worker)
+
+def stop_ingest_workers(timeout=None):
+    '''
+    Stop the worker threads, letting them finish the job at hand
+    '''
+    for worker in _workers:
+        worker.stop()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
+    shutdown_ingest_pool()
+
+if __name__ == '__main__':
+    start_ingest_workers()
+    try:
+        for worker in list(_workers):
+            worker.join()
+    except KeyboardInterrupt:
+        stop_ingest_workers()
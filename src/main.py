@@ -1,22 +1,28 @@
 from xml.etree.ElementInclude import include
 from fastapi import (
-    FastAPI,
+    FastAPI, Request, Header,
     status, HTTPException,
 )
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 import uvicorn
 import db.db_operations as db_operations
 import db.schema as schema
+import db.writer as db_writer
 from db.db_helpers import row2dict
 from pydantic import BaseModel, ValidationError, validator
-from datetime import date, datetime
-import traceback
+from datetime import date, datetime, timedelta
 from collections import Counter
+import zlib
 
-from utils.email_parser import eat, EmailMissingHeaders
+import ingest_worker
+import ingest_batch
+import image_worker
+from utils.email_parser import find_image
+from utils.category_parser import CATEGORIES
 import configs.server_configs as config # type: ignore
 from configs.creds import valid_API_tokens
 
@@ -56,6 +62,19 @@ class GetEventsFrequencyByMonth(BaseModel):
             raise ValueError("Month must be in range 1 and 12")
         return v
         
+class GetEventHeatmap(BaseModel):
+    from_date: date
+    to_date: date
+    category: int | None = None # Tag number, or None for events of any category
+    filter_by_sent_date: bool | None = False
+    auth: AuthModel
+
+    @validator('to_date')
+    def is_valid_range(cls, v, values):
+        if 'from_date' in values and not values['from_date'] <= v <= values['from_date'] + timedelta(days=366):
+            raise ValueError("to_date must be at most a year after from_date")
+        return v
+
 class GetEventsByDate(BaseModel):
     from_date: date
     include_description: bool | None = False
@@ -63,6 +82,60 @@ class GetEventsByDate(BaseModel):
                                              # instead of when our parser thinks it is occurring
     auth: AuthModel
 
+class GetEventsInRange(BaseModel):
+    from_date: date
+    to_date: date
+    category_mask: int | None = 0 # Bitmask of tag numbers (events with any of them), or 0 for all events
+    page_size: int = 50
+    cursor: str | None = None # `next_cursor` of the previous page, or None for the first page
+    auth: AuthModel
+
+    @validator('to_date')
+    def is_valid_range(cls, v, values):
+        if 'from_date' in values and v < values['from_date']:
+            raise ValueError("to_date must not be before from_date")
+        return v
+
+    @validator('page_size')
+    def is_valid_page_size(cls, v):
+        if not 1 <= v <= 200:
+            raise ValueError("Page size must be in range 1 and 200")
+        return v
+
+    @validator('category_mask')
+    def is_valid_category_mask(cls, v):
+        # e.g. a negative mask would match every event, and one over 64 bits cannot be bound in SQL
+        if v is not None and not 0 <= v < 1 << len(CATEGORIES):
+            raise ValueError(f"category_mask must be a bitmask of tags in range 0 and {len(CATEGORIES) - 1}")
+        return v
+
+class SearchEvents(BaseModel):
+    query: str
+    from_date: date | None = None # Only events happening (or sent) in this range, if given
+    to_date: date | None = None
+    filter_by_sent_date: bool | None = False
+    page: int = 0
+    page_size: int = 20
+    auth: AuthModel
+
+    @validator('query')
+    def is_valid_query(cls, v):
+        if len(v) > 256:
+            raise ValueError("Query must be at most 256 characters")
+        return v
+
+    @validator('page')
+    def is_valid_page(cls, v):
+        if v < 0:
+            raise ValueError("Page must be at least 0")
+        return v
+
+    @validator('page_size')
+    def is_valid_page_size(cls, v):
+        if not 1 <= v <= 100:
+            raise ValueError("Page size must be in range 1 and 100")
+        return v
+
 class EmailModel(BaseModel):
     email: str
     token: str
@@ -82,8 +155,20 @@ async def root():
     return {"message": "Hello World"}
 
 # By default, we also have FastAPI serve static images 
-# This is largely for DEV environments (PROD + and TESTING should use Nginx instead)
-app.mount("/images", StaticFiles(directory=config.LOCAL_IMAGE_PATH), name="images")
+# This is largely for DEV environments (PROD + and TESTING should use Nginx instead,
+# falling back to this route for images still being compressed, e.g. with
+# `try_files $uri @backend;`)
+@app.get("/images/{image_name}")
+def get_image(image_name: str):
+    '''
+    Serve a compressed image, or its original until it is compressed (see `image_worker.py`)
+    '''
+    image_path, compressed = find_image(image_name)
+    if image_path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    # the original must not be cached in place of the compressed image
+    cache_control = "public, max-age=31536000, immutable" if compressed else "no-cache"
+    return FileResponse(image_path, headers={"Cache-Control": cache_control})
 
 @app.post("/get_event_category_frequency_for_month")
 async def get_event_category_frequency_for_month(req: GetEventsFrequencyByMonth):
@@ -101,31 +186,31 @@ async def get_event_category_frequency_for_month(req: GetEventsFrequencyByMonth)
             }
             return res
 
-        events = db_operations.get_events_by_month(session,req.month,req.year, req.filter_by_sent_date)
-        events_categories = db_operations.get_event_tags(session,events, convertName=True) #Make sure to get actual category names
-        event_categories_by_date = {} # Hold the tags used in each day
-        
-        # Sort events in bins of the day they start on,
-        # keeping track of all event categories that are used on that day
-        for (event, event_categories) in zip(events, events_categories):
-            if req.filter_by_sent_date:
-                date = event.date_created.strftime("%Y-%m-%d")
-                
-            else:
-                date = event.start_date.strftime("%Y-%m-%d")
-            if date not in event_categories_by_date:
-                event_categories_by_date[date] = event_categories.copy() #Memory safety
-            else:
-                event_categories_by_date[date].extend(event_categories)
-        
-        event_categories_freq_by_date = {} #Hold frequency of tags used on each day
-        for (given_date, day_event_tags) in event_categories_by_date.items():
-            event_categories_freq_by_date[given_date] = Counter(day_event_tags)
+        # Counted in SQL, from the category bitmask of the events
+        event_categories_freq_by_date = db_operations.get_category_counts_by_day(session,req.month,req.year, req.filter_by_sent_date)
         
         return {
             'frequency': event_categories_freq_by_date
         }
 
+@app.post("/get_event_heatmap")
+async def get_event_heatmap(req: GetEventHeatmap):
+    '''
+    Given a range of days (up to a year), return a mapping of the days which
+    have at least one event (of the given category), to their number of events
+    '''
+    with db_operations.session_scope() as session:
+        # validate that user has logged in
+        is_valid = db_operations.validate_session_id(session, req.auth.email_addr, req.auth.session_id)
+        if not is_valid:
+            return {"counts": {}}
+
+        category = schema.ALL_CATEGORIES if req.category is None else req.category
+        counts = db_operations.get_daily_event_counts(session, req.from_date, req.to_date, req.filter_by_sent_date, category)
+        return {
+            'counts': counts
+        }
+
 @app.post("/get_events_by_month")
 async def get_events_by_month(req: GetEventsByMonth):
     with db_operations.session_scope() as session:
@@ -181,54 +266,265 @@ async def get_events_by_date(req: GetEventsByDate):
             res['descriptions_html'] = descriptions_html
         return res
 
-@app.post("/eat", status_code=status.HTTP_201_CREATED)
-async def digest(req: EmailModel):
+@app.post("/get_events_in_range")
+async def get_events_in_range(req: GetEventsInRange):
+    '''
+    Return a page of the events happening between two days (inclusive), in
+    order of start date, start time and name
+
+    `next_cursor` is the cursor of the next page, or None if this is the last.
+    '''
+    try:
+        after = None if req.cursor is None else db_operations.decode_event_cursor(req.cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid cursor")
+    with db_operations.session_scope() as session:
+        # validate that user has logged in
+        is_valid = db_operations.validate_session_id(session, req.auth.email_addr, req.auth.session_id)
+        if not is_valid:
+            return {
+                "events": [],
+                "tags": [],
+                "users": [],
+                "next_cursor": None,
+            }
+
+        # one more event than the page, to know if there is a next one
+        events = db_operations.get_events_in_range(
+            session, req.from_date, req.to_date, req.category_mask or 0, limit=req.page_size + 1, after=after,
+        )
+        next_cursor = None
+        if len(events) > req.page_size:
+            events = events[:req.page_size]
+            next_cursor = db_operations.encode_event_cursor(db_operations.event_page_key(events[-1]))
+        tags = db_operations.get_event_tags(session,events)
+        users = db_operations.get_event_user_emails(session,events)
+        return {
+            'events': row2dict(events),
+            'tags': tags,
+            'users': users,
+            'next_cursor': next_cursor,
+        }
+
+@app.post("/search_events")
+async def search_events(req: SearchEvents):
+    '''
+    Search events by the words in their title, location and description, and
+    return a page of the results (best first), with a snippet of each where
+    the words matched
+
+    `next_page` is the page after this one, or None if this is the last.
+    '''
+    with db_operations.session_scope() as session:
+        # validate that user has logged in
+        is_valid = db_operations.validate_session_id(session, req.auth.email_addr, req.auth.session_id)
+        if not is_valid:
+            return {
+                "events": [],
+                "tags": [],
+                "users": [],
+                "snippets": [],
+                "next_page": None,
+            }
+
+        # one more result than the page, to know if there is a next one
+        events, snippets = db_operations.search_events(
+            session, req.query, req.from_date, req.to_date, req.filter_by_sent_date,
+            limit=req.page_size + 1, offset=req.page * req.page_size,
+        )
+        next_page = req.page + 1 if len(events) > req.page_size else None
+        events, snippets = events[:req.page_size], snippets[:req.page_size]
+        tags = db_operations.get_event_tags(session,events)
+        users = db_operations.get_event_user_emails(session,events)
+        return {
+            'events': row2dict(events),
+            'tags': tags,
+            'users': users,
+            'snippets': snippets,
+            'next_page': next_page,
+        }
+
+@app.on_event("startup")
+def start_ingest_workers():
+    ingest_worker.start_ingest_workers()
+    image_worker.start_image_worker()
+
+@app.on_event("shutdown")
+def stop_ingest_workers():
+    ingest_worker.stop_ingest_workers()
+    image_worker.stop_image_worker()
+
+# media types accepted by `/eat/raw`
+RAW_EMAIL_MEDIA_TYPES = ("message/rfc822", "application/gzip")
+
+def queue_email(raw):
+    '''
+    Queue a raw email to be ingested in the background (see `ingest_worker.py`),
+    and return the id of its ingestion job
+
+    Raises 503 (with `Retry-After`) if too many emails are already queued.
+    '''
+    with db_operations.session_scope() as session:
+        # apply backpressure when the ingest workers can't keep up
+        if db_operations.count_pending_ingest_jobs(session) >= config.INGEST_MAX_BACKLOG:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="too many emails waiting to be ingested",
+                headers={"Retry-After": str(config.INGEST_RETRY_AFTER)},
+            )
+        job_id = db_writer.write(session, db_operations.enqueue_email, raw)
+    ingest_worker.notify()
+    return {
+        "job_id": job_id,
+        "status_url": f"/eat/status/{job_id}",
+    }
+
+async def read_raw_email(request: Request, gzipped: bool) -> str:
+    '''
+    Read a raw email from the body of a request, as it streams in,
+    decompressing it on the fly if `gzipped`
+
+    Raises 413 if the (decompressed) email is larger than `config.INGEST_MAX_EMAIL_BYTES`.
+    '''
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16) if gzipped else None
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        while chunk:
+            if decompressor is not None:
+                # never inflate more than allowed, however well it compresses
+                data = decompressor.decompress(chunk, config.INGEST_MAX_EMAIL_BYTES + 1 - size)
+                chunk = decompressor.unconsumed_tail
+            else:
+                data, chunk = chunk, b""
+            size += len(data)
+            if size > config.INGEST_MAX_EMAIL_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"emails are limited to {config.INGEST_MAX_EMAIL_BYTES} bytes",
+                )
+            chunks.append(data)
+
+    if decompressor is not None and not decompressor.eof:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="truncated gzip body",
+        )
+    return ingest_batch.decode_email(b"".join(chunks))
+
+@app.post("/eat", status_code=status.HTTP_202_ACCEPTED)
+def digest(req: EmailModel):
+    '''
+    Queue a raw email to be ingested in the background (see `ingest_worker.py`),
+    and return the id of its ingestion job right away
+
+    Answers 503 (with `Retry-After`) if too many emails are already queued.
+    '''
     if not req.token in valid_API_tokens:
         msg = f"unrecognized token {req.token!r}"
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=msg,
         )
-    try:
-        parsed = eat(req.email)
-    except EmailMissingHeaders as e:
+    return queue_email(req.email)
+
+@app.post("/eat/raw", status_code=status.HTTP_202_ACCEPTED)
+async def digest_raw(request: Request, x_api_token: str = Header(), content_type: str = Header(),
+                     content_encoding: str | None = Header(default=None)):
+    '''
+    Same as `/eat`, but the request body is the raw email itself (`message/rfc822`),
+    optionally gzipped (`application/gzip`, or `Content-Encoding: gzip`), instead
+    of a JSON string. The API token goes in the `X-API-Token` header.
+
+    This spares escaping and parsing multi-megabyte emails as JSON.
+    '''
+    if not x_api_token in valid_API_tokens:
+        msg = f"unrecognized token {x_api_token!r}"
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e),
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=msg,
         )
-    except Exception as e:
-        tb = traceback.format_exc()
+
+    media_type = content_type.partition(";")[0].strip().lower()
+    if media_type not in RAW_EMAIL_MEDIA_TYPES:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=tb,
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"expected one of {', '.join(RAW_EMAIL_MEDIA_TYPES)}",
         )
+    gzipped = media_type == "application/gzip" or (content_encoding or "").strip().lower() == "gzip"
 
-    verified = parsed.sender.email.domain.lower() == "mit.edu" # could be improved?
-    sender_email = str(parsed.sender.email).lower()
-    if verified and parsed.dormspam:
-        with db_operations.session_scope() as session:
-            user_id = db_operations.add_user(session, sender_email)
-            club_id = None
-            location = None
-            for location in parsed.locations: break
-            link = None
-
-            event_id = db_operations.add_event(
-                session,
-                parsed.thread_topic or parsed.subject,
-                user_id,
-                parsed.plaintext,
-                parsed.categories,
-                parsed.when.start_date or parsed.sent.date(), #If no date was found, use the sent date
-                parsed.when.end_date,
-                parsed.when.start_time,
-                parsed.when.end_time,
-                parsed.content.get("text/html", None),
-                club_id,
-                location,
-                link,
-                parsed.sent or datetime.now()
-            )
+    raw = await read_raw_email(request, gzipped)
+    return await run_in_threadpool(queue_email, raw)
+
+@app.get("/eat/status/{job_id}")
+def digest_status(job_id: int, token: str):
+    '''
+    Look up how the ingestion of an email queued by `/eat` is going
+    '''
+    if not token in valid_API_tokens:
+        msg = f"unrecognized token {token!r}"
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=msg,
+        )
+
+    with db_operations.session_scope() as session:
+        res = db_operations.get_ingest_job_status(session, job_id)
+    if res is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"no ingestion job {job_id}",
+        )
+    return res
+
+@app.post("/eat_batch")
+async def digest_batch(request: Request, x_api_token: str = Header()):
+    '''
+    Ingest an mbox file (the request body) right away, e.g. to replay emails
+    that never made it to `/eat`. The API token goes in the `X-API-Token` header.
+
+    The body is streamed, and split into emails that are digested in parallel
+    in the ingest process pool, then added to the database in one transaction
+    per batch (see `ingest_batch.py`).
+
+    Returns a report of each email: accepted, rejected, duplicate or error
+    (marked permanent if sending the email again would not help)
+    '''
+    if not x_api_token in valid_API_tokens:
+        msg = f"unrecognized token {x_api_token!r}"
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=msg,
+        )
+
+    pool = ingest_worker.get_ingest_pool()
+    reports = []
+    async def ingest(raws):
+        digested = await ingest_batch.digest_batch_async(pool, raws)
+        def write():
+            with db_operations.session_scope() as session:
+                return ingest_batch.write_batch(session, digested, len(reports))
+        written = await run_in_threadpool(write)
+        reports.extend(written)
+        if any(report["status"] == "accepted" for report in written):
+            image_worker.notify() # their images (if any) are pending
+
+    splitter = ingest_batch.MboxSplitter()
+    batch = []
+    async for chunk in request.stream():
+        for raw in splitter.feed(chunk):
+            batch.append(ingest_batch.decode_email(raw))
+            if len(batch) >= ingest_batch.DEFAULT_BATCH_SIZE:
+                await ingest(batch)
+                batch = []
+    batch.extend(ingest_batch.decode_email(raw) for raw in splitter.close())
+    if batch:
+        await ingest(batch)
+
+    return {
+        "counts": Counter(report["status"] for report in reports),
+        "emails": reports,
+    }
 
 @app.post("/create_session", status_code=status.HTTP_201_CREATED)
 async def create_session(req: NewAuthModel):
@@ -240,7 +536,7 @@ async def create_session(req: NewAuthModel):
         )
 
     with db_operations.session_scope() as session:
-        session_id = db_operations.add_session_id(session, req.email_addr)
+        session_id = db_writer.write(session, db_operations.add_session_id, req.email_addr)
         res = {"session_id": session_id}
         return res
 
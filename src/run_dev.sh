@@ -1,2 +1,3 @@
 #Should have activated your virtual environment at this point
+python3 -m db.migrations upgrade || exit 1 #Create and migrate the database
 python3 main.py
\ No newline at end of file
@@ -1,6 +1,7 @@
 export CURRENT_MODE=PROD #Used to override operating mode in `src/configs/server_configs.py`
 pkill gunicorn #Stop any current process
 sleep 5        #Wait for gunicorn to properly exit
+python3 -m db.migrations upgrade || exit 1 #Create and migrate the database, before any worker uses it
 gunicorn main:app \
     --workers 4 \
     --worker-class uvicorn.workers.UvicornWorker \
@@ -0,0 +1,92 @@
+import base64
+import doctest
+import hashlib
+import os
+import tempfile
+import tracemalloc
+import unittest
+from unittest import mock
+
+import PIL.Image
+
+import utils.base64_spool
+import utils.email_parser as email_parser
+from utils.base64_spool import Base64Spool
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(utils.base64_spool))
+    return tests
+
+def fold(payload: str, width=76) -> str:
+    return "\n".join(payload[i:i+width] for i in range(0, len(payload), width)) + "\n"
+
+class TestBase64Spool(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def test_chunk_boundaries(self):
+        data = os.urandom(1000)
+        for payload in (base64.b64encode(data).decode(), fold(base64.b64encode(data).decode())):
+            for chunk_size in (1, 3, 5, 77, 4096):
+                with Base64Spool(self.directory, max_memory=1 << 20) as spool:
+                    spool.write(payload, chunk_size=chunk_size)
+                    self.assertEqual(spool.reader().read(), data)
+
+    def test_missing_padding(self):
+        with Base64Spool(self.directory, max_memory=1024) as spool:
+            spool.write("aGVsbG8")
+            self.assertEqual(spool.reader().read(), b"hello")
+
+    def test_roll_over(self):
+        data = os.urandom(10000)
+        with Base64Spool(self.directory, max_memory=4096) as spool:
+            spool.write(fold(base64.b64encode(data).decode()), chunk_size=1000)
+            self.assertIsNotNone(spool.path)
+            self.assertEqual(spool.reader().read(), data)
+            self.assertEqual(spool.hexdigest(), hashlib.sha256(data).hexdigest())
+            spool.persist(os.path.join(self.directory, "image"))
+        self.assertEqual(os.listdir(self.directory), ["image"])
+        with open(os.path.join(self.directory, "image"), "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_close_removes_file(self):
+        with Base64Spool(self.directory, max_memory=10) as spool:
+            spool.write(base64.b64encode(os.urandom(100)).decode())
+        self.assertEqual(os.listdir(self.directory), [])
+
+class TestImageMemoryCap(unittest.TestCase):
+
+    def test_large_image_within_cap(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cap = 1 << 20
+        for name, value in (
+            ("LOCAL_IMAGE_PATH", tmp.name + "/"),
+            ("PENDING_IMAGE_PATH", tmp.name + "/pending/"),
+            ("FAILED_IMAGE_PATH", tmp.name + "/pending/failed/"),
+            ("IMAGE_MEMORY_CAP", cap),
+        ):
+            patcher = mock.patch.object(email_parser, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        size = 20 * 1024 * 1024
+        payload = fold(base64.b64encode(os.urandom(size)).decode())
+        # PIL imports its format plugins on first use, which is not the spool's memory
+        PIL.Image.init()
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            variants = email_parser.save_pending_image(payload, "image/jpeg")
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, 2 * cap + 4 * utils.base64_spool.BASE64_CHUNK_SIZE)
+        self.assertEqual(os.path.getsize(email_parser.find_image(variants.src.rsplit("/", 1)[1])[0]), size)
+
+if __name__ == '__main__':
+    unittest.main()
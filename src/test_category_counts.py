@@ -0,0 +1,80 @@
+import unittest
+from datetime import date, datetime
+
+import db.db_operations as db_operations
+from db.category_counts import rebuild_daily_category_counts
+from db.schema import DailyCategoryCount
+from database_test_case import DatabaseTestCase
+
+class TestCategoryCounts(DatabaseTestCase):
+    '''
+    Check that the counts kept up to date by db_operations match the counts
+    rebuilt from the events
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = db_operations.add_user(self.session, "username@mit.edu")
+
+    def counts(self):
+        rows = self.session.query(DailyCategoryCount).filter(DailyCategoryCount.count != 0)
+        return {(row.date_kind, row.date, row.category): row.count for row in rows}
+
+    def assert_counts_rebuilt(self):
+        counts = self.counts()
+        with self.engine.begin() as connection:
+            rebuild_daily_category_counts(connection)
+        self.session.expire_all()
+        self.assertEqual(counts, self.counts())
+
+    def add_event(self, tags, day, **kwargs):
+        return db_operations.add_event(
+            self.session, "Event", self.user_id, "description", tags,
+            start_date=date(2023, 2, day), date_created=datetime(2023, 1, day, 12), **kwargs,
+        )
+
+    def test_add_event(self):
+        self.add_event([0, 1], 3)
+        self.add_event([1], 3)
+        self.add_event([], 4, commit=False)
+        self.session.commit()
+        self.assertEqual(db_operations.get_category_counts_by_day(self.session, 2, 2023), {
+            "2023-02-03": {"OTHER": 1, "FOOD": 2},
+            "2023-02-04": {},
+        })
+        self.assertEqual(
+            db_operations.get_category_counts_by_day(self.session, 1, 2023, filter_by_sent_date=True),
+            {"2023-01-03": {"OTHER": 1, "FOOD": 2}, "2023-01-04": {}},
+        )
+        self.assert_counts_rebuilt()
+
+    def test_update_event(self):
+        event_id = self.add_event([0, 1], 3)
+        self.add_event([1], 3)
+        self.assertTrue(db_operations.update_event(
+            self.session, event_id, "Event", "description", [2], start_date=date(2023, 2, 5),
+        ))
+        self.assertEqual(db_operations.get_category_counts_by_day(self.session, 2, 2023), {
+            "2023-02-03": {"FOOD": 1},
+            "2023-02-05": {"CAREER": 1},
+        })
+        self.assert_counts_rebuilt()
+
+        db_operations.add_event_tags(self.session, event_id, [7, 9])
+        self.assertEqual(db_operations.get_category_counts_by_day(self.session, 2, 2023)["2023-02-05"], {"TALKS": 1, "RSVP": 1})
+        self.assert_counts_rebuilt()
+
+    def test_heatmap(self):
+        for day in (1, 1, 2, 28):
+            self.add_event([day % 10], day)
+        self.assertEqual(
+            db_operations.get_daily_event_counts(self.session, date(2023, 1, 1), date(2023, 12, 31)),
+            {"2023-02-01": 2, "2023-02-02": 1, "2023-02-28": 1},
+        )
+        self.assertEqual(
+            db_operations.get_daily_event_counts(self.session, date(2023, 1, 1), date(2023, 12, 31), category=2),
+            {"2023-02-02": 1},
+        )
+
+if __name__ == '__main__':
+    unittest.main()
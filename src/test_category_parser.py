@@ -0,0 +1,34 @@
+import unittest
+import utils.category_parser as category_parser
+from utils.category_parser import parse_categories, category_automaton, CATEGORIES
+
+FOOD = CATEGORIES.index(category_parser.FOOD)
+BOBA = CATEGORIES.index(category_parser.BOBA)
+SALE = CATEGORIES.index(category_parser.SALE)
+RSVP = CATEGORIES.index(category_parser.RSVP)
+
+class TestCategoryParser(unittest.TestCase):
+
+    def test_no_categories(self):
+        self.assertEqual(parse_categories("Blah blah blah"), set())
+
+    def test_shared_keyword(self):
+        self.assertEqual(parse_categories("Free BUBBLE TEA in lobby 10"), {FOOD, BOBA})
+
+    def test_whole_words_only(self):
+        self.assertEqual(parse_categories("The wholesale eatery"), set())
+        self.assertEqual(parse_categories("Please rsvp: sale, eat"), {FOOD, SALE, RSVP})
+
+    def test_rebuilt_when_categories_change(self):
+        automaton = category_automaton()
+        self.assertIs(automaton, category_automaton())
+        category_parser.RSVP.keywords.append("register")
+        try:
+            self.assertIsNot(automaton, category_automaton())
+            self.assertEqual(parse_categories("Register here"), {RSVP})
+        finally:
+            category_parser.RSVP.keywords.remove("register")
+        self.assertEqual(parse_categories("Register here"), set())
+
+if __name__ == '__main__':
+    unittest.main()
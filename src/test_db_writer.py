@@ -0,0 +1,72 @@
+import threading
+import unittest
+from unittest import mock
+
+import sqlalchemy
+
+import configs.server_configs as config
+import db.db_operations as db_operations
+import db.writer as db_writer
+from db.schema import Event, SessionId, IngestJob
+from database_test_case import DatabaseTestCase
+
+def fail(session, commit=True):
+    raise ValueError("bad write")
+
+class TestDBWriter(DatabaseTestCase):
+    DATABASE_FILE = True # a connection per thread, like the server's
+
+    def setUp(self):
+        super().setUp()
+        self.commits = 0
+        sqlalchemy.event.listen(self.engine, "commit", self.count_commit)
+        # long enough for every thread to send its write
+        patcher = mock.patch.object(config, "DB_WRITER_INTERVAL", 0.2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def count_commit(self, conn):
+        self.commits += 1
+
+    def write_concurrently(self, writes):
+        results = [None] * len(writes)
+        def run(i, function, *args):
+            session = self.Session()
+            try:
+                results[i] = db_writer.write(session, function, *args)
+            except Exception as e:
+                results[i] = e
+            finally:
+                session.close()
+        threads = [threading.Thread(target=run, args=(i, *write)) for i, write in enumerate(writes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_groups_writes(self):
+        results = self.write_concurrently([(db_operations.enqueue_email, f"raw {i}") for i in range(20)])
+        self.assertEqual(len(set(results)), 20)
+        self.assertLess(self.commits, 5)
+        self.assertEqual(self.session.query(IngestJob).count(), 20)
+
+    def test_failed_write_does_not_fail_others(self):
+        db_operations.add_ingested_message(self.session, "<taken@mit.edu>", None)
+        duplicate = db_operations.NewEvent("Event", "description", sender="username@mit.edu", message_id="<taken@mit.edu>")
+        results = self.write_concurrently([
+            (db_operations.add_session_id, "username@mit.edu", "new"),
+            (db_operations.add_events, [duplicate]), # rolls back its transaction
+            (fail,),
+            (db_operations.enqueue_email, "raw"),
+        ])
+        self.assertEqual(results[0], "new")
+        self.assertEqual(results[1], [None])
+        self.assertIsInstance(results[2], ValueError)
+        self.assertIsInstance(results[3], int)
+        self.assertEqual([session_id for session_id, in self.session.query(SessionId.session_id)], ["new"])
+        self.assertEqual(self.session.query(IngestJob).count(), 1)
+        self.assertEqual(self.session.query(Event).count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
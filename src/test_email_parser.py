@@ -0,0 +1,72 @@
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import utils.email_parser as email_parser
+from utils.email_parser import eat, eat_in_stages, Email, ImageVariants
+
+TEST_EMAILS = Path(__file__).parent / "test_emails"
+
+class TestEmailDigest(unittest.TestCase):
+
+    def setUp(self):
+        with open(TEST_EMAILS / "sipb-hackathon.txt", "r") as f:
+            self.email = eat(f.read())
+
+    def test_fields_are_lazy(self):
+        for field in Email.DERIVED_FIELDS:
+            self.assertFalse(self.email.is_computed(field))
+
+    def test_fields_are_memoized(self):
+        with mock.patch.object(email_parser, "parse_event_time", wraps=email_parser.parse_event_time) as parse:
+            when = self.email.when
+            self.assertIs(when, self.email.when)
+            self.assertEqual(parse.call_count, 1)
+        self.assertTrue(self.email.is_computed("when"))
+        self.assertTrue(self.email.is_computed("plaintext"))
+        self.assertFalse(self.email.is_computed("categories"))
+
+    def test_digest(self):
+        self.email.digest()
+        for field in Email.DERIVED_FIELDS:
+            self.assertTrue(self.email.is_computed(field))
+        self.assertTrue(self.email.dormspam)
+
+class TestEatInStages(unittest.TestCase):
+
+    def setUp(self):
+        with open(TEST_EMAILS / "sipb-hackathon.txt", "r") as f:
+            self.raw = f.read()
+        patcher = mock.patch.object(email_parser, "save_pending_image", return_value=ImageVariants("image", [500], ("webp",)))
+        self.save_image = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rejects_sender_before_parsing_body(self):
+        with mock.patch.object(email_parser.mailparser, "parse_from_string") as parse:
+            digestion = eat_in_stages(self.raw)
+            parse.assert_not_called()
+        self.assertFalse(digestion.accepted)
+        self.assertEqual([stage.name for stage in digestion.stages], ["sender"])
+        self.assertIn("username@domain.com", digestion.rejection)
+        self.save_image.assert_not_called()
+
+    def test_rejects_non_dormspam_before_images(self):
+        with mock.patch.object(email_parser, "ACCEPTED_SENDER_DOMAINS", ("domain.com",)), \
+             mock.patch.object(Email, "dormspam", new_callable=mock.PropertyMock, return_value=False):
+            digestion = eat_in_stages(self.raw)
+        self.assertFalse(digestion.accepted)
+        self.assertEqual([stage.name for stage in digestion.stages], ["sender", "message", "dormspam"])
+        self.assertIsNotNone(digestion.rejection)
+        self.save_image.assert_not_called()
+
+    def test_accepts(self):
+        with mock.patch.object(email_parser, "ACCEPTED_SENDER_DOMAINS", ("domain.com",)):
+            digestion = eat_in_stages(self.raw)
+        self.assertTrue(digestion.accepted)
+        self.assertIsNone(digestion.rejection)
+        self.assertEqual([stage.name for stage in digestion.stages], ["sender", "message", "dormspam", "images"])
+        self.assertTrue(all(stage.seconds >= 0 for stage in digestion.stages))
+        self.assertEqual(digestion.email.subject, eat(self.raw).subject)
+
+if __name__ == '__main__':
+    unittest.main()
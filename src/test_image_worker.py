@@ -0,0 +1,204 @@
+import base64
+import os
+import tempfile
+import time
+import unittest
+from io import BytesIO
+from unittest import mock
+
+import sqlalchemy
+import sqlalchemy.orm
+from PIL import Image
+
+import db.db_operations as db_operations
+import image_worker
+from db.schema import SQLBase
+import utils.email_parser as email_parser
+from utils.email_parser import (
+    save_pending_image, compress_pending_image, find_image,
+    open_image, decode_image, ImageVariants,
+)
+
+def make_image(size=(1000, 600), format="JPEG", exif=None) -> bytes:
+    buffer = BytesIO()
+    image = Image.new("RGB", size, (200, 30, 30))
+    if exif is not None:
+        image.save(buffer, format=format, exif=exif)
+    else:
+        image.save(buffer, format=format)
+    return buffer.getvalue()
+
+def encode(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+class TestPendingImages(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.images = tmp.name + "/"
+        for name, value in (
+            ("LOCAL_IMAGE_PATH", self.images),
+            ("PENDING_IMAGE_PATH", self.images + "pending/"),
+            ("FAILED_IMAGE_PATH", self.images + "pending/failed/"),
+            ("BASE_IMAGE_URL", "http://localhost/images/"),
+            ("IMAGE_FORMATS", ("webp",)),
+        ):
+            patcher = mock.patch.object(email_parser, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_original_served_until_compressed(self):
+        variants = save_pending_image(encode(make_image((2000, 1200))), "image/jpeg")
+        self.assertEqual(variants.widths, [250, 500, 1000])
+        image_name = variants.src.rsplit("/", 1)[1]
+        self.assertEqual(image_name, f"{variants.name}_500w.webp")
+
+        path, compressed = find_image(image_name)
+        self.assertFalse(compressed)
+        self.assertTrue(path.endswith(".jpg"))
+
+        paths = compress_pending_image(path)
+        self.assertEqual(len(paths), 3)
+        self.assertFalse(os.path.exists(path))
+        for width in variants.widths:
+            path, compressed = find_image(variants.file_name("webp", width))
+            self.assertTrue(compressed)
+            with Image.open(path) as img:
+                self.assertEqual((img.format, img.size), ("WEBP", (width, width * 3 // 5)))
+
+    def test_never_upscales(self):
+        variants = save_pending_image(encode(make_image((300, 200), "PNG")), "image/png")
+        self.assertEqual(variants.widths, [250, 300])
+        self.assertTrue(variants.src.endswith("_300w.webp"))
+        compress_pending_image(email_parser.list_pending_images()[0])
+        with Image.open(self.images + variants.file_name("webp", 300)) as img:
+            self.assertEqual(img.size, (300, 200))
+
+    def test_rotated_photo(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6 # rotated 90 degrees
+        img, widths = open_image(BytesIO(make_image((2000, 400), exif=exif.tobytes())))
+        self.assertEqual(widths, [250, 400])
+        self.assertEqual(decode_image(img, 400).size, (400, 2000))
+
+    def test_draft_decoding(self):
+        img, widths = open_image(BytesIO(make_image((4000, 3000))))
+        self.assertEqual(decode_image(img, widths[-1]).size, (1000, 750))
+
+    def test_broken_image_served_as_is(self):
+        variants = save_pending_image(encode(b"not an image"), "image/gif")
+        self.assertEqual(image_worker.compress_pending_images(None), 0)
+        self.assertEqual(email_parser.list_pending_images(), [])
+
+        path, compressed = find_image(variants.src.rsplit("/", 1)[1])
+        self.assertFalse(compressed)
+        self.assertTrue(path.startswith(self.images + "pending/failed/"))
+
+    def test_compress_pending_images(self):
+        saved = [save_pending_image(encode(make_image((600 + i, 400))), "image/png") for i in range(3)]
+        self.assertEqual(len(email_parser.list_pending_images()), 3)
+        self.assertEqual(image_worker.compress_pending_images(None), 3)
+        self.assertEqual(email_parser.list_pending_images(), [])
+        for variants in saved:
+            self.assertTrue(find_image(variants.src.rsplit("/", 1)[1])[1])
+
+    def test_worker_keeps_its_lock(self):
+        saved = save_pending_image(encode(make_image((600, 400))), "image/png")
+        for name, value in (("PENDING_IMAGE_PATH", self.images + "pending/"), ("IMAGE_PROCESSES", 0)):
+            patcher = mock.patch.object(image_worker.config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        worker = image_worker.ImageWorker()
+        worker.start()
+        try:
+            deadline = time.monotonic() + 10
+            while email_parser.list_pending_images() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            worker.stop()
+            worker.join()
+        self.assertTrue(find_image(saved.src.rsplit("/", 1)[1])[1])
+        # the lock file is never taken for a pending image
+        self.assertEqual(os.listdir(self.images + "pending/"), [".lock"])
+
+    def test_same_image_stored_once(self):
+        data = encode(make_image())
+        variants = save_pending_image(data, "image/jpeg")
+        self.assertEqual(save_pending_image(data, "image/jpeg"), variants)
+        self.assertEqual(len(email_parser.list_pending_images()), 1)
+
+        image_worker.compress_pending_images(None)
+        with mock.patch.object(email_parser, "compress_image") as compress:
+            self.assertEqual(save_pending_image(data, "image/jpeg"), variants)
+            self.assertEqual(email_parser.list_pending_images(), [])
+            compress.assert_not_called()
+
+    def test_saved_again_when_collected_meanwhile(self):
+        data = encode(make_image())
+        variants = save_pending_image(data, "image/jpeg")
+        image_worker.compress_pending_images(None)
+
+        def collect(path, *args):
+            # `image_worker.py --gc` removed the image after it was found
+            for file_name in variants.file_names():
+                os.remove(self.images + file_name)
+            raise FileNotFoundError(path)
+        with mock.patch.object(email_parser.os, "utime", side_effect=collect):
+            self.assertEqual(save_pending_image(data, "image/jpeg"), variants)
+        self.assertEqual(len(email_parser.list_pending_images()), 1)
+
+    def test_collect_garbage(self):
+        engine = sqlalchemy.create_engine("sqlite://")
+        SQLBase.metadata.create_all(engine)
+        session = sqlalchemy.orm.sessionmaker(bind=engine)()
+        self.addCleanup(session.close)
+
+        user_id = db_operations.add_user(session, "username@mit.edu")
+        event_id = db_operations.add_event(session, "Event", user_id, "", description_html="")
+        kept = save_pending_image(encode(make_image((600, 400))), "image/png")
+        collected = save_pending_image(encode(make_image((700, 400))), "image/png")
+        db_operations.add_event_images(session, event_id, [kept.name])
+        image_worker.compress_pending_images(None)
+        pending = save_pending_image(encode(make_image((800, 400))), "image/png")
+
+        with open(self.images + "legacy.png", "wb") as f:
+            f.write(b"legacy")
+        past = time.time() - 10
+        for entry in email_parser.list_image_files():
+            os.utime(entry.path, (past, past))
+        save_pending_image(encode(make_image((800, 400))), "image/png") # in an email being ingested
+
+        self.assertEqual(image_worker.collect_garbage(session, grace=5, dry_run=True)[0], len(collected.file_names()))
+        self.assertEqual(image_worker.collect_garbage(session, grace=5)[0], len(collected.file_names()))
+        remaining = {entry.name for entry in email_parser.list_image_files()}
+        self.assertEqual(remaining, set(kept.file_names()) | {pending.name + ".png", "legacy.png"})
+        self.assertEqual(image_worker.collect_garbage(session, grace=5, legacy=True)[0], 1)
+
+    def test_unknown_images(self):
+        self.assertEqual(find_image("missing.png"), (None, False))
+        self.assertEqual(find_image("../secret.png"), (None, False))
+        self.assertEqual(find_image(".lock"), (None, False))
+
+class TestImageVariants(unittest.TestCase):
+
+    def test_srcset(self):
+        variants = ImageVariants("flyer", [250, 500], ("webp",))
+        with mock.patch.object(email_parser, "BASE_IMAGE_URL", "/images/"):
+            html = variants.html('<img alt="flyer" src="cid:abc">', "abc")
+        self.assertEqual(html, (
+            '<img alt="flyer" src="/images/flyer_500w.webp" '
+            'srcset="/images/flyer_250w.webp 250w, /images/flyer_500w.webp 500w" '
+            'sizes="(max-width: 500px) 100vw, 500px" loading="lazy">'
+        ))
+
+    def test_picture(self):
+        variants = ImageVariants("flyer", [250], ("avif", "webp"))
+        with mock.patch.object(email_parser, "BASE_IMAGE_URL", "/images/"):
+            html = variants.html('<img src="cid:abc">', "abc")
+        self.assertTrue(html.startswith('<picture><source type="image/avif" srcset="/images/flyer_250w.avif 250w"'))
+        self.assertIn('<img src="/images/flyer_250w.webp"', html)
+        self.assertTrue(html.endswith("</picture>"))
+
+if __name__ == '__main__':
+    unittest.main()
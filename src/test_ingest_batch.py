@@ -0,0 +1,158 @@
+import doctest
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from unittest import mock
+
+import sqlalchemy
+
+import ingest_batch
+from ingest_batch import MboxSplitter
+from utils.email_parser import ImageVariants
+import db.db_operations as db_operations
+from db.schema import Event, EventDescription, EventDescriptionType, IngestedMessage, User
+from database_test_case import DatabaseTestCase
+
+TEST_EMAILS = Path(__file__).parent / "test_emails"
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(ingest_batch))
+    return tests
+
+def read_test_email(name):
+    with open(TEST_EMAILS / name, "r") as f:
+        return f.read().replace("username@domain.com", "username@mit.edu")
+
+def to_mbox(raws):
+    mbox = b""
+    for raw in raws:
+        body = "".join(">" + line if line.startswith("From ") else line for line in raw.splitlines(keepends=True))
+        mbox += b"From username@mit.edu Thu Apr 27 15:17:52 2023\n" + body.encode() + b"\n"
+    return mbox
+
+class TestMboxSplitter(unittest.TestCase):
+
+    def split(self, mbox, chunk_size):
+        splitter = MboxSplitter()
+        raws = []
+        for i in range(0, len(mbox), chunk_size):
+            raws.extend(splitter.feed(mbox[i:i+chunk_size]))
+        raws.extend(splitter.close())
+        return [raw.decode() for raw in raws]
+
+    def test_round_trip(self):
+        raws = [read_test_email("sipb-hackathon.txt"), read_test_email("senior-sale-update.txt")]
+        mbox = to_mbox(raws)
+        for chunk_size in (1, 7, 4096, len(mbox)):
+            self.assertEqual(self.split(mbox, chunk_size), raws)
+
+    def test_from_in_body(self):
+        mbox = b"From a\nSubject: 1\n\nhello\nFrom here on\n\n>From there\n>>From everywhere\n\nFrom b\nSubject: 2\n"
+        self.assertEqual(self.split(mbox, 5), [
+            "Subject: 1\n\nhello\nFrom here on\n\nFrom there\n>From everywhere\n",
+            "Subject: 2\n",
+        ])
+
+    def test_iter_mbox(self):
+        raws = [read_test_email("sipb-hackathon.txt")] * 3
+        with tempfile.NamedTemporaryFile(suffix=".mbox") as f:
+            f.write(to_mbox(raws))
+            f.flush()
+            self.assertEqual(list(ingest_batch.iter_emails(f.name)), raws)
+
+class TestWriteBatch(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("utils.email_parser.save_pending_image", return_value=ImageVariants("image", [500], ("webp",)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ingest(self, raws, start_index=0):
+        digested = ingest_batch.digest_batch(None, raws)
+        return ingest_batch.write_batch(self.session, digested, start_index)
+
+    def test_report(self):
+        hackathon = read_test_email("sipb-hackathon.txt")
+        rejected = hackathon.replace("username@mit.edu", "username@domain.com")
+        broken = "From: someone@mit.edu\n\nhello"
+        reports = self.ingest([hackathon, rejected, hackathon, broken])
+
+        self.assertEqual([report["status"] for report in reports], ["accepted", "rejected", "duplicate", "error"])
+        self.assertEqual([report["index"] for report in reports], [0, 1, 2, 3])
+        self.assertTrue(reports[3]["permanent"]) # sending it again would not help
+        self.assertEqual(reports[2]["event_id"], reports[0]["event_id"])
+        self.assertEqual(self.session.query(Event).count(), 1)
+        self.assertEqual(self.session.query(IngestedMessage).count(), 1)
+
+        self.assertEqual(self.ingest([hackathon], start_index=4), [{
+            "index": 4, "status": "duplicate",
+            "message_id": reports[0]["message_id"], "event_id": reports[0]["event_id"],
+        }])
+
+    def test_single_transaction(self):
+        raws = [read_test_email("sipb-hackathon.txt"), read_test_email("senior-sale-update.txt")]
+        with mock.patch.object(self.session, "commit", wraps=self.session.commit) as commit:
+            reports = self.ingest(raws)
+        self.assertEqual([report["status"] for report in reports], ["accepted", "accepted"])
+        self.assertEqual(commit.call_count, 1)
+
+    def test_failed_transaction_retries_one_by_one(self):
+        raws = [read_test_email("sipb-hackathon.txt"), read_test_email("senior-sale-update.txt")]
+        add = ingest_batch.ingest_worker.add_digested_events
+        def add_all_but_senior_sale(session, summaries, commit=True):
+            if any("Senior" in summary.title for summary in summaries):
+                return [None] * len(summaries)
+            return add(session, summaries, commit=commit)
+        with mock.patch.object(ingest_batch.ingest_worker, "add_digested_events", add_all_but_senior_sale):
+            reports = self.ingest(raws)
+        self.assertEqual([report["status"] for report in reports], ["accepted", "error"])
+        self.assertFalse(reports[1]["permanent"]) # might be added if sent again
+        self.assertEqual(self.session.query(Event).count(), 1)
+
+class TestAddEvents(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.statements = []
+        self.commits = 0
+        sqlalchemy.event.listen(self.engine, "before_cursor_execute", self.record)
+        sqlalchemy.event.listen(self.engine, "commit", self.count_commit)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.split()[0].upper())
+
+    def count_commit(self, conn):
+        self.commits += 1
+
+    def new_events(self, count, prefix=""):
+        return [
+            db_operations.NewEvent(
+                f"Event {i}", "description" * 10000, [i % 10, 3], date(2023, 2, 3),
+                description_html="<p>description</p>" * 10000,
+                sender=f"user{i % 3}@mit.edu", images=["a" * 64, "b" * 64], message_id=f"<{prefix}{i}@mit.edu>",
+            )
+            for i in range(count)
+        ]
+
+    def test_single_transaction(self):
+        event_ids = db_operations.add_events(self.session, self.new_events(30))
+        self.assertEqual(len(set(event_ids)), 30)
+        self.assertEqual(self.commits, 1)
+        # one insert per event (to get its id back), and one per other table (and the search index)
+        self.assertEqual(self.statements.count("INSERT"), 30 + 7)
+        self.assertEqual(self.session.query(User).count(), 3)
+        self.assertEqual(self.session.query(EventDescription).count(), 30 * 2) # compressed to less than a chunk each
+        events = self.session.query(Event).order_by(Event.id).all()
+        self.assertEqual(db_operations.get_event_tags(self.session, events[:2]), [[0, 3], [1, 3]])
+        self.assertEqual(db_operations.get_event_descriptions(self.session, events[:1], EventDescriptionType.HTML), ["<p>description</p>" * 10000])
+
+    def test_failed_insert_rolls_back(self):
+        db_operations.add_events(self.session, self.new_events(2))
+        self.assertEqual(db_operations.add_events(self.session, self.new_events(3, prefix="new")[1:] + self.new_events(1)), [None] * 3)
+        self.assertEqual(self.session.query(Event).count(), 2)
+        self.assertEqual(self.session.query(IngestedMessage).count(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import pickle
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+import db.db_operations as db_operations
+import ingest_worker
+from utils.compressed_text import decompress_text
+from utils.email_parser import ImageVariants, eat
+from db.schema import IngestDeadLetter, IngestJobStatus
+from database_test_case import DatabaseTestCase
+import configs.server_configs as config
+
+TEST_EMAILS = Path(__file__).parent / "test_emails"
+
+class TestIngestQueue(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # digest emails in this process, so that they can be mocked
+        patcher = mock.patch.object(config, "INGEST_PROCESSES", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def status(self, job_id):
+        return db_operations.get_ingest_job_status(self.session, job_id)
+
+    def test_counts_pending(self):
+        db_operations.enqueue_email(self.session, "first")
+        db_operations.enqueue_email(self.session, "second")
+        self.assertEqual(db_operations.count_pending_ingest_jobs(self.session), 2)
+        db_operations.claim_ingest_job(self.session)
+        self.assertEqual(db_operations.count_pending_ingest_jobs(self.session), 1)
+
+    def test_claims_in_order_once(self):
+        first = db_operations.enqueue_email(self.session, "first")
+        second = db_operations.enqueue_email(self.session, "second")
+        self.assertEqual(self.status(first)["status"], "pending")
+
+        job = db_operations.claim_ingest_job(self.session)
+        self.assertEqual((job.id, job.raw, job.attempts), (first, "first", 1))
+        self.assertEqual(db_operations.claim_ingest_job(self.session).id, second)
+        self.assertIsNone(db_operations.claim_ingest_job(self.session))
+        self.assertEqual(self.status(first)["status"], "processing")
+
+    def test_reclaims_timed_out_jobs(self):
+        job_id = db_operations.enqueue_email(self.session, "raw")
+        db_operations.claim_ingest_job(self.session)
+        later = datetime.now() + timedelta(seconds=config.INGEST_CLAIM_TIMEOUT + 1)
+        job = db_operations.claim_ingest_job(self.session, now=later)
+        self.assertEqual((job.id, job.attempts), (job_id, 2))
+
+    def test_retries_then_dead_letters(self):
+        job_id = db_operations.enqueue_email(self.session, "raw")
+        now = datetime.now()
+        for attempt in range(1, config.INGEST_MAX_ATTEMPTS + 1):
+            now += timedelta(days=1) # past any backoff
+            job = db_operations.claim_ingest_job(self.session, now=now)
+            self.assertEqual(job.attempts, attempt)
+            retried = db_operations.fail_ingest_job(self.session, job, f"error {attempt}")
+            self.assertEqual(retried, attempt < config.INGEST_MAX_ATTEMPTS)
+
+        status = self.status(job_id)
+        self.assertEqual(status["status"], "dead")
+        self.assertEqual(status["error"], f"error {config.INGEST_MAX_ATTEMPTS}")
+        dead = self.session.query(IngestDeadLetter).one()
+        self.assertEqual((dead.job_id, dead.raw), (job_id, "raw"))
+        self.assertIsNone(db_operations.claim_ingest_job(self.session, now=now + timedelta(days=1)))
+
+    def test_retry_backs_off(self):
+        db_operations.enqueue_email(self.session, "raw")
+        job = db_operations.claim_ingest_job(self.session)
+        db_operations.fail_ingest_job(self.session, job, "error")
+        self.assertIsNone(db_operations.claim_ingest_job(self.session))
+        later = datetime.now() + timedelta(seconds=config.INGEST_RETRY_DELAY + 1)
+        self.assertIsNotNone(db_operations.claim_ingest_job(self.session, now=later))
+
+    def test_process_rejected_email(self):
+        with open(TEST_EMAILS / "sipb-hackathon.txt", "r") as f:
+            job_id = db_operations.enqueue_email(self.session, f.read())
+        job = db_operations.claim_ingest_job(self.session)
+        ingest_worker.process_ingest_job(self.session, job)
+
+        status = self.status(job_id)
+        self.assertEqual(status["status"], IngestJobStatus.REJECTED.name.lower())
+        self.assertEqual(status["report"]["stages"][-1]["name"], "sender")
+        self.assertIsNone(job.raw)
+
+    def test_process_accepted_email(self):
+        with open(TEST_EMAILS / "sipb-hackathon.txt", "r") as f:
+            job_id = db_operations.enqueue_email(self.session, f.read())
+        job = db_operations.claim_ingest_job(self.session)
+        with mock.patch("utils.email_parser.ACCEPTED_SENDER_DOMAINS", ("domain.com",)), \
+             mock.patch("utils.email_parser.save_pending_image", return_value=ImageVariants("image", [500], ("webp",))):
+            ingest_worker.process_ingest_job(self.session, job)
+
+        status = self.status(job_id)
+        self.assertEqual(status["status"], "done")
+        self.assertIsNotNone(status["event_id"])
+        self.assertTrue(status["report"]["accepted"])
+
+    def test_process_missing_headers(self):
+        job_id = db_operations.enqueue_email(self.session, "From: someone@mit.edu\n\nhello")
+        job = db_operations.claim_ingest_job(self.session)
+        ingest_worker.process_ingest_job(self.session, job)
+        self.assertEqual(self.status(job_id)["status"], "dead")
+        self.assertEqual(self.session.query(IngestDeadLetter).count(), 1)
+
+class TestIngestPool(unittest.TestCase):
+
+    def tearDown(self):
+        ingest_worker.shutdown_ingest_pool()
+
+    def test_digests_in_pool(self):
+        with open(TEST_EMAILS / "sipb-hackathon.txt", "r") as f:
+            raw = f.read().replace("username@domain.com", "username@mit.edu")
+        with mock.patch.object(config, "INGEST_PROCESSES", 1):
+            report, summary = ingest_worker.digest_email(raw)
+            self.assertIsNotNone(ingest_worker._pool)
+        self.assertTrue(report["accepted"])
+        self.assertEqual(summary.sender, "username@mit.edu")
+        self.assertEqual(summary.location, "W20-557")
+        # descriptions come back compressed, smaller than the email
+        email = eat(raw)
+        self.assertLess(len(pickle.dumps(summary)), len(raw))
+        self.assertEqual(decompress_text(summary.plaintext), email.plaintext)
+        self.assertEqual(decompress_text(summary.html), email.content["text/html"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from utils.location_parser import find_locations, parse_locations
+
+class TestLocationParser(unittest.TestCase):
+
+    def test_longest_match(self):
+        self.assertEqual(parse_locations("See you in Kresge Auditorium!"), {"Kresge Auditorium"})
+
+    def test_case_insensitive(self):
+        self.assertEqual(parse_locations("in the stata lobby"), {"Stata Lobby"})
+
+    def test_whole_words_only(self):
+        self.assertEqual(parse_locations("Go Walkers"), set())
+
+    def test_building_room(self):
+        self.assertEqual(parse_locations("Rooms 32-G882 and E51-315, near E51"), {"32-G882", "E51-315", "E51"})
+
+    def test_offsets(self):
+        text = "Lobby 10, then Kresge"
+        matches = find_locations(text)
+        self.assertEqual([match.location for match in matches], ["Lobby 10", "Kresge"])
+        for match in matches:
+            self.assertEqual(text[match.start:match.end].lower(), match.location.lower())
+
+if __name__ == '__main__':
+    unittest.main()
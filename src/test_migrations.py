@@ -0,0 +1,206 @@
+import unittest
+from datetime import date, datetime
+from unittest import mock
+
+import sqlalchemy
+
+import db.db_operations as db_operations
+from db import migrations
+from db.descriptions import compress_text_descriptions
+from db.schema import EventDescription, EventDescriptionType, DescriptionEncoding, EMAIL_DESCRIPTION_CHUNK_SIZE
+from database_test_case import DatabaseTestCase
+
+INDEXES = [
+    ("events", "ix_events_start_date"),
+    ("events", "ix_events_date_created"),
+    ("events", "ix_events_start_date_category_mask"),
+    ("events", "ix_events_date_created_category_mask"),
+    ("events", "ix_events_page"),
+    ("event_tags", "ix_event_tags_event_id"),
+    ("event_descriptions", "ix_event_descriptions_event_id"),
+    ("session_ids", "ix_session_ids_email_addr"),
+    ("club_memberships", "ix_club_memberships_user_id"),
+    ("ingest_jobs", "ix_ingest_jobs_claimed_by"),
+]
+
+def index_names(engine, table_name):
+    # including the indexes on expressions, which SQLAlchemy does not reflect
+    return {row[0] for row in engine.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", table_name)}
+
+class TestMigrations(DatabaseTestCase):
+    DATABASE_FILE = True
+
+    def test_upgrade_existing_database(self):
+        # a database created before the indexes were added to the schema
+        for table_name, index_name in INDEXES:
+            self.engine.execute(f"DROP INDEX {index_name}")
+
+        self.assertEqual(migrations.upgrade(self.engine), [migration.version for migration in migrations.MIGRATIONS])
+        for table_name, index_name in INDEXES:
+            self.assertIn(index_name, index_names(self.engine, table_name))
+        self.assertEqual(migrations.upgrade(self.engine), [])
+
+    def test_backfill_category_mask(self):
+        # a database created before events had a category bitmask
+        session = self.session
+        user_id = db_operations.add_user(session, "username@mit.edu")
+        tags = [[0], [1, 3], [], [9, 2, 2]]
+        for event_tags in tags:
+            db_operations.add_event(session, "Event", user_id, "description", event_tags)
+        session.close()
+        with self.engine.begin() as connection:
+            for index_name in ("ix_events_start_date_category_mask", "ix_events_date_created_category_mask"):
+                connection.execute(f"DROP INDEX {index_name}")
+            connection.execute("ALTER TABLE events DROP COLUMN category_mask")
+
+        migrations.upgrade(self.engine)
+        masks = [row[0] for row in self.engine.execute("SELECT category_mask FROM events ORDER BY id")]
+        self.assertEqual(masks, [0b1, 0b1010, 0, 0b1000000100])
+        events = db_operations.get_all_events(session)
+        self.assertEqual(db_operations.get_event_tags(session, events), [[0], [1, 3], [], [2, 9]])
+
+        # kept up to date when the tags of an event change
+        db_operations.add_event_tags(session, events[0].id, [5, 1])
+        self.assertEqual(db_operations.get_event_tags(session, events[:1], convertName=True), [["FOOD", "PERFORMANCE"]])
+
+    def test_backfill_interrupted(self):
+        # the column was added (and committed), but its backfill never finished
+        user_id = db_operations.add_user(self.session, "username@mit.edu")
+        db_operations.add_event(self.session, "Event", user_id, "description", [1, 3])
+        self.session.close()
+        self.engine.execute("UPDATE events SET category_mask = 0")
+
+        migrations.upgrade(self.engine)
+        self.assertEqual(self.engine.execute("SELECT category_mask FROM events").scalar(), 0b1010)
+
+    def test_compress_descriptions(self):
+        # a database created before descriptions were compressed
+        session = self.session
+        user_id = db_operations.add_user(session, "username@mit.edu")
+        descriptions = [("description", "<p>description</p>" * 10000), ("", "<p>déjà vu</p>")]
+        for plaintext, html in descriptions:
+            event_id = db_operations.add_event(session, "Event", user_id, None, [])
+            for content_type, text in ((EventDescriptionType.PLAINTEXT, plaintext), (EventDescriptionType.HTML, html)):
+                for content_index, i in enumerate(range(0, len(text), EMAIL_DESCRIPTION_CHUNK_SIZE)):
+                    session.add(EventDescription(event_id, content_type.value, content_index, text[i:i+EMAIL_DESCRIPTION_CHUNK_SIZE]))
+        session.commit()
+        session.close()
+        with self.engine.begin() as connection:
+            connection.execute("ALTER TABLE event_descriptions DROP COLUMN encoding")
+            connection.execute("ALTER TABLE event_descriptions DROP COLUMN compressed_data")
+        self.assertEqual(self.engine.execute("SELECT COUNT(*) FROM event_descriptions").scalar(), 1 + 3 + 1)
+
+        commits = []
+        def record(connection):
+            commits.append(connection)
+        def compress(connection):
+            sqlalchemy.event.listen(self.engine, "commit", record)
+            try:
+                return compress_text_descriptions(connection, batch_size=1)
+            finally:
+                sqlalchemy.event.remove(self.engine, "commit", record)
+        with mock.patch("db.descriptions.compress_text_descriptions", compress):
+            migrations.upgrade(self.engine)
+        self.assertEqual(len(commits), len(descriptions)) # one range of events at a time
+        rows = self.engine.execute("SELECT encoding, data FROM event_descriptions").fetchall()
+        self.assertEqual(rows, [(DescriptionEncoding.ZLIB.value, None)] * 3)
+        events = db_operations.get_all_events(session)
+        for description_type, texts in zip(EventDescriptionType, zip(*descriptions)):
+            self.assertEqual(db_operations.get_event_descriptions(session, events, description_type), list(texts))
+
+    def test_upgrade_new_database(self):
+        migrations.upgrade(self.engine)
+        with self.engine.connect() as connection:
+            self.assertEqual(set(migrations.applied_migrations(connection)), {migration.version for migration in migrations.MIGRATIONS})
+
+class TestQueryPlans(DatabaseTestCase):
+    '''
+    Check that the queries behind the `/get_events_*` endpoints never scan a whole table
+    '''
+    MIGRATE = True
+
+    def setUp(self):
+        super().setUp()
+        user_id = db_operations.add_user(self.session, "username@mit.edu")
+        for day in range(1, 29):
+            db_operations.add_event(
+                self.session, f"Event {day}", user_id, "description", [day % 10],
+                start_date=date(2023, 2, day), description_html="<p>description</p>",
+                date_created=datetime(2023, 1, day),
+            )
+        db_operations.add_session_id(self.session, "username@mit.edu", token="token")
+
+        self.statements = []
+        sqlalchemy.event.listen(self.engine, "before_cursor_execute", self.record)
+        self.addCleanup(sqlalchemy.event.remove, self.engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            self.statements.append((statement, parameters))
+
+    def assert_indexed(self):
+        self.assertTrue(self.statements)
+        statements, self.statements = self.statements, []
+        with self.engine.connect() as connection:
+            for statement, parameters in statements:
+                plan = connection.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+                for row in plan:
+                    detail = row[-1]
+                    if detail.startswith("SCAN") and "INDEX" not in detail:
+                        self.fail(f"{detail!r} in the plan of: {statement}")
+
+    def test_get_events(self):
+        for month, filter_by_sent_date in ((2, False), (1, True)):
+            events = db_operations.get_events_by_date(self.session, date(2023, month, 3), filter_by_sent_date)
+            events += db_operations.get_events_by_month(self.session, month, 2023, filter_by_sent_date)
+            self.assertTrue(events)
+            db_operations.get_event_tags(self.session, events)
+            db_operations.get_event_user_emails(self.session, events)
+            db_operations.get_event_descriptions(self.session, events, EventDescriptionType.HTML)
+            self.assert_indexed()
+
+    def test_get_events_by_category(self):
+        for month, filter_by_sent_date in ((2, False), (1, True)):
+            events = db_operations.get_events_by_category_in_month(self.session, 3, month, 2023, filter_by_sent_date)
+            self.assertEqual([event.title for event in events], ["Event 3", "Event 13", "Event 23"])
+            counts = db_operations.get_category_counts_by_day(self.session, month, 2023, filter_by_sent_date)
+            self.assertEqual(len(counts), 28)
+            self.assertEqual(counts[f"2023-0{month}-13"], {"FUNDRAISING": 1})
+            counts = db_operations.get_daily_event_counts(self.session, date(2023, 1, 1), date(2023, 12, 31), filter_by_sent_date, 3)
+            self.assertEqual(list(counts.values()), [1, 1, 1])
+            self.assert_indexed()
+
+    def test_get_events_in_range(self):
+        pages, after = [], None
+        while True:
+            events = db_operations.get_events_in_range(self.session, date(2023, 2, 3), date(2023, 2, 20), 1 << 3 | 1 << 5, limit=2, after=after)
+            if not events:
+                break
+            pages.append([event.title for event in events])
+            after = db_operations.event_page_key(events[-1])
+        self.assertEqual(pages, [["Event 3", "Event 5"], ["Event 13", "Event 15"]])
+        # pages are read in the order of the index, from the key of the previous page
+        with self.engine.connect() as connection:
+            statement, parameters = self.statements[-1]
+            details = [row[-1] for row in connection.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+        self.assertEqual(details, ["SEARCH events USING INDEX ix_events_page (start_date>? AND start_date<?)"])
+        self.assert_indexed()
+
+    def test_validate_session_id(self):
+        self.assertTrue(db_operations.validate_session_id(self.session, "username@mit.edu", "token"))
+        self.assert_indexed()
+
+    def test_has_edit_permission(self):
+        db_operations.has_edit_permission(self.session, 1, 2)
+        self.assert_indexed()
+
+    def test_claim_ingest_job(self):
+        db_operations.enqueue_email(self.session, "raw")
+        self.statements = []
+        job = db_operations.claim_ingest_job(self.session)
+        db_operations.count_pending_ingest_jobs(self.session)
+        db_operations.get_ingest_job_status(self.session, job.id)
+        self.assert_indexed()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from dataclasses import dataclass
+from utils.parser import Parser, ParserChain
+
+@dataclass
+class Pair:
+    left: int
+    right: int
+
+@dataclass
+class Word:
+    word: str
+
+PAIR_PATTERN = r"\b(?P<left>\d+)-(?P<right>\d+)\b"
+
+_parser_increasing = Parser[Pair](Pair, PAIR_PATTERN, [int, int], lambda pair: pair if pair.left < pair.right else None)
+_parser_decreasing = Parser[Pair](Pair, PAIR_PATTERN, [int, int], lambda pair: pair if pair.left > pair.right else None)
+_parser_word = Parser[Word](Word, r"\b(?P<word>[a-z]+)\b", [str])
+
+class TestParserChain(unittest.TestCase):
+
+    def test_shared_pattern_matches_each_parser(self):
+        chain = ParserChain([_parser_increasing, _parser_decreasing], lambda pair: (pair.left, pair.right))
+        self.assertEqual(len(chain.parsers_by_pattern), 1)
+        text = "5-3, 1-2, 4-3 and 7-8"
+        self.assertEqual(list(chain.iter(text)), [(1, 2), (7, 8), (5, 3), (4, 3)])
+        self.assertEqual(chain(text), (1, 2))
+
+    def test_merged_chain(self):
+        chain = ParserChain([_parser_decreasing, _parser_word, _parser_increasing], str, merge=True)
+        self.assertEqual(len(chain.branches), 2)
+        text = "5-3, then 1-2"
+        self.assertEqual(list(chain.iter(text)), [str(Pair(5, 3)), str(Word("then")), str(Pair(1, 2))])
+
+    def test_matches(self):
+        chain = ParserChain([_parser_word], str, merge=True)
+        text = "12 monkeys"
+        [(match, parsed)] = chain.iter_matches(text)
+        self.assertEqual(match.span(), (3, 10))
+        self.assertEqual(parsed, Word("monkeys"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import asyncio
+import unittest
+from datetime import date, datetime, time
+from unittest import mock
+
+import sqlalchemy
+
+import db.db_operations as db_operations
+import main
+from db.schema import Event
+from database_test_case import DatabaseTestCase
+
+AUTH = {"email_addr": "username@mit.edu", "session_id": "session"}
+
+# requests to each endpoint that queries the database, and how many queries they should take
+ENDPOINTS = {
+    "get_event_category_frequency_for_month": (
+        main.get_event_category_frequency_for_month,
+        lambda: main.GetEventsFrequencyByMonth(month=2, year=2023, auth=AUTH),
+        2, # session, counts by day
+    ),
+    "get_event_heatmap": (
+        main.get_event_heatmap,
+        lambda: main.GetEventHeatmap(from_date=date(2023, 1, 1), to_date=date(2023, 12, 31), auth=AUTH),
+        2, # session, counts by day
+    ),
+    "get_events_by_month": (
+        main.get_events_by_month,
+        lambda: main.GetEventsByMonth(month=2, year=2023, auth=AUTH),
+        3, # session, events (with their tags), users
+    ),
+    "get_events_by_month (by sent date)": (
+        main.get_events_by_month,
+        lambda: main.GetEventsByMonth(month=1, year=2023, filter_by_sent_date=True, auth=AUTH),
+        3,
+    ),
+    "get_events_by_date": (
+        main.get_events_by_date,
+        lambda: main.GetEventsByDate(from_date=date(2023, 2, 3), auth=AUTH),
+        3,
+    ),
+    "get_events_by_date (with descriptions)": (
+        main.get_events_by_date,
+        lambda: main.GetEventsByDate(from_date=date(2023, 2, 3), include_description=True, auth=AUTH),
+        5, # session, events, users, plaintext and html descriptions
+    ),
+    "get_events_in_range": (
+        main.get_events_in_range,
+        lambda: main.GetEventsInRange(from_date=date(2023, 2, 1), to_date=date(2023, 2, 28), page_size=10, auth=AUTH),
+        3, # session, events (with their tags), users
+    ),
+    "get_events_in_range (next page)": (
+        main.get_events_in_range,
+        lambda: main.GetEventsInRange(
+            from_date=date(2023, 2, 1), to_date=date(2023, 2, 28), category_mask=0b11, page_size=10, auth=AUTH,
+            cursor=db_operations.encode_event_cursor((date(2023, 2, 3), time(0), "Event", 0)),
+        ),
+        3,
+    ),
+    "search_events": (
+        main.search_events,
+        lambda: main.SearchEvents(query="event descr", from_date=date(2023, 2, 1), to_date=date(2023, 2, 28), auth=AUTH),
+        4, # session, search, events, users
+    ),
+    "create_session": (
+        main.create_session,
+        lambda: main.NewAuthModel(email_addr="username@mit.edu", token="token"),
+        1, # session id (added by the database writer)
+    ),
+    "eat": (
+        main.digest,
+        lambda: main.EmailModel(email="raw", token="token"),
+        2, # backlog, job (added by the database writer)
+    ),
+    "eat/status": (
+        lambda job_id: main.digest_status(job_id, "token"),
+        lambda: 1,
+        1,
+    ),
+}
+
+class TestQueryCounts(DatabaseTestCase):
+    '''
+    Check that each endpoint makes a constant number of queries, however many
+    events it returns (no N+1 queries)
+    '''
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch.object(db_operations, "is_redis_alive", False),
+            mock.patch.object(main, "valid_API_tokens", ["token"]),
+            mock.patch.object(main.ingest_worker, "notify"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        with db_operations.session_scope() as session:
+            db_operations.add_session_id(session, AUTH["email_addr"], token=AUTH["session_id"])
+            db_operations.enqueue_email(session, "raw")
+
+        self.queries = 0
+        sqlalchemy.event.listen(self.engine, "before_cursor_execute", self.count)
+        self.addCleanup(sqlalchemy.event.remove, self.engine, "before_cursor_execute", self.count)
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE")):
+            self.queries += 1
+
+    def add_events(self, count):
+        with db_operations.session_scope() as session:
+            for i in range(count):
+                user_id = db_operations.add_user(session, f"user{i}@mit.edu")
+                db_operations.add_event(
+                    session, f"Event {i}", user_id, "description", [i % 10, (i + 1) % 10],
+                    start_date=date(2023, 2, 3), description_html="<p>description</p>" * 5000,
+                    date_created=datetime(2023, 1, 3),
+                )
+
+    def call(self, endpoint, request):
+        self.queries = 0
+        res = endpoint(request())
+        if asyncio.iscoroutine(res):
+            res = asyncio.run(res)
+        return res, self.queries
+
+    def test_query_counts(self):
+        for event_count in (1, 30):
+            self.add_events(event_count)
+            for name, (endpoint, request, expected) in ENDPOINTS.items():
+                with self.subTest(name, events=event_count):
+                    _, queries = self.call(endpoint, request)
+                    self.assertEqual(queries, expected)
+
+    def test_responses(self):
+        self.add_events(3)
+        res, _ = self.call(main.get_events_by_date, ENDPOINTS["get_events_by_date (with descriptions)"][1])
+        self.assertEqual(len(res["events"]), 3)
+        self.assertEqual(res["users"], ["user0@mit.edu", "user1@mit.edu", "user2@mit.edu"])
+        self.assertEqual(res["tags"], [[0, 1], [1, 2], [2, 3]])
+        self.assertEqual(res["descriptions"], ["description"] * 3)
+        self.assertEqual(res["descriptions_html"], ["<p>description</p>" * 5000] * 3)
+
+        res, _ = self.call(main.get_event_category_frequency_for_month, ENDPOINTS["get_event_category_frequency_for_month"][1])
+        self.assertEqual(res["frequency"], {"2023-02-03": {"OTHER": 1, "FOOD": 2, "CAREER": 2, "FUNDRAISING": 1}})
+        res, _ = self.call(main.get_event_heatmap, ENDPOINTS["get_event_heatmap"][1])
+        self.assertEqual(res["counts"], {"2023-02-03": 3})
+
+        pages, cursor = [], None
+        while True:
+            request = lambda: main.GetEventsInRange(from_date=date(2023, 2, 3), to_date=date(2023, 2, 3), page_size=2, cursor=cursor, auth=AUTH)
+            res, _ = self.call(main.get_events_in_range, request)
+            pages.append((res["users"], res["tags"]))
+            cursor = res["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages, [(["user0@mit.edu", "user1@mit.edu"], [[0, 1], [1, 2]]), (["user2@mit.edu"], [[2, 3]])])
+        request = lambda: main.GetEventsInRange(from_date=date(2023, 2, 3), to_date=date(2023, 2, 3), category_mask=1 << 3, auth=AUTH)
+        res, _ = self.call(main.get_events_in_range, request)
+        self.assertEqual(res["tags"], [[2, 3]])
+        with self.assertRaises(main.HTTPException) as raised:
+            self.call(main.get_events_in_range, lambda: main.GetEventsInRange(from_date=date(2023, 2, 3), to_date=date(2023, 2, 3), cursor="nope", auth=AUTH))
+        self.assertEqual(raised.exception.status_code, 400)
+        for category_mask in (-1, 1 << 64):
+            with self.assertRaises(main.ValidationError):
+                main.GetEventsInRange(from_date=date(2023, 2, 3), to_date=date(2023, 2, 3), category_mask=category_mask, auth=AUTH)
+
+        # events without a start time are paged like midnight
+        with db_operations.session_scope() as session:
+            session.query(Event).filter(Event.title == "Event 1").update({Event.start_time: None})
+        pages, cursor = [], None
+        while True:
+            request = lambda: main.GetEventsInRange(from_date=date(2023, 2, 3), to_date=date(2023, 2, 3), page_size=1, cursor=cursor, auth=AUTH)
+            res, _ = self.call(main.get_events_in_range, request)
+            pages.append([event["title"] for event in res["events"]])
+            cursor = res["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages, [["Event 0"], ["Event 1"], ["Event 2"]])
+
+        request = lambda: main.SearchEvents(query="event 1", page_size=2, auth=AUTH)
+        res, _ = self.call(main.search_events, request)
+        self.assertEqual([event["title"] for event in res["events"]], ["Event 1"])
+        self.assertEqual(res["users"], ["user1@mit.edu"])
+        self.assertEqual(res["snippets"], ["<mark>Event</mark> <mark>1</mark>"])
+        self.assertIsNone(res["next_page"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+from datetime import date, datetime
+
+import sqlalchemy
+
+import db.db_operations as db_operations
+from db import migrations
+from database_test_case import DatabaseTestCase
+from db.search import fts_query, rebuild_search_index
+
+class TestSearch(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = db_operations.add_user(self.session, "username@mit.edu")
+
+    def add_event(self, title, description="", location="", day=1):
+        return db_operations.add_event(
+            self.session, title, self.user_id, description, [], location=location,
+            start_date=date(2023, 2, day), date_created=datetime(2023, 1, day),
+        )
+
+    def search(self, query, **kwargs):
+        events, _ = db_operations.search_events(self.session, query, **kwargs)
+        return [event.title for event in events]
+
+    def test_fts_query(self):
+        self.assertEqual(fts_query('free "food" OR*'), '"free" "food" "OR"*')
+        self.assertIsNone(fts_query(" -* "))
+
+    def test_ranking(self):
+        self.add_event("Study break", "Come for the pizza")
+        self.add_event("Pizza night", "Free food")
+        self.add_event("Movie", "Snacks", location="Pizza room")
+        self.add_event("Concert")
+        self.assertEqual(self.search("pizza"), ["Pizza night", "Movie", "Study break"])
+        self.assertEqual(self.search("piz"), ["Pizza night", "Movie", "Study break"]) # still being typed
+        self.assertEqual(self.search("pizza free"), ["Pizza night"])
+        self.assertEqual(self.search("concerts"), ["Concert"]) # stemmed
+        self.assertEqual(self.search("   "), [])
+
+    def test_snippets(self):
+        self.add_event("Café <b>night</b>", "words " * 50 + "Free cafe food & drinks " + "words " * 50)
+        _, snippets = db_operations.search_events(self.session, "cafe")
+        self.assertEqual(snippets, ["<mark>Café</mark> &lt;b&gt;night&lt;/b&gt;"]) # best matching column, escaped
+        _, snippets = db_operations.search_events(self.session, "drinks")
+        self.assertIn("cafe food &amp; <mark>drinks</mark>", snippets[0])
+        self.assertTrue(snippets[0].startswith("…") and snippets[0].endswith("…"))
+
+    def test_filters_and_pages(self):
+        for day in range(1, 11):
+            self.add_event(f"Event {day}", day=day)
+        self.assertEqual(self.search("event", from_date=date(2023, 2, 3), to_date=date(2023, 2, 5)), ["Event 3", "Event 4", "Event 5"])
+        self.assertEqual(self.search("event", from_date=date(2023, 1, 9), filter_by_sent_date=True), ["Event 9", "Event 10"])
+        pages = [self.search("event", limit=4, offset=offset) for offset in (0, 4, 8)]
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual(len({title for page in pages for title in page}), 10)
+
+    def test_update_event(self):
+        event_id = self.add_event("Pizza night", "Free food")
+        self.assertTrue(db_operations.update_event(self.session, event_id, "Taco night", "Free food", location="Lobby 7"))
+        self.assertEqual(self.search("pizza"), [])
+        self.assertEqual(self.search("taco lobby"), ["Taco night"])
+        self.assertEqual(self.search("food"), ["Taco night"])
+
+    def test_rebuild(self):
+        self.add_event("Pizza night", "Free food")
+        self.add_event("Concert", "Free music")
+        self.session.execute("DELETE FROM events_fts")
+        self.assertEqual(self.search("free"), [])
+        self.assertEqual(rebuild_search_index(self.session.connection()), 2) # in the transaction of the session
+        self.assertEqual(sorted(self.search("free")), ["Concert", "Pizza night"])
+        self.session.commit()
+
+        # outside of a transaction, each batch of events is committed
+        commits = []
+        def record(connection):
+            commits.append(connection)
+        sqlalchemy.event.listen(self.engine, "commit", record)
+        self.addCleanup(sqlalchemy.event.remove, self.engine, "commit", record)
+        with self.engine.connect() as connection:
+            self.assertEqual(rebuild_search_index(connection, batch_size=1), 2)
+        self.assertEqual(len(commits), 1 + 2 + 1) # cleared, indexed, optimized
+        self.assertEqual(sorted(self.search("free")), ["Concert", "Pizza night"])
+
+    def test_migration(self):
+        # a database created before events were indexed
+        self.add_event("Pizza night", "Free food")
+        self.session.commit()
+        self.session.close()
+        self.engine.execute("DROP TABLE events_fts")
+        migrations.upgrade(self.engine)
+        self.assertEqual(self.search("food"), ["Pizza night"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).parent.parent / "mail_scripts"))
+import send_to_backend
+
+class TestDeliverBatch(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for patcher in (
+            mock.patch.object(send_to_backend, "SPOOL_DIR", tmp.name),
+            mock.patch.object(send_to_backend, "ENDPOINTS", {"prod": "http://localhost/eat"}),
+            mock.patch.object(send_to_backend, "send_to_mattermost"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.email_ids = [send_to_backend.spool(f"Subject: {i}\n\nhello\n".encode()) for i in range(3)]
+        self.endpoint = send_to_backend.Endpoint("prod", "http://localhost/eat")
+
+    def test_transient_errors_are_retried(self):
+        reports = [
+            {"index": 0, "status": "accepted", "message_id": "<0@mit.edu>", "event_id": 1},
+            {"index": 1, "status": "error", "error": "database is locked", "permanent": False},
+            {"index": 2, "status": "error", "error": "missing headers", "permanent": True},
+        ]
+        due = self.endpoint.due(time.time())
+        with mock.patch.object(self.endpoint, "post_batch", return_value=reports):
+            self.assertEqual(self.endpoint.deliver_batch(due), 1)
+
+        delivered, transient, permanent = (send_to_backend.read_state("prod", email_id) for email_id in self.email_ids)
+        self.assertTrue(delivered["delivered"])
+        self.assertFalse(send_to_backend.is_settled(transient))
+        self.assertEqual((transient["attempts"], transient["error"]), (1, "database is locked"))
+        self.assertGreater(transient["next_attempt"], time.time())
+        self.assertTrue(send_to_backend.is_settled(permanent))
+        # only the transient error is left to retry, once its backoff is over
+        self.assertEqual([email_id for email_id, _ in self.endpoint.due(time.time() + send_to_backend.BACKOFF)], self.email_ids[1:2])
+
+    def test_reports_matched_by_index(self):
+        reports = [
+            {"index": 2, "status": "rejected", "rejection": "not dormspam"},
+            {"index": 0, "status": "accepted", "message_id": "<0@mit.edu>", "event_id": 1},
+            {"index": 1, "status": "duplicate", "message_id": "<0@mit.edu>", "event_id": 1},
+        ]
+        due = self.endpoint.due(time.time())
+        with mock.patch.object(self.endpoint, "post_batch", return_value=reports):
+            self.assertEqual(self.endpoint.deliver_batch(due), 3)
+        self.assertTrue(all(send_to_backend.read_state("prod", email_id)["delivered"] for email_id in self.email_ids))
+
+    def test_missing_reports_are_retried(self):
+        # e.g. the backend dropped an email it could not split out of the batch
+        reports = [
+            {"index": 0, "status": "accepted", "message_id": "<0@mit.edu>", "event_id": 1},
+            {"index": 1, "status": "accepted", "message_id": "<2@mit.edu>", "event_id": 2},
+        ]
+        due = self.endpoint.due(time.time())
+        with mock.patch.object(self.endpoint, "post_batch", return_value=reports):
+            self.assertEqual(self.endpoint.deliver_batch(due), 0)
+        self.assertFalse(self.endpoint.batches)
+        # none was settled, they are all sent again (one by one)
+        self.assertEqual([email_id for email_id, _ in self.endpoint.due(time.time())], self.email_ids)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import datetime
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import sqlalchemy
+
+import configs.server_configs as config
+import db.db_operations as db_operations
+import db.schema as schema
+from db import migrations
+import ingest_worker
+from utils.compressed_text import compress_text
+from utils.email_parser import EventSummary
+from utils.time_parser import EventTime
+
+def make_summaries(count, prefix):
+    return [
+        EventSummary(
+            f"<{prefix}-{i}@mit.edu>", f"user{i % 5}@mit.edu", f"Event {i}", compress_text("description " * 100),
+            compress_text("<p>description</p>" * 1000), [1, 7], "Lobby 10",
+            EventTime(datetime.date(2023, 2, 1 + i % 28), None, None, None),
+            datetime.datetime(2023, 1, 1 + i % 28), [],
+        )
+        for i in range(count)
+    ]
+
+def ingest(stop, written, errors):
+    '''
+    Add batches of events until `stop` is set (in a forked process)
+    '''
+    batch = 0
+    while not stop.is_set():
+        try:
+            with db_operations.session_scope() as session:
+                ingest_worker.add_digested_events(session, make_summaries(50, batch))
+        except sqlalchemy.exc.OperationalError:
+            errors.value += 1
+        else:
+            written.value += 50
+        batch += 1
+
+class TestSQLiteProfile(unittest.TestCase):
+    '''
+    Check the connection profile of the SQLite database, and that reads are
+    not held up by another process ingesting events
+    '''
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for patcher in (
+            mock.patch.object(schema, "SQL_URL", f"sqlite:///{tmp.name}/test.db"),
+            mock.patch.object(schema, "_engine", None),
+            mock.patch.object(db_operations, "is_redis_alive", False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(db_operations.Session.remove)
+        engine = schema.new_engine()
+        migrations.setup_database(engine) # like `run_prod.sh`, before the server starts
+        engine.dispose()
+
+    def test_pragmas(self):
+        expected = {
+            "journal_mode": "wal",
+            "synchronous": 1, # NORMAL
+            "busy_timeout": config.SQLITE_PRAGMAS["busy_timeout"],
+            "cache_size": config.SQLITE_PRAGMAS["cache_size"],
+            "temp_store": 2, # MEMORY
+        }
+        with schema.get_engine().connect() as connection:
+            for name, value in expected.items():
+                self.assertEqual(connection.execute(f"PRAGMA {name}").scalar(), value, name)
+
+    def test_engine_per_process(self):
+        engine = schema.get_engine()
+        self.assertIs(schema.get_engine(), engine)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if schema.get_engine() is not engine else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+    def test_schema_out_of_date(self):
+        # the engine of a worker never migrates the database itself
+        with schema.new_engine().begin() as connection:
+            connection.execute("DELETE FROM schema_migrations WHERE version = 2")
+        with self.assertRaises(migrations.SchemaOutOfDate):
+            schema.get_engine()
+        self.assertIsNone(schema._engine)
+
+    def read_latencies(self, duration):
+        latencies = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            with db_operations.session_scope() as session:
+                events = db_operations.get_events_by_date(session, datetime.date(2023, 2, 3), False)
+                db_operations.get_event_descriptions(session, events, schema.EventDescriptionType.HTML)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def test_reads_during_ingest(self):
+        with db_operations.session_scope() as session:
+            ingest_worker.add_digested_events(session, make_summaries(280, "seed"))
+        idle = self.read_latencies(1)
+
+        context = multiprocessing.get_context("fork")
+        stop, written, errors = context.Event(), context.Value("i", 0), context.Value("i", 0)
+        writer = context.Process(target=ingest, args=(stop, written, errors))
+        writer.start()
+        try:
+            while not written.value:
+                time.sleep(0.01)
+            busy = self.read_latencies(2)
+        finally:
+            stop.set()
+            writer.join()
+
+        self.assertEqual(errors.value, 0)
+        self.assertGreater(written.value, 50)
+        # the reader shares the CPU with the writer, but never waits for its locks
+        self.assertLess(statistics.median(busy), 10 * statistics.median(idle))
+        self.assertLess(max(busy), config.SQLITE_PRAGMAS["busy_timeout"] / 1000 / 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -97,5 +97,32 @@ class TestTimeParser(unittest.TestCase):
         self.assertEqual(expected.end_date, actual.end_date)
         self.assertEqual(expected.end_time, actual.end_time)
 
+    def test_time_range_named_start(self):
+        text = "Open house from noon-2pm!"
+        expected = EventTime(None, time(12, 0), None, time(14, 0))
+        actual = parse_event_time(text, today=self.today)
+        self.assertEqual(expected.start_date, actual.start_date)
+        self.assertEqual(expected.start_time, actual.start_time)
+        self.assertEqual(expected.end_date, actual.end_date)
+        self.assertEqual(expected.end_time, actual.end_time)
+
+    def test_time_range_minutes(self):
+        text = "Fri Mar 17th, 6:30pm-10pm in W20-557"
+        expected = EventTime(date(2023, 3, 17), time(18, 30), date(2023, 3, 17), time(22, 0))
+        actual = parse_event_time(text, today=self.today)
+        self.assertEqual(expected.start_date, actual.start_date)
+        self.assertEqual(expected.start_time, actual.start_time)
+        self.assertEqual(expected.end_date, actual.end_date)
+        self.assertEqual(expected.end_time, actual.end_time)
+
+    def test_not_a_time_range(self):
+        text = "Teams of 3-5 people, on Feb 30 or 3/18 at 4:30"
+        expected = EventTime(date(2023, 3, 18), time(4, 30), None, None)
+        actual = parse_event_time(text, today=self.today)
+        self.assertEqual(expected.start_date, actual.start_date)
+        self.assertEqual(expected.start_time, actual.start_time)
+        self.assertEqual(expected.end_date, actual.end_date)
+        self.assertEqual(expected.end_time, actual.end_time)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import binascii
+import hashlib
+import mmap
+import os
+import uuid
+from io import BytesIO
+from typing import BinaryIO, Optional, Union
+
+# characters of a base64 payload per decoded chunk
+BASE64_CHUNK_SIZE = 1 << 16
+
+# line breaks (and other whitespace) folding base64 payloads in emails
+_WHITESPACE = b" \t\r\n"
+
+class Base64Spool:
+    """Decodes a base64 payload chunk by chunk, into memory, or into a
+    temporary file once it grows past ``max_memory`` bytes
+
+    Only one chunk of the payload is copied at a time, so decoding an
+    attachment never takes much more memory than ``max_memory``, however large
+    it is. The decoded bytes are hashed as they are decoded, and can be read
+    back without copying them (see ``reader``), or moved to their destination
+    (see ``persist``).
+
+    Example: ::
+
+        >>> with Base64Spool("/tmp", max_memory=1024) as spool:
+        ...     spool.write("aGVsbG8g\\nd29y\\nbGQ=\\n")
+        ...     spool.reader().read()
+        b'hello world'
+        >>> spool.size
+        11
+    """
+
+    def __init__(self, directory: str, max_memory: int):
+        self.directory = directory
+        self.max_memory = max_memory
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.path: Optional[str] = None # of the temporary file, once rolled over
+        self._buffer: Union[BytesIO, BinaryIO] = BytesIO()
+        self._map: Optional[mmap.mmap] = None
+        self._carry = b"" # characters of an incomplete quantum, left for the next chunk
+
+    def write(self, payload: str, chunk_size=BASE64_CHUNK_SIZE) -> None:
+        """Decode (the next part of) a base64 payload
+        """
+        for i in range(0, len(payload), chunk_size):
+            chunk = self._carry + payload[i:i+chunk_size].encode("ascii", errors="ignore").translate(None, _WHITESPACE)
+            end = len(chunk) - len(chunk) % 4
+            self._carry = chunk[end:]
+            self._write_decoded(binascii.a2b_base64(chunk[:end]))
+
+    def close_payload(self) -> None:
+        """Decode what is left of the payload (e.g. with missing padding)
+        """
+        if self._carry:
+            carry, self._carry = self._carry, b""
+            self._write_decoded(binascii.a2b_base64(carry + b"=" * (-len(carry) % 4)))
+
+    def _write_decoded(self, data: bytes) -> None:
+        if self.path is None and self.size + len(data) > self.max_memory:
+            self._roll_over()
+        self._buffer.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def _roll_over(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{uuid.uuid4().hex}.tmp")
+        spooled = open(self.path, "wb+")
+        spooled.write(self._buffer.getbuffer())
+        self._buffer = spooled
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+    def reader(self) -> BinaryIO:
+        """File-like object reading the decoded bytes from the start, without
+        copying them: the memory buffer itself, or a memory map of the file
+        """
+        self.close_payload()
+        if self.path is None:
+            self._buffer.seek(0)
+            return self._buffer
+        self._buffer.flush()
+        if self._map is None:
+            if self.size == 0:
+                return BytesIO()
+            self._map = mmap.mmap(self._buffer.fileno(), 0, access=mmap.ACCESS_READ)
+        self._map.seek(0)
+        return self._map # type: ignore
+
+    def persist(self, path: str) -> None:
+        """Move the decoded bytes to the file ``path``, atomically
+        """
+        self.close_payload()
+        if self.path is None:
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self._buffer.getbuffer())
+            os.replace(tmp_path, path)
+        else:
+            self._buffer.flush()
+            os.replace(self.path, path)
+            self.path = None
+        self.close()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._buffer.close()
+        if self.path is not None:
+            os.remove(self.path)
+            self.path = None
+
+    def __enter__(self) -> "Base64Spool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
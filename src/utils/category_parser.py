@@ -1,7 +1,8 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Optional, Set
-import re
+from typing import Iterable, List, Optional, Set, Tuple
+
+from .keyword_automaton import KeywordAutomaton
 
 @dataclass
 class Category:
@@ -100,6 +101,26 @@ CATEGORIES = [
    RSVP
 ]
 
+# automaton over the keywords of all categories, and the keywords it was built from
+_category_automaton: Optional[KeywordAutomaton[int]] = None
+_category_automaton_keywords: Optional[Tuple[Tuple[str, ...], ...]] = None
+
+def category_automaton() -> KeywordAutomaton[int]:
+   """Automaton mapping every keyword to the indices of its categories
+
+   It is only rebuilt when the keywords in ``CATEGORIES`` change.
+   """
+   global _category_automaton, _category_automaton_keywords
+   keywords = tuple(tuple(category.keywords) for category in CATEGORIES)
+   if _category_automaton is None or keywords != _category_automaton_keywords:
+      _category_automaton = KeywordAutomaton(
+         (keyword, i)
+         for i, category_keywords in enumerate(keywords)
+         for keyword in category_keywords
+      )
+      _category_automaton_keywords = keywords
+   return _category_automaton
+
 def parse_categories(text: str) -> Set[int]:
    """An iteration of a category parser
 
@@ -110,13 +131,8 @@ def parse_categories(text: str) -> Set[int]:
       text: The body of text to search for locations.
    """
    categories = set()
-   for i, category in enumerate(CATEGORIES):
-      for keyword in category.keywords:
-         pattern = fr"\b{re.escape(keyword)}\b"
-         match = re.search(pattern, text, re.IGNORECASE)
-         if match:
-            categories.add(i)
-            break
+   for match in category_automaton().iter(text):
+      categories.update(match.values)
 
    return categories
 
@@ -130,3 +146,25 @@ def parse_tags(tags: list[int]) -> list[str]:
    """
    category_names = [CATEGORIES[tag].name for tag in tags]
    return category_names
+
+def tags_to_mask(tags: Iterable[int]) -> int:
+   """Convert tag numbers to a bitmask, with bit ``1 << tag`` set for each tag
+
+   This is how the database stores the categories of an event (see
+   ``Event.category_mask``), so that they can be filtered and counted in SQL.
+
+   Args:
+      tags: The tags associated with an event
+   """
+   mask = 0
+   for tag in tags:
+      mask |= 1 << tag
+   return mask
+
+def mask_to_tags(mask: int) -> list[int]:
+   """Convert a bitmask back to the (sorted, unique) tag numbers it holds
+
+   Args:
+      mask: The category bitmask of an event
+   """
+   return [tag for tag in range(len(CATEGORIES)) if mask & (1 << tag)]
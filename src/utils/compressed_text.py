@@ -0,0 +1,24 @@
+'''
+Text compressed with zlib, the way event descriptions are stored in the
+database (see `db/descriptions.py`)
+
+Digested emails send their descriptions back from the ingest processes in
+this form (see `email_parser.EventSummary`), so that they are small to
+pickle, and stored without being compressed again.
+'''
+import zlib
+
+import configs.server_configs as config
+
+def compress_text(text: str) -> bytes:
+    '''
+    Compress text (empty text stays empty, like an empty description has no chunks)
+    '''
+    if not text:
+        return b""
+    return zlib.compress(text.encode("utf-8"), config.DESCRIPTION_COMPRESSION_LEVEL)
+
+def decompress_text(data: bytes) -> str:
+    if not data:
+        return ""
+    return zlib.decompress(data).decode("utf-8")
@@ -1,28 +1,32 @@
 from typing import Any, Optional, Set, List, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property
 from zoneinfo import ZoneInfo
 
 import sys
 import datetime
+import time
 import re
 import html.parser
+import email.parser as email_parser
+import email.utils as email_utils
 import mailparser
 
 # Image processing
-from PIL import Image
-import base64
-from io import BytesIO
-from pillow_heif import register_heif_opener
+from PIL import Image, ImageOps, ExifTags
+from pillow_heif import register_heif_opener, register_avif_opener
 
 # Image saving
-import uuid
 import os
+import mimetypes
 
 from .parser import Parser, ParserChain
 from .time_parser import parse_event_time, EventTime
-from .location_parser import parse_locations
+from .location_parser import find_locations, LocationMatch
 from .category_parser import parse_categories
-from configs.server_configs import BASE_IMAGE_URL, LOCAL_IMAGE_PATH
+from .base64_spool import Base64Spool
+from .compressed_text import compress_text
+from configs.server_configs import BASE_IMAGE_URL, LOCAL_IMAGE_PATH, PENDING_IMAGE_PATH, IMAGE_FORMATS, IMAGE_MEMORY_CAP
 
 # pattern that determines if it's a dormspam or not
 DORMSPAM_PATTERN = r"\b[bB]cc[’'`-]?e?d\s+to\s+(all\s+)?(?:dorms|dormspam)[;,.]?\s+([\*\s\w-]+)\s+for bc-talk\b"
@@ -35,39 +39,279 @@ CONTENT_TYPES = (
 )
 
 # Compressing images
-COMPRESSED_IMAGE_WIDTH = 500 # pixels
-
-#Enable Pillow plugin to support HEIC images
+COMPRESSED_IMAGE_WIDTH = 500 # pixels, of the default version of an image
+COMPRESSED_IMAGE_WIDTHS = (250, 500, 1000) # pixels, of the versions listed in its srcset
+COMPRESSED_IMAGE_SIZES = f"(max-width: {COMPRESSED_IMAGE_WIDTH}px) 100vw, {COMPRESSED_IMAGE_WIDTH}px"
+
+# options of each format images can be compressed to (see `IMAGE_FORMATS`)
+IMAGE_FORMAT_OPTIONS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "avif": {"format": "AVIF", "quality": 60, "enc_params": {"speed": "8"}},
+}
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+#Enable Pillow plugin to support HEIC (and AVIF) images
 register_heif_opener() 
+register_avif_opener()
+
+# EXIF orientations that swap the width and height of an image
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+def image_stem(file_name: str) -> str:
+    '''
+    Name of the image a file belongs to (see `ImageVariants.file_name`)
+    '''
+    return os.path.splitext(file_name)[0].split("_", 1)[0]
+
+def image_widths(width: int) -> List[int]:
+    '''
+    Widths of the compressed versions of an image `width` pixels wide (never wider than it)
+    '''
+    return sorted({min(compressed_width, width) for compressed_width in COMPRESSED_IMAGE_WIDTHS})
+
+@dataclass
+class ImageVariants:
+    '''
+    Compressed versions of an image, in each of `formats` (most preferred first)
+    and at each of `widths`
+    '''
+    name: str
+    widths: List[int]
+    formats: Tuple[str, ...]
+
+    def file_name(self, format: str, width: int) -> str:
+        return f"{self.name}_{width}w.{format}"
+
+    def file_names(self) -> List[str]:
+        return [self.file_name(format, width) for format in self.formats for width in self.widths]
+
+    def url(self, format: str, width: int) -> str:
+        return BASE_IMAGE_URL + self.file_name(format, width)
+
+    def srcset(self, format: str) -> str:
+        return ", ".join(f"{self.url(format, width)} {width}w" for width in self.widths)
+
+    @property
+    def src(self) -> str:
+        '''
+        URL of the default version, for browsers without srcset support
+        '''
+        width = max([width for width in self.widths if width <= COMPRESSED_IMAGE_WIDTH] or self.widths[:1])
+        return self.url(self.formats[-1], width)
+
+    def html(self, img_tag: str, cid: str) -> str:
+        '''
+        Point an <img> tag with `src="cid:{cid}"` to the compressed versions,
+        wrapping it in a <picture> if there are several formats
+        '''
+        img_tag = img_tag.replace(
+            f'src="cid:{cid}"',
+            f'src="{self.src}" srcset="{self.srcset(self.formats[-1])}" sizes="{COMPRESSED_IMAGE_SIZES}" loading="lazy"',
+        )
+        if len(self.formats) == 1:
+            return img_tag
+        sources = "".join(
+            f'<source type="{mimetypes.types_map["." + format]}" srcset="{self.srcset(format)}" sizes="{COMPRESSED_IMAGE_SIZES}">'
+            for format in self.formats[:-1]
+        )
+        return f"<picture>{sources}{img_tag}</picture>"
+
+def open_image(fp) -> Tuple[Image.Image, List[int]]:
+    '''
+    Open an image, only reading its headers
+
+    Returns the image, and the widths of its compressed versions
+    '''
+    img = Image.open(fp)
+    width, height = img.size
+    if img.getexif().get(ExifTags.Base.Orientation) in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return img, image_widths(width)
+
+def decode_image(img: Image.Image, width: int) -> Image.Image:
+    '''
+    Decode an image opened with `open_image`, upright, and in a mode every
+    format can save
+
+    JPEGs are only decoded at the smallest scale that is still at least
+    `width` pixels wide (see `Image.draft`), which is much faster for photos.
+    '''
+    height = img.size[1] * width // img.size[0]
+    if img.getexif().get(ExifTags.Base.Orientation) in _TRANSPOSED_ORIENTATIONS:
+        img.draft("RGB", (height, width))
+    else:
+        img.draft("RGB", (width, height))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        transparent = "A" in img.getbands() or "transparency" in img.info
+        img = img.convert("RGBA" if transparent else "RGB")
+    return img
+
+def compress_image(img: Image.Image, widths: List[int], image_path) -> List[str]:
+    '''
+    Resize an image (opened with `open_image`) to each of `widths` (keeping
+    aspect ratio), and save each version in each of `IMAGE_FORMATS`, to
+    `image_path(format, width)`
+
+    Returns the paths of the compressed versions
+    '''
+    img = decode_image(img, widths[-1])
+    paths = []
+    # from the largest version down, each resized from the previous one
+    for width in reversed(widths):
+        if width != img.size[0]:
+            height = max(1, round(img.size[1] * width / img.size[0]))
+            img = img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for format in IMAGE_FORMATS:
+            path = image_path(format, width)
+            # write then rename, so that a partial image is never served
+            img.save(path + ".tmp", **IMAGE_FORMAT_OPTIONS[format])
+            os.replace(path + ".tmp", path)
+            paths.append(path)
+    return paths
+
+# Images waiting to be compressed by `image_worker.py` are saved in the pending
+# area under the name of their compressed versions (with the extension of their
+# content type instead), and those that failed to be compressed in `failed/`
+FAILED_IMAGE_PATH = PENDING_IMAGE_PATH + "failed/"
+
+def save_pending_image(original_image: str, content_type: str) -> ImageVariants:
+    '''
+    Given a base64 encoding of an image, save the decoded image to the pending
+    area, to be compressed later by `image_worker.py`.
 
-def generate_image_name():
-    name = f"{uuid.uuid1()}.png"
-    return name
+    Images are named after a hash of their decoded bytes, so that the same
+    image sent in many emails is only stored and compressed once: nothing is
+    saved if it already was.
 
-def check_duplicate(image_path):
-    return os.path.exists(image_path)
+    The image is decoded without ever holding much more than
+    `IMAGE_MEMORY_CAP` bytes of it in memory (see `Base64Spool`).
 
-def compress_image_and_save(original_image: str) -> str:
+    Returns the compressed versions the image will have (see `find_image` until then)
     '''
-    Given a base64 encoding of an image, resize the image such that it is 500 x * pixels in size
-    (keeping aspect ratio), and compress it using Pillow's `optimize` and `quality` flags.
+    with Base64Spool(PENDING_IMAGE_PATH, IMAGE_MEMORY_CAP) as spool:
+        spool.write(original_image)
+        spool.close_payload()
+        variants = _save_pending_image(spool, content_type)
+    return variants
+
+def _save_pending_image(spool: Base64Spool, content_type: str) -> ImageVariants:
+    image_name = spool.hexdigest()
+    try:
+        widths = open_image(spool.reader())[1]
+    except Exception:
+        widths = image_widths(COMPRESSED_IMAGE_WIDTH) # served as is, see `compress_pending_image`
+    variants = ImageVariants(image_name, widths, tuple(IMAGE_FORMATS))
+
+    # if the image was already saved, keep it from being collected as garbage
+    # before the event is added (see `image_worker.collect_garbage`); if it is
+    # collected in the meantime, it is saved again
+    try:
+        if compressed_image_exists(variants):
+            for file_name in variants.file_names():
+                os.utime(LOCAL_IMAGE_PATH + file_name)
+            return variants
+        original_path = find_image(image_name)[0]
+        if original_path is not None: # pending, or failed to be compressed
+            os.utime(original_path)
+            return variants
+    except FileNotFoundError:
+        pass
+
+    # moved atomically, so that the image worker never reads a partial image
+    os.makedirs(PENDING_IMAGE_PATH, exist_ok=True)
+    extension = mimetypes.guess_extension(content_type) or ".img"
+    spool.persist(PENDING_IMAGE_PATH + image_name + extension)
+    return variants
+
+def compressed_image_exists(variants: ImageVariants) -> bool:
+    return all(os.path.isfile(LOCAL_IMAGE_PATH + file_name) for file_name in variants.file_names())
+
+def list_pending_images() -> List[str]:
+    '''
+    Paths of the images waiting to be compressed, oldest first (not the
+    images being written, nor dotfiles, e.g. the lock of `image_worker.py`)
+    '''
+    try:
+        entries = list(os.scandir(PENDING_IMAGE_PATH))
+    except FileNotFoundError:
+        return []
+    entries = [
+        entry for entry in entries
+        if entry.is_file() and not entry.name.endswith(".tmp") and not entry.name.startswith(".")
+    ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    return [entry.path for entry in entries]
+
+def compress_pending_image(pending_path: str) -> List[str]:
+    '''
+    Compress an image of the pending area (unless it already was), and remove
+    it from there. Images that cannot be compressed are moved to the failed
+    area instead.
 
-    Returns url of the image
+    Returns paths of the compressed versions of the image
+    '''
+    image_name, _ = os.path.splitext(os.path.basename(pending_path))
+    try:
+        with open(pending_path, "rb") as f:
+            img, widths = open_image(f)
+            variants = ImageVariants(image_name, widths, tuple(IMAGE_FORMATS))
+            if compressed_image_exists(variants):
+                paths = [LOCAL_IMAGE_PATH + file_name for file_name in variants.file_names()]
+            else:
+                paths = compress_image(img, widths, lambda format, width: LOCAL_IMAGE_PATH + variants.file_name(format, width))
+    except Exception:
+        os.makedirs(FAILED_IMAGE_PATH, exist_ok=True)
+        os.replace(pending_path, FAILED_IMAGE_PATH + os.path.basename(pending_path))
+        raise
+    os.remove(pending_path)
+    return paths
+
+def find_image(image_name: str) -> Tuple[Optional[str], bool]:
     '''
-    img = Image.open(BytesIO(base64.b64decode(original_image)))
-    #Calculate new image size
-    wpercent = (COMPRESSED_IMAGE_WIDTH/float(img.size[0]))
-    hsize = int((float(img.size[1])*float(wpercent)))
-    # Resize the image
-    img = img.resize((COMPRESSED_IMAGE_WIDTH,hsize), Image.Resampling.LANCZOS)
-    # Generate a unique name for the image using uuid1
-    image_name = generate_image_name()
+    Find the file to serve for an image url (see `ImageVariants`): the
+    compressed version if it is ready, or else the original of the image.
+
+    Returns the path of the file (or None if there is none), and whether it is
+    the compressed version
+    '''
+    if os.path.basename(image_name) != image_name or image_name.startswith("."):
+        return None, False
     image_path = LOCAL_IMAGE_PATH + image_name
-    while check_duplicate(image_path):
-        image_name = generate_image_name()
-        image_path = LOCAL_IMAGE_PATH + image_name
-    img.save(image_path, optimize=True, quality=80, format='PNG')
-    return BASE_IMAGE_URL+image_name
+    if os.path.isfile(image_path):
+        return image_path, True
+
+    stem = image_stem(image_name)
+    for directory in (PENDING_IMAGE_PATH, FAILED_IMAGE_PATH):
+        try:
+            for entry in os.scandir(directory):
+                if entry.is_file() and os.path.splitext(entry.name)[0] == stem:
+                    return entry.path, False
+        except FileNotFoundError:
+            pass
+    return None, False
+
+def list_image_files() -> List[os.DirEntry]:
+    '''
+    Every image file: compressed, pending, or that failed to be compressed
+    '''
+    files = []
+    for directory in (LOCAL_IMAGE_PATH, PENDING_IMAGE_PATH, FAILED_IMAGE_PATH):
+        try:
+            files.extend(entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith("."))
+        except FileNotFoundError:
+            pass
+    return files
+
+# URLs of images in HTML content, e.g. ".../images/<name>_500w.webp" (or ".../images/<uuid>.png" before)
+_IMAGE_URL_PATTERN = re.compile(r"/images/([\w-]+?)(?:_\d+w)?\.\w+\b")
+
+def find_image_names(html: str) -> List[str]:
+    '''
+    Names of the images the HTML content of an email points to
+    '''
+    return list(dict.fromkeys(_IMAGE_URL_PATTERN.findall(html)))
 
 
 # raised when the email could not be parsed
@@ -123,7 +367,7 @@ def html2text(html: str) -> str:
     parser.feed(html)
     return parser.get_text()
 
-@dataclass
+@dataclass(slots=True)
 class EmailAddress:
     username: str
     domain: str
@@ -151,6 +395,13 @@ _parser_email_address = Parser[EmailAddress](
 class Email:
     """Represents a digested email
 
+    The derived fields (``plaintext``, ``color``, ``dormspam``, ``when``,
+    ``location_matches``, ``locations`` and ``categories``) are computed
+    lazily on first access and memoized on the instance, so reading them
+    repeatedly never re-runs ``html2text`` or the regex parsers. Use
+    ``is_computed`` to check whether a derived field has already been
+    computed, or ``digest`` to compute all of them at once.
+
     Attributes:
         sent: When the email was sent
         sender: By whom the email was sent
@@ -159,6 +410,7 @@ class Email:
         content: Dictionary mapping the supported content types to what was found in the email
         to: Who the email was sent to, if anyone.
         message_id: Universal ID of the email.
+        images: Names of the images inserted in the HTML content (see ``ImageVariants``).
     """
     sent: datetime.datetime
     sender: Contact
@@ -167,8 +419,12 @@ class Email:
     content: dict[str, str]
     to: Optional[Contact]
     message_id: str
+    images: List[str] = field(default_factory=list)
 
-    @property
+    # memoized fields, computed from the ones above
+    DERIVED_FIELDS = ("plaintext", "color", "dormspam", "when", "location_matches", "locations", "categories")
+
+    @cached_property
     def plaintext(self) -> str:
         if "text/plain" in self.content:
             return self.content["text/plain"]
@@ -176,30 +432,98 @@ class Email:
             return html2text(self.content["text/html"])
         return ""
 
-    @property
+    @cached_property
     def dormspam(self) -> bool:
         return bool(self.color)
 
-    @property
+    @cached_property
     def color(self) -> Optional[str]:
         search = re.search(DORMSPAM_PATTERN, self.plaintext, flags=re.IGNORECASE)
         if search:
             return search.group(DORMSPAM_PATTERN_COLOR_GROUP)
         return None
 
-    @property
+    @cached_property
     def when(self) -> EventTime:
         return parse_event_time(self.plaintext, today=self.sent.date())
 
-    @property
+    @cached_property
+    def location_matches(self) -> List[LocationMatch]:
+        return find_locations(self.plaintext)
+
+    @cached_property
     def locations(self) -> Set[str]:
-        return parse_locations(self.plaintext)
+        return set(match.location for match in self.location_matches)
 
-    @property
+    @cached_property
     def categories(self) -> Set[int]:
         text = f"{self.thread_topic or self.subject}\n\n{self.plaintext}"
         return parse_categories(text)
 
+    def is_computed(self, field: str) -> bool:
+        """Whether the derived field ``field`` was already computed
+        """
+        assert field in self.DERIVED_FIELDS, f"{field!r} is not a derived field"
+        return field in self.__dict__
+
+    def digest(self) -> "Email":
+        """Compute every derived field in a single pass, and return itself
+        """
+        for field in self.DERIVED_FIELDS:
+            getattr(self, field)
+        return self
+
+    def summarize(self) -> "EventSummary":
+        """Summarize what is needed to add the event of this email
+        """
+        location = None
+        if self.location_matches: # the first location mentioned
+            location = self.location_matches[0].location
+        html = self.content.get("text/html", None)
+        return EventSummary(
+            message_id=self.message_id,
+            sender=str(self.sender.email).lower(),
+            title=self.thread_topic or self.subject,
+            plaintext=compress_text(self.plaintext),
+            html=None if html is None else compress_text(html),
+            categories=sorted(self.categories),
+            location=location,
+            when=self.when,
+            sent=self.sent,
+            images=list(self.images),
+        )
+
+@dataclass
+class EventSummary:
+    """What is needed to add the event of a digested email to the database
+
+    Unlike ``Email``, it only holds plain values, so it is cheap to pickle
+    (e.g. to send it back from a worker process). The descriptions are
+    compressed, like they are stored (see ``utils.compressed_text``).
+
+    Attributes:
+        message_id: Universal ID of the email.
+        sender: Email address of the sender, lowercased.
+        title: Thread topic of the email, or its subject.
+        plaintext: Plaintext content of the email, compressed.
+        html: HTML content of the email, compressed, if any.
+        categories: Categories of the event.
+        location: First location mentioned, if any.
+        when: When the event happens.
+        sent: When the email was sent.
+        images: Names of the images inserted in the HTML content.
+    """
+    message_id: str
+    sender: str
+    title: str
+    plaintext: bytes
+    html: Optional[bytes]
+    categories: List[int]
+    location: Optional[str]
+    when: EventTime
+    sent: datetime.datetime
+    images: List[str]
+
 def nibble(header_name: str, header_data: Any, headers_not_found: Optional[list[str]]=None) -> Any:
     """Digest a single header from the email
     """
@@ -222,20 +546,19 @@ def parse_date(date: str) -> datetime.datetime:
 
 ContactsType = list[tuple[str,str]]
 
-def eat(raw) -> Email:
-    """Digest a raw email
+def _eat_message(email: mailparser.MailParser) -> Email:
+    """Digest the headers and the text content of a parsed email
 
     Raises:
         EmailMissingHeaders: if some headers could not be parsed
     """
-    email = mailparser.parse_from_string(raw)
-    assert(isinstance(email, mailparser.MailParser))
-
     # keep track of what couldn't be found
     headers_not_found: list[str] = []
 
     # eat it one bite at a time
-    email_sent_date = email.date.replace(tzinfo=ZoneInfo("UTC")).astimezone(ZoneInfo('America/New_York')) #For consistency, we want all our timestamps be in EST
+    email_sent_date = None
+    if email.date is not None:
+        email_sent_date = email.date.replace(tzinfo=ZoneInfo("UTC")).astimezone(ZoneInfo('America/New_York')) #For consistency, we want all our timestamps be in EST
     
     message_id: str               = nibble("Message-ID", email.message_id, headers_not_found)
     sent:       datetime.datetime = nibble(      "Date", email_sent_date,  headers_not_found)
@@ -269,7 +592,7 @@ def eat(raw) -> Email:
     if first_to_name or first_to_email:
         to_contact = Contact(_parser_email_address(first_to_email), first_to_name)
 
-    # parse email body, and process inserted images
+    # parse email body (inserted images are processed separately)
     content = {}
 
     if email.text_plain:
@@ -282,16 +605,6 @@ def eat(raw) -> Email:
 
     if email.text_html:
         content["text/html"] = email.text_html[0]
-        for attachment in email.attachments:
-            if cid := attachment["content-id"].strip("<>"):
-                cte = attachment.get("content_transfer_encoding") or "base64"
-                before = f'src="cid:{cid}"'
-                payload_fixed = attachment["payload"].replace("\n","")
-                #Proceed to compress and save if attachment is an image
-                if 'mail_content_type' in attachment and attachment['mail_content_type'].startswith("image/"):
-                    payload_image_url = compress_image_and_save(payload_fixed)
-                    after = f'''src="{payload_image_url}"'''
-                    content["text/html"] = content["text/html"].replace(before, after) #change the cid with the basic c4 encoding of the image
 
     return Email(
         sent=sent,
@@ -303,6 +616,142 @@ def eat(raw) -> Email:
         message_id=message_id,
     )
 
+def _eat_images(email: mailparser.MailParser, parsed: Email) -> None:
+    """Save the images inserted in the HTML content of the email to be compressed
+    in the background, and point the HTML to where they will be
+    """
+    if "text/html" not in parsed.content:
+        return
+
+    for attachment in email.attachments:
+        if cid := attachment["content-id"].strip("<>"):
+            cte = attachment.get("content_transfer_encoding") or "base64"
+            before = f'src="cid:{cid}"'
+            #Proceed to save (to be compressed) if attachment is an image
+            if 'mail_content_type' in attachment and attachment['mail_content_type'].startswith("image/"):
+                variants = save_pending_image(attachment["payload"], attachment['mail_content_type'])
+                if variants.name not in parsed.images:
+                    parsed.images.append(variants.name)
+                img_tag = re.compile(r'<img\b[^>]*?' + re.escape(before) + r'[^>]*>', re.IGNORECASE)
+                content = img_tag.sub(lambda match: variants.html(match.group(0), cid), parsed.content["text/html"])
+                parsed.content["text/html"] = content.replace(before, f'src="{variants.src}"') #change the cid with the url of the compressed image
+
+def eat(raw) -> Email:
+    """Digest a raw email
+
+    Raises:
+        EmailMissingHeaders: if some headers could not be parsed
+    """
+    email = mailparser.parse_from_string(raw)
+    assert(isinstance(email, mailparser.MailParser))
+
+    parsed = _eat_message(email)
+    _eat_images(email, parsed)
+    return parsed
+
+# only emails sent from these domains are accepted as dormspam
+ACCEPTED_SENDER_DOMAINS = ("mit.edu",) # could be improved?
+
+@dataclass
+class Stage:
+    """How a stage of ``eat_in_stages`` went
+
+    Attributes:
+        name: Name of the stage.
+        seconds: How long the stage took.
+        rejection: Why the stage rejected the email, if it did.
+    """
+    name: str
+    seconds: float
+    rejection: Optional[str] = None
+
+@dataclass
+class Digestion:
+    """Outcome of ``eat_in_stages``
+
+    Attributes:
+        email: The digested email, if it was accepted.
+        stages: Report of each stage that ran, in order.
+    """
+    email: Optional[Email]
+    stages: List[Stage]
+
+    @property
+    def rejection(self) -> Optional[str]:
+        """Why the email was rejected, if it was
+        """
+        return self.stages[-1].rejection if self.stages else None
+
+    @property
+    def accepted(self) -> bool:
+        return self.email is not None
+
+    def report(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "rejection": self.rejection,
+            "stages": [stage.__dict__.copy() for stage in self.stages],
+        }
+
+def eat_in_stages(raw) -> Digestion:
+    """Digest a raw email, but only as far as needed to reject it
+
+    The stages run from cheapest to most expensive, and stop at the first one
+    that rejects the email:
+
+    1. ``sender``: only the headers are parsed, to check the sender's domain.
+    2. ``message``: the whole email is parsed, besides its attachments.
+    3. ``dormspam``: the plaintext is checked for the dormspam footer.
+    4. ``images``: inserted images are saved, to be compressed in the background.
+
+    Raises:
+        EmailMissingHeaders: if some headers could not be parsed
+    """
+    stages: List[Stage] = []
+    def stage(name: str, start: float, rejection: Optional[str]=None) -> Digestion:
+        stages.append(Stage(name, time.perf_counter() - start, rejection))
+        return Digestion(None, stages)
+
+    start = time.perf_counter()
+    headers = email_parser.HeaderParser().parsestr(raw)
+    _, sender = email_utils.parseaddr(headers.get("From", ""))
+    domain = sender.rpartition("@")[-1].lower()
+    if domain not in ACCEPTED_SENDER_DOMAINS:
+        return stage("sender", start, f"sender {sender!r} is not from an accepted domain")
+    stage("sender", start)
+
+    start = time.perf_counter()
+    email = mailparser.parse_from_string(raw)
+    assert(isinstance(email, mailparser.MailParser))
+    parsed = _eat_message(email)
+    if parsed.sender.email.domain.lower() not in ACCEPTED_SENDER_DOMAINS:
+        return stage("message", start, f"sender {str(parsed.sender.email)!r} is not from an accepted domain")
+    stage("message", start)
+
+    start = time.perf_counter()
+    if not parsed.dormspam:
+        return stage("dormspam", start, "no dormspam footer found")
+    stage("dormspam", start)
+
+    start = time.perf_counter()
+    _eat_images(email, parsed)
+    stage("images", start)
+
+    return Digestion(parsed, stages)
+
+def eat_and_summarize(raw) -> Tuple[dict, Optional[EventSummary]]:
+    """Digest a raw email with ``eat_in_stages``, but only return its report,
+    and the summary of its event if it was accepted
+
+    Both are small and picklable, unlike the digested email itself.
+
+    Raises:
+        EmailMissingHeaders: if some headers could not be parsed
+    """
+    digestion = eat_in_stages(raw)
+    summary = digestion.email.summarize() if digestion.email is not None else None
+    return digestion.report(), summary
+
 if __name__ == "__main__":
     raw = sys.stdin.read()
     parsed_email = eat(raw)
@@ -310,10 +759,7 @@ if __name__ == "__main__":
     for k, v in parsed_email.__dict__.items():
         print(f"   {k!r} -> {v!r}")
 
-    print(f"   'color' -> {parsed_email.color!r}")
-    print(f"   'dormspam' -> {parsed_email.dormspam!r}")
-    print(f"   'when' -> {parsed_email.when!r}")
-    print(f"   'locations' -> {parsed_email.locations!r}")
-    print(f"   'categories' -> {parsed_email.categories!r}")
+    for field in Email.DERIVED_FIELDS:
+        print(f"   {field!r} -> {getattr(parsed_email, field)!r}")
 
     pass
@@ -0,0 +1,156 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, Generic, Iterable, Iterator, List, Optional, Tuple, TypeVar
+A = TypeVar("A")
+
+import re
+
+from .parser import FLAGS
+
+# a single word character, as understood by the regex `\b`
+_WORD_CHAR = re.compile(r"\w")
+
+@dataclass(slots=True)
+class KeywordMatch(Generic[A]):
+    """A keyword found in some text
+
+    Attributes:
+        start: Offset of the first character of the match in the text.
+        end: Offset right after the last character of the match in the text.
+        keyword: The keyword that was matched, as it was given to the automaton.
+        values: The values associated to the keyword.
+    """
+    start: int
+    end: int
+    keyword: str
+    values: Tuple[A, ...]
+
+@dataclass(slots=True)
+class _Node(Generic[A]):
+    children: Dict[str, _Node[A]] = field(default_factory=dict)
+    keyword: Optional[str] = None # set if a keyword ends at this node
+    values: List[A] = field(default_factory=list)
+
+class KeywordAutomaton(Generic[A]):
+    """Finds many keywords at once, in a single scan of the text
+
+    The keywords are case-folded into a trie, which is compiled once into a
+    single regex shaped like the trie. Scanning is then done by the regex
+    engine in one pass, instead of once per keyword, and the trie is only
+    walked (in Python) at the few offsets where a keyword was found.
+
+    Example: ::
+
+        >>> automaton = KeywordAutomaton([("boba", 1), ("bubble tea", 1), ("tea", 2)])
+        >>> [match.keyword for match in automaton.iter("Boba (bubble tea)!")]
+        ['boba', 'bubble tea', 'tea']
+        >>> [match.keyword for match in automaton.iter_longest("Boba (bubble tea)!")]
+        ['boba', 'bubble tea']
+        >>>
+
+    Args:
+        keywords: Pairs of keywords and the value associated to them. A
+            keyword can be given more than once, with different values.
+        word_boundaries: Whether keywords must match whole words only (like
+            surrounding them with ``\\b`` in a regex).
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, A]], word_boundaries: bool=True) -> None:
+        self.word_boundaries = word_boundaries
+        self.root: _Node[A] = _Node()
+        for keyword, value in keywords:
+            if not keyword: continue
+            node = self.root
+            for char in keyword.lower():
+                node = node.children.setdefault(char, _Node())
+            if node.keyword is None:
+                node.keyword = keyword
+            if value not in node.values:
+                node.values.append(value)
+
+        pattern = self._root_pattern()
+        # consumes the leftmost-longest keyword at each match
+        self.regex = re.compile(pattern, flags=FLAGS)
+        # finds the longest keyword at every offset, even overlapping ones
+        self.regex_overlapping = re.compile(f"(?=({pattern}))", flags=FLAGS)
+
+    def _root_pattern(self) -> str:
+        """Compile the whole trie into a regex
+
+        The regex starts with a lookahead for the first character of any
+        keyword, which lets the regex engine skip quickly through the text.
+        """
+        if not self.root.children:
+            return "(?!)" # no keywords at all, never matches
+
+        first_chars = "".join(re.escape(char) for char in self.root.children)
+        # keywords starting with a word character must also start a word
+        word_alternatives, other_alternatives = [], []
+        for char, child in self.root.children.items():
+            alternative = re.escape(char) + self._pattern(child, char)
+            if self.word_boundaries and _WORD_CHAR.match(char):
+                word_alternatives.append(alternative)
+            else:
+                other_alternatives.append(alternative)
+
+        alternatives = other_alternatives
+        if word_alternatives:
+            alternatives = [rf"(?<!\w)(?:{'|'.join(word_alternatives)})"] + alternatives
+        return f"(?=[{first_chars}])(?:{'|'.join(alternatives)})"
+
+    def _pattern(self, node: _Node[A], char: str) -> str:
+        """Compile the trie under ``node`` (reached by ``char``) into a regex
+
+        Children are tried before the end of a keyword, so that the regex
+        always prefers the longest keyword.
+        """
+        alternatives = [
+            re.escape(next_char) + self._pattern(child, next_char)
+            for next_char, child in node.children.items()
+        ]
+        if node.keyword is not None:
+            alternatives.append(r"(?!\w)" if self.word_boundaries and _WORD_CHAR.match(char) else "")
+
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return f"(?:{'|'.join(alternatives)})"
+
+    def _at_boundary(self, text: str, end: int) -> bool:
+        """Whether a keyword ending right before ``end`` ends a word
+        """
+        if not self.word_boundaries or not _WORD_CHAR.match(text, end - 1):
+            return True
+        return not _WORD_CHAR.match(text, end)
+
+    def _walk(self, text: str, start: int, end: int) -> Iterator[Tuple[int, _Node[A]]]:
+        """Walk down the trie along ``text[start:end]``, yielding every node
+        """
+        node: Optional[_Node[A]] = self.root
+        for i in range(start, end):
+            node = node.children.get(text[i].lower())
+            if node is None: return # the regex folded case differently
+            yield i + 1, node
+
+    def iter(self, text: str) -> Iterator[KeywordMatch[A]]:
+        """Iterate through every keyword found, including overlapping ones
+
+        Matches are ordered by their start offset, then by their length.
+        """
+        for candidate in self.regex_overlapping.finditer(text):
+            start, longest = candidate.span(1)
+            # every shorter keyword at this offset is a prefix of the longest
+            for end, node in self._walk(text, start, longest):
+                if node.keyword is not None and (end == longest or self._at_boundary(text, end)):
+                    yield KeywordMatch(start, end, node.keyword, tuple(node.values))
+
+    def iter_longest(self, text: str) -> Iterator[KeywordMatch[A]]:
+        """Iterate through the leftmost-longest keywords found
+
+        Matches never overlap: a keyword that is part of a longer one that was
+        found (e.g. "Kresge" in "Kresge Auditorium") is not reported.
+        """
+        for match in self.regex.finditer(text):
+            start, longest = match.span()
+            for end, node in self._walk(text, start, longest):
+                if end == longest and node.keyword is not None:
+                    yield KeywordMatch(start, end, node.keyword, tuple(node.values))
@@ -1,8 +1,9 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Set
+from typing import List, Set
 
 from .parser import Parser, ParserChain
+from .keyword_automaton import KeywordAutomaton
 
 LOCATIONS = [
    "Baker Dining", "Baker D",
@@ -28,7 +29,7 @@ LOCATIONS = [
    "Media Lab",
 ]
 
-@dataclass
+@dataclass(slots=True)
 class BldgRoom:
    bldg: str
    room: str
@@ -46,7 +47,7 @@ _parser_bldg_room = Parser[BldgRoom](
 
 _parser_stata_bldg_room = Parser[BldgRoom](
    BldgRoom,
-   fr"\b32[-–][GD]{ROOM}\b",
+   r"\b(?P<bldg>32)[-–](?P<room>[GD][0-9][0-9][0-9])\b",
    [str, str],
 )
 
@@ -58,14 +59,48 @@ LOCATION_PARSER_CHAIN = ParserChain[BldgRoom, str](
    lambda parsed: str(parsed)
 )
 
-def parse_locations(text: str) -> Set[str]:
-   """Early iteration of a location parser
+# case-folded index of all known locations, built once
+LOCATION_AUTOMATON = KeywordAutomaton[str]((location, location) for location in LOCATIONS)
+
+@dataclass(slots=True)
+class LocationMatch:
+   """A location found in some text, and where it was found
+   """
+   start: int
+   end: int
+   location: str
+
+def find_locations(text: str) -> List[LocationMatch]:
+   """Find all locations in the text, ordered by where they were found
+
+   Known locations and building-room numbers are both searched for. Longer
+   matches are preferred, and matches never overlap: "Kresge Auditorium" is
+   reported instead of "Kresge", and "E51-315" instead of "E51".
 
    Args:
       text: The body of text to search for locations.
    """
-   locations = set(loc for loc in LOCATIONS if loc.lower() in text.lower())
-   locations |= set(LOCATION_PARSER_CHAIN.iter(text))
+   matches = [
+      LocationMatch(match.start, match.end, match.keyword)
+      for match in LOCATION_AUTOMATON.iter_longest(text)
+   ]
+   for match, parsed in LOCATION_PARSER_CHAIN.iter_matches(text):
+      location = LOCATION_PARSER_CHAIN.formatter(parsed)
+      matches.append(LocationMatch(match.start(), match.end(), location))
+   matches.sort(key=lambda match: (match.start, -(match.end - match.start)))
+
+   locations: List[LocationMatch] = []
+   for match in matches:
+      if locations and match.start < locations[-1].end:
+         continue # overlaps a longer or earlier match
+      locations.append(match)
 
    return locations
 
+def parse_locations(text: str) -> Set[str]:
+   """Early iteration of a location parser
+
+   Args:
+      text: The body of text to search for locations.
+   """
+   return set(match.location for match in find_locations(text))
@@ -1,7 +1,8 @@
 from __future__ import annotations
 from dataclasses import dataclass
+from itertools import tee
 from typing import (
-    Callable, Generator, Iterator, Tuple, List, Dict, Any,
+    Callable, Generator, Iterator, Iterable, Tuple, List, Dict, Any,
     Optional, Union, Final, Generic, TypeVar,
 )
 A = TypeVar("A")
@@ -9,6 +10,20 @@ B = TypeVar("B")
 
 import re
 
+# all parsers match case-insensitively
+FLAGS: Final[int] = re.IGNORECASE
+
+# named groups (and their backreferences) in a pattern
+_NAMED_GROUP_PATTERN = re.compile(r"\(\?P(?P<kind>[<=])(?P<name>\w+)")
+
+def _prefix_named_groups(pattern: str, prefix: str) -> str:
+    """Rename every named group ``name`` in ``pattern`` to ``prefix + name``
+    """
+    return _NAMED_GROUP_PATTERN.sub(
+        lambda match: f"(?P{match['kind']}{prefix}{match['name']}",
+        pattern,
+    )
+
 @dataclass
 class Parser(Generic[A]):
     """Represents a regex parser to extract info from text
@@ -17,6 +32,8 @@ class Parser(Generic[A]):
     (``text``) to attempt the parsing. If successful, it returns the parsed
     data as the ``NamedTuple`` type. Otherwise returns `None`.
 
+    The pattern is compiled once, when the parser is constructed.
+
     Attributes:
         output: The type of the parsed output, if successful.
         pattern: The regex pattern to search for. The respective regex named
@@ -38,29 +55,49 @@ class Parser(Generic[A]):
             self.annotations = self.output.__origin__.__annotations__
         assert self.annotations, \
             f"original output type {self.output!r} must have type annotations"
+        self.regex = re.compile(self.pattern, flags=FLAGS)
+        self.fields = list(zip(self.annotations, self.subparsers))
 
-    def iter(self, text: str) -> Iterator[A]:
-        """Iterate through all matches found
+    def parse_match(self, match: re.Match, prefix: str="") -> Optional[A]:
+        """Build the output from a match of this parser's pattern
+
+        Args:
+            match: The regex match to parse.
+            prefix: Prefix of the named groups in the match, if the pattern
+                was merged into a larger one (see ``ParserChain``).
         """
-        for match in re.finditer(self.pattern, text, flags=re.IGNORECASE):
-            groups = match.groupdict()
-            kwargs = {}
-            successfully_parsed = True
-            for i, name in enumerate(self.annotations):
-                value = self.subparsers[i](groups[name])
-                if value is None:
-                    successfully_parsed = False
-                    break
-                kwargs[name] = value
-            if not successfully_parsed: continue
-
-            parsed = self.output(**kwargs)
-            parsed = self.tweak(parsed)
+        kwargs = {}
+        for name, subparser in self.fields:
+            value = subparser(match.group(prefix + name))
+            if value is None:
+                return None
+            kwargs[name] = value
+
+        return self.tweak(self.output(**kwargs))
+
+    def iter_matches(self, text: str, matches: Optional[Iterable[re.Match]]=None) -> Iterator[Tuple[re.Match, A]]:
+        """Iterate through all matches found, along with their parsed output
+
+        Args:
+            text: The body of text to search.
+            matches: Matches of this parser's pattern in ``text``, if they were
+                already scanned for.
+        """
+        if matches is None:
+            matches = self.regex.finditer(text)
+        for match in matches:
+            parsed = self.parse_match(match)
             if parsed is not None:
-                yield parsed
+                yield match, parsed
 
         return None
 
+    def iter(self, text: str, matches: Optional[Iterable[re.Match]]=None) -> Iterator[A]:
+        """Iterate through all matches found
+        """
+        for _, parsed in self.iter_matches(text, matches):
+            yield parsed
+
     def __call__(self, text: str) -> Optional[A]:
         """Return first match
         """
@@ -73,15 +110,78 @@ class Parser(Generic[A]):
 
 @dataclass
 class ParserChain(Generic[A, B]):
+    """Runs a list of parsers, in order, and formats what they found
+
+    Parsers that share an identical pattern are matched only once per text:
+    the matches are scanned once and shared between those parsers.
+
+    With ``merge`` set, all the patterns are instead merged into a single
+    alternation that is scanned once, and each match is dispatched to the
+    parsers of the branch that matched. Matches are then found in text order
+    (rather than parser order) and cannot overlap, so only merge chains whose
+    patterns do not overlap, or whose caller does not depend on the order.
+
+    Attributes:
+        parsers: The parsers to run, by order of priority.
+        formatter: Function to call on the parsed output of any of the parsers.
+        merge: Whether to merge the parsers into a single alternation scan.
+    """
     parsers: List[Parser]
     formatter: Callable[[A], B]
+    merge: bool = False
+
+    def __post_init__(self) -> None:
+        # parsers sharing the same pattern, in order of priority
+        self.parsers_by_pattern: Dict[str, List[Parser]] = {}
+        for parser in self.parsers:
+            self.parsers_by_pattern.setdefault(parser.pattern, []).append(parser)
+
+        # merged alternation, with one named branch per distinct pattern
+        self.branches: Dict[str, List[Parser]] = {}
+        self.regex: Optional[re.Pattern] = None
+        if self.merge:
+            alternatives = []
+            for i, (pattern, parsers) in enumerate(self.parsers_by_pattern.items()):
+                branch = f"_{i}"
+                self.branches[branch] = parsers
+                alternatives.append(f"(?P<{branch}>{_prefix_named_groups(pattern, branch)})")
+            self.regex = re.compile("|".join(alternatives), flags=FLAGS)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[re.Match, A]]:
+        """Iterate through all matches found, along with their parsed output
+        (before formatting)
+        """
+        if self.regex is not None:
+            for match in self.regex.finditer(text):
+                # the branch group encloses the others, so it is closed last
+                branch = match.lastgroup
+                for parser in self.branches[branch]:
+                    parsed = parser.parse_match(match, prefix=branch)
+                    if parsed is not None:
+                        yield match, parsed
+            return None
+
+        shared: Dict[str, Iterator[Iterator[re.Match]]] = {}
+        for parser in self.parsers:
+            sharing = len(self.parsers_by_pattern[parser.pattern])
+            if sharing == 1:
+                yield from parser.iter_matches(text)
+                continue
+            if parser.pattern not in shared:
+                shared[parser.pattern] = iter(tee(parser.regex.finditer(text), sharing))
+            yield from parser.iter_matches(text, matches=next(shared[parser.pattern]))
+
+    def iter_parsed(self, text: str) -> Iterator[A]:
+        """Iterate through all parsed outputs found, before formatting
+        """
+        for _, parsed in self.iter_matches(text):
+            yield parsed
 
     def iter(self, text: str, **kwargs) -> Iterator[B]:
         """Iterate through all matches found
         """
-        for parser in self.parsers:
-            for parsed in parser.iter(text):
-                yield self.formatter(parsed, **kwargs)
+        for parsed in self.iter_parsed(text):
+            yield self.formatter(parsed, **kwargs)
 
     def __call__(self, text: str, **kwargs) -> Optional[B]:
         """Return first match
@@ -1,17 +1,17 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Tuple, Dict, Optional, Union, Final, Generic, TypeVar
+from typing import Any, Callable, Iterator, List, Tuple, Dict, Optional, Union, Final, TypeVar
 A = TypeVar("A")
 B = TypeVar("B")
 
 import datetime
-
-from .parser import Parser, ParserChain
+import enum
+import re
 
 TODAY = datetime.date.today()
 
 #
-# Date parsers
+# Dates
 #
 
 # non-numerical names for months or hours
@@ -34,36 +34,18 @@ HOURS: Final[Dict[str, int]] = {
     "Midnight": 0,
 }
 
-@dataclass
+@dataclass(slots=True)
 class MonthNameDay:
     month_name: str
     day: int
 
-@dataclass
+@dataclass(slots=True)
 class MonthDay:
     month: int
     day: int
 
 Date = Union[MonthNameDay, MonthDay]
 
-_parser_month_name_day = Parser[MonthNameDay](
-    MonthNameDay,
-    r"\b(?P<month_name>\w+)\s+(?P<day>\d{1,2})\b",
-    [str, int],
-    lambda parsed: parsed if parsed.month_name.capitalize() in MONTHS else None,
-)
-_parser_day_month_name = Parser[MonthNameDay](
-    MonthNameDay,
-    r"\b(?P<day>\d{1,2})\s+(?P<month_name>\w+)\b",
-    [str, int],
-    lambda parsed: parsed if parsed.month_name.capitalize() in MONTHS else None,
-)
-_parser_month_day = Parser[MonthDay](
-    MonthDay,
-    r"\b(?P<month>\d{1,2})\/(?P<day>\d{1,2})\b",
-    [int, int],
-)
-
 def _format_month_name_day(parsed: MonthNameDay, *, today: datetime.date=TODAY) -> datetime.date:
     return datetime.date(
         today.year,
@@ -86,71 +68,21 @@ def format_date(parsed: Date, *, today: datetime.date=TODAY) -> datetime.date:
     possible_dates = [date.replace(year=date.year+offset) for offset in (-1, 0, 1)]
     return min(possible_dates, key=lambda dt: abs(dt - today).total_seconds())
 
-DATE_PARSER_CHAIN = ParserChain[Date, datetime.date](
-    [
-        _parser_month_name_day,
-        _parser_day_month_name,
-        _parser_month_day,
-    ],
-    format_date,
-)
-
 #
-# Time and time range parsers
+# Times
 #
 
-@dataclass
-class HourOnly:
-    hour: int
-
-@dataclass
-class HourMinute:
-    hour: int
-    minute: int
-
-@dataclass
+@dataclass(slots=True)
 class HourMinutePeriod:
     hour: int
     minute: int
-    period: str
+    period: Optional[str]
 
-@dataclass
+@dataclass(slots=True)
 class HourName:
     hour_name: str
 
-Time = Union[HourOnly, HourMinute, HourMinutePeriod, HourName]
-
-@dataclass
-class TimeRange(Generic[A, B]):
-    start: A
-    end: B
-
-HH = r"(?P<hour>\d{1,2})"                # h or hh
-MM = r"(?::(?P<minute>\d{2}))"           # :mm
-PERIOD = r"(?:(?P<period>a|p)\.?m?\.?)" # a, am, a.m.
-
-_parser_hour_only = Parser[HourOnly](HourOnly, fr"\b{HH}\b", [int])
-_parser_hour_period = Parser[HourMinutePeriod](
-    HourMinutePeriod,
-    fr"\b{HH}{MM}?\s*{PERIOD}\b",
-    [int, lambda mm: 0 if mm is None else int(mm), str],
-)
-_parser_hour_minute = Parser[HourMinutePeriod](
-    HourMinutePeriod,
-    fr"\b{HH}{MM}\s*{PERIOD}?\b",
-    [int, int, lambda period: "a" if period is None else str(period)],
-)
-_parser_hour_name = Parser[HourName](
-    HourName,
-    r"\b(?P<hour_name>noon|midnight)\b",
-    [lambda name: name.capitalize()],
-)
-
-def _format_hour_only(parsed: HourOnly) -> datetime.time:
-    return datetime.time(parsed.hour)
-
-def _format_hour_minute(parsed: HourMinute) -> datetime.time:
-    return datetime.time(parsed.hour, parsed.minute)
+Time = Union[HourMinutePeriod, HourName]
 
 def _format_hour_minute_period(parsed: HourMinutePeriod) -> datetime.time:
     h = parsed.hour
@@ -168,11 +100,9 @@ def _format_hour_minute_period(parsed: HourMinutePeriod) -> datetime.time:
     return datetime.time(h, m)
 
 def _format_hour_name(parsed: HourName) -> datetime.time:
-    return datetime.time(HOURS[parsed.hour_name])
+    return datetime.time(HOURS[parsed.hour_name.capitalize()])
 
 _time_formatters = {
-    HourOnly: _format_hour_only,
-    HourMinute: _format_hour_minute,
     HourMinutePeriod: _format_hour_minute_period,
     HourName: _format_hour_name,
 }
@@ -180,69 +110,203 @@ _time_formatters = {
 def format_time(parsed: Time) -> datetime.time:
     return _time_formatters[type(parsed)](parsed)
 
-TIME_PARSER_CHAIN = ParserChain(
-    [
-        _parser_hour_period,
-        _parser_hour_minute,
-        _parser_hour_name,
-    ],
-    format_time,
-)
+def _minutes(time: datetime.time) -> int:
+    return 60*time.hour + time.minute
 
-TIME_RANGE_PATTERN = r"\b(?P<start>\S+)\b\s*(?:[-–]|to|until)\s*\b(?P<end>\S+)\b"
+def _has_period(parsed: Time) -> bool:
+    """Whether the time is explicitly in the morning or in the afternoon
+    """
+    return isinstance(parsed, HourName) or parsed.period is not None
 
-def format_time_range(parsed: TimeRange) -> Tuple[datetime.time, datetime.time]:
-    return (
-        format_time(parsed.start),
-        format_time(parsed.end),
-    )
+def _with_period(parsed: Time, period: str) -> datetime.time:
+    return format_time(HourMinutePeriod(parsed.hour, parsed.minute, period))
 
-TIME_RANGE_PARSER_CHAIN = ParserChain[TimeRange, Tuple[datetime.time, datetime.time]](
-    [
-        Parser[TimeRange[HourOnly, HourMinutePeriod]]( # 10-10:30
-            TimeRange[HourOnly, HourMinutePeriod],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_only, _parser_hour_minute],
-        ),
-        Parser[TimeRange[HourMinutePeriod, HourOnly]]( # 10:30-11
-            TimeRange[HourMinutePeriod, HourOnly],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_minute, _parser_hour_only],
-        ),
-        Parser[TimeRange[HourMinutePeriod, HourMinutePeriod]]( # 10:00-11:00
-            TimeRange[HourMinutePeriod, HourMinutePeriod],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_minute, _parser_hour_minute],
-        ),
-        Parser[TimeRange[HourOnly, HourMinutePeriod]]( # 10-11am
-            TimeRange[HourOnly, HourMinutePeriod],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_only, _parser_hour_period],
-        ),
-        Parser[TimeRange[HourMinutePeriod, HourMinutePeriod]]( # 10am-11am
-            TimeRange[HourMinutePeriod, HourMinutePeriod],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_period, _parser_hour_period],
-        ),
-        Parser[TimeRange[HourMinutePeriod, HourMinutePeriod]]( # 10:30-11am
-            TimeRange[HourMinutePeriod, HourMinutePeriod],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_minute, _parser_hour_period],
-        ),
-        Parser[TimeRange[HourMinutePeriod, HourName]]( # 10:30-noon
-            TimeRange[HourMinutePeriod, HourName],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_minute, _parser_hour_name],
-        ),
-        Parser[TimeRange[HourMinutePeriod, HourName]]( # 10am-noon
-            TimeRange[HourMinutePeriod, HourName],
-            TIME_RANGE_PATTERN,
-            [_parser_hour_period, _parser_hour_name],
-        ),
-    ],
-    format_time_range,
+def format_time_range(start: Time, end: Time) -> Tuple[datetime.time, datetime.time]:
+    """Format both ends of a time range
+
+    If only one end states its period (am or pm), the other end takes the
+    period that puts it closest before (or after) that end, e.g. "1-4pm" is
+    from 1pm, and "11-1pm" is from 11am.
+    """
+    start_time, end_time = format_time(start), format_time(end)
+    # midnight ends the day, rather than starting it
+    end_minutes = _minutes(end_time) or 24*60
+
+    if _has_period(end) and not _has_period(start) and start.hour <= 12:
+        candidates = [_with_period(start, period) for period in "ap"]
+        candidates = [time for time in candidates if _minutes(time) <= end_minutes]
+        if candidates: start_time = max(candidates, key=_minutes)
+    elif _has_period(start) and not _has_period(end) and end.hour <= 12:
+        candidates = [_with_period(end, period) for period in "ap"]
+        candidates = [time for time in candidates if _minutes(time) >= _minutes(start_time)]
+        if candidates: end_time = min(candidates, key=_minutes)
+
+    return start_time, end_time
+
+#
+# Lexer
+#
+
+class TokenKind(enum.Enum):
+    MONTH = "month"         # March, Mar
+    DATE = "date"           # 3/17
+    ORDINAL = "ordinal"     # 17th
+    NUMBER = "number"       # 17, or a bare hour
+    TIME = "time"           # 4pm, 4:30, 4:30 p.m.
+    HOUR_NAME = "hour_name" # noon, midnight
+    RANGE_SEP = "range_sep" # -, to, until
+
+@dataclass(slots=True)
+class Token:
+    """A piece of text that may make up a date or a time
+
+    Attributes:
+        kind: What the token is.
+        start: Offset of the token in the text.
+        end: Offset right after the token in the text.
+        value: The month name (``str``) of a month, the number (``int``) of an
+            ordinal or a number, the parsed ``Date`` or ``Time`` of a date or a
+            time, and ``None`` for a range separator.
+    """
+    kind: TokenKind
+    start: int
+    end: int
+    value: Any = None
+
+HH = r"(?P<hour>\d{1,2})"                # h or hh
+MM = r"(?::(?P<minute>\d{2}))"           # :mm
+PERIOD = r"(?:(?P<period>a|p)\.?m?\.?)" # a, am, a.m.
+ORDINAL = r"(?P<ordinal>st|nd|rd|th)"   # 1st, 2nd, 3rd, 4th
+
+# every token starts with one of these, which lets the regex engine skip
+# quickly through the rest of the text
+_TOKEN_FIRST_CHARS = "".join(sorted(set(name[0].lower() for name in [*MONTHS, *HOURS, "to", "until"])))
+
+# each alternative is named after the kind of token it matches (numbers can
+# turn out to be ordinals, numbers or times)
+_TOKEN_PATTERN = re.compile(
+    fr"(?=[\d{_TOKEN_FIRST_CHARS}\-–])(?:(?<!\w)(?:" + "|".join([
+        fr"(?P<month>(?:{'|'.join(sorted(MONTHS, key=len, reverse=True))})\b)",
+        fr"(?P<hour_name>(?:{'|'.join(HOURS)})\b)",
+        r"(?P<date>(?P<date_month>\d{1,2})\/(?P<date_day>\d{1,2})\b)",
+        fr"(?P<number>{HH}(?:{ORDINAL}|{MM}?(?:\s*{PERIOD})?)\b)",
+        r"(?P<range_word>(?:to|until)\b)",
+    ]) + r")|(?P<range_sep>[-–]))",
+    flags=re.IGNORECASE,
 )
 
+def tokenize(text: str) -> Iterator[Token]:
+    """Split the text into the tokens making up dates and times, in one scan
+
+    Anything else in the text is skipped over.
+    """
+    for match in _TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        start, end = match.span()
+        if kind == "month":
+            yield Token(TokenKind.MONTH, start, end, match.group())
+        elif kind == "hour_name":
+            yield Token(TokenKind.HOUR_NAME, start, end, HourName(match.group().capitalize()))
+        elif kind == "date":
+            date = MonthDay(int(match.group("date_month")), int(match.group("date_day")))
+            yield Token(TokenKind.DATE, start, end, date)
+        elif kind == "number":
+            hour, minute, period = match.group("hour", "minute", "period")
+            if match.group("ordinal"):
+                yield Token(TokenKind.ORDINAL, start, end, int(hour))
+            elif minute is not None or period is not None:
+                time = HourMinutePeriod(int(hour), 0 if minute is None else int(minute), period)
+                yield Token(TokenKind.TIME, start, end, time)
+            else:
+                yield Token(TokenKind.NUMBER, start, end, int(hour))
+        else:
+            yield Token(TokenKind.RANGE_SEP, start, end)
+
+#
+# Grammar
+#
+# date        := MONTH (NUMBER | ORDINAL)     e.g. March 17, Mar 17th
+#              | (NUMBER | ORDINAL) MONTH     e.g. 17 Mar
+#              | DATE                         e.g. 3/17
+# time range  := hour RANGE_SEP hour          e.g. 10-11am, 10:30 to noon
+#                (at least one side being a TIME or a HOUR_NAME)
+# hour        := NUMBER | TIME | HOUR_NAME
+# time        := TIME | HOUR_NAME             e.g. 4pm, 4:30, noon
+#
+# Dates made of a month and a day only allow whitespace between them, and the
+# tokens of a time range only allow whitespace (if anything) between them.
+#
+
+_DAYS = (TokenKind.NUMBER, TokenKind.ORDINAL)
+_HOURS = (TokenKind.NUMBER, TokenKind.TIME, TokenKind.HOUR_NAME)
+
+def _as_time(token: Token) -> Time:
+    if token.kind == TokenKind.NUMBER:
+        return HourMinutePeriod(token.value, 0, None)
+    return token.value
+
+class _Grammar:
+    """Finds dates and times in the tokens of a text
+    """
+
+    def __init__(self, text: str, tokens: List[Token]) -> None:
+        self.text = text
+        self.tokens = tokens
+
+    def _adjacent(self, first: Token, second: Token, *, required: bool) -> bool:
+        """Whether only whitespace (if ``required``, at least some) separates
+        the two tokens
+        """
+        between = self.text[first.end:second.start]
+        return between.isspace() if required else (not between or between.isspace())
+
+    def _pairs(self) -> Iterator[Tuple[Token, Token]]:
+        return zip(self.tokens, self.tokens[1:])
+
+    def dates(self) -> Iterator[Date]:
+        """Iterate through all dates found, by order of preference
+        """
+        for month, day in self._pairs():
+            if month.kind == TokenKind.MONTH and day.kind in _DAYS \
+                    and self._adjacent(month, day, required=True):
+                yield MonthNameDay(month.value, day.value)
+        for day, month in self._pairs():
+            if day.kind in _DAYS and month.kind == TokenKind.MONTH \
+                    and self._adjacent(day, month, required=True):
+                yield MonthNameDay(month.value, day.value)
+        for date in self.tokens:
+            if date.kind == TokenKind.DATE:
+                yield date.value
+
+    def time_ranges(self) -> Iterator[Tuple[Time, Time]]:
+        """Iterate through all time ranges found, by order of preference
+        """
+        for start, sep, end in zip(self.tokens, self.tokens[1:], self.tokens[2:]):
+            if sep.kind != TokenKind.RANGE_SEP or start.kind not in _HOURS or end.kind not in _HOURS:
+                continue
+            if start.kind == end.kind == TokenKind.NUMBER:
+                continue # too ambiguous, e.g. "3-5 people"
+            if self._adjacent(start, sep, required=False) and self._adjacent(sep, end, required=False):
+                yield _as_time(start), _as_time(end)
+
+    def times(self) -> Iterator[Time]:
+        """Iterate through all times found, by order of preference
+        """
+        times = [token.value for token in self.tokens if token.kind == TokenKind.TIME]
+        yield from (time for time in times if time.period is not None)
+        yield from (time for time in times if time.period is None)
+        yield from (token.value for token in self.tokens if token.kind == TokenKind.HOUR_NAME)
+
+def _first_valid(parsed: Iterator[A], formatter: Callable[[A], B]) -> Optional[B]:
+    """Format the first parsed value that can be formatted (e.g. skip Feb 30)
+    """
+    for value in parsed:
+        try:
+            return formatter(value)
+        except ValueError:
+            continue
+    return None
+
 @dataclass
 class EventTime:
     """Represents a dormspam event start & end time
@@ -255,27 +319,21 @@ class EventTime:
 def parse_event_time(text: str, *, today: datetime.date=TODAY) -> EventTime:
     """Early iteration of an event time parser
 
-    It has room for improvement, but it works.
+    The text is tokenized in a single scan, and dates and times are then
+    assembled from the tokens.
 
     Args:
         text: The body of text to search for event times.
     """
+    grammar = _Grammar(text, list(tokenize(text)))
+
     # search for event date
-    try:
-        date = DATE_PARSER_CHAIN(text, today=today)
-    except ValueError:
-        date = None
+    date = _first_valid(grammar.dates(), lambda date: format_date(date, today=today))
 
     # search for event times
-    try:
-        time_range = TIME_RANGE_PARSER_CHAIN(text)
-    except ValueError:
-        time_range = None
+    time_range = _first_valid(grammar.time_ranges(), lambda time_range: format_time_range(*time_range))
     if time_range is None:
-        try:
-            start_time = TIME_PARSER_CHAIN(text)
-        except ValueError:
-            start_time = None
+        start_time = _first_valid(grammar.times(), format_time)
         end_time = None
     else:
         start_time, end_time = time_range
@@ -290,4 +348,4 @@ def parse_event_time(text: str, *, today: datetime.date=TODAY) -> EventTime:
 if __name__ == "__main__":
     text = "It's from 8am-noon on March 17!"
     print(text)
-    print(parse_event_time(text))
\ No newline at end of file
+    print(parse_event_time(text))